@@ -11,6 +11,8 @@ from typing import Optional, Dict, Any
 from dotenv import load_dotenv
 import logging
 
+from profiling import timed
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -49,13 +51,14 @@ class JWTHandler:
         """
         try:
             # 解码JWT Token
-            payload = jwt.decode(
-                token, 
-                JWT_SECRET, 
-                algorithms=[JWT_ALGORITHM],
-                # 验证Token的有效期
-                options={"verify_exp": True, "verify_iat": True}
-            )
+            with timed("jwt"):
+                payload = jwt.decode(
+                    token, 
+                    JWT_SECRET, 
+                    algorithms=[JWT_ALGORITHM],
+                    # 验证Token的有效期
+                    options={"verify_exp": True, "verify_iat": True}
+                )
             
             # 检查Token是否过期
             exp = payload.get('exp')
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+响应序列化基准测试
+比较便签列表页（20/100条）在不同序列化路径下的耗时
+
+- jsonable_encoder + json：未声明 response_model 时 FastAPI 的默认路径
+- response_model + orjson：pydantic-core 校验/序列化后由 orjson 编码
+- orjson 直出：已是JSON安全的数据直接编码（高频读接口返回 FastJSONResponse 的当前路径）
+
+用法:
+    python bench_serialization.py [--repeat 200]
+"""
+
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from schemas import ApiResponse, PostListData, dumps
+
+
+def make_page(size: int) -> Dict[str, Any]:
+    """构造与 get_posts_list 返回结构一致的列表页"""
+    now = datetime.utcnow()
+    posts: List[Dict[str, Any]] = []
+    for i in range(size):
+        posts.append({
+            "id": str(uuid.uuid4()),
+            "user_id": str(uuid.uuid4()),
+            "content": "今天下班路上看到了很美的晚霞，心情一下子就变好了。" * 3,
+            "image_url": f"https://example.com/images/{i}.jpg",
+            "audio_url": None,
+            "location_data": {
+                "name": "人民广场",
+                "formatted_address": "上海市黄浦区人民大道200号",
+                "coordinates": {"latitude": 31.2304, "longitude": 121.4737},
+            },
+            "weather_data": {
+                "location_name": "Shanghai",
+                "temperature": {"current": 24.5, "feels_like": 25.1, "min": 20.0, "max": 27.0, "unit": "celsius"},
+                "weather": {"main_condition": "Clear", "description": "晴", "icon_code": "01d"},
+                "humidity_percent": 60,
+                "wind": {"speed_mps": 3.1, "direction_deg": 120},
+                "pressure_hpa": 1012,
+                "visibility_km": 10.0,
+            },
+            "likes_count": i * 3,
+            "comments_count": i,
+            "rewards_count": i % 5,
+            "rewards_amount": float(i % 5),
+            "created_at": (now - timedelta(minutes=i)).isoformat() + "+00:00",
+            "user_profiles": {"nickname": f"用户{i}", "avatar_url": None},
+        })
+    return {
+        "success": True,
+        "data": {
+            "posts": posts,
+            "pagination": {"page": 1, "limit": size, "total": 1000, "pages": (1000 + size - 1) // size},
+        },
+        "message": "便签列表获取成功",
+    }
+
+
+def bench(fn: Callable[[], bytes], repeat: int) -> float:
+    """返回单次调用的平均耗时（毫秒）"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="响应序列化基准测试")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    adapter = TypeAdapter(ApiResponse[PostListData])
+
+    paths = {
+        "jsonable_encoder + json": lambda page: json.dumps(
+            jsonable_encoder(page), ensure_ascii=False
+        ).encode("utf-8"),
+        "response_model + orjson": lambda page: dumps(
+            adapter.dump_python(adapter.validate_python(page), mode="json", exclude_unset=True)
+        ),
+        "orjson 直出": lambda page: dumps(page),
+    }
+
+    print(f"{'路径':<28}{'20条 (ms)':>12}{'100条 (ms)':>12}{'100条大小 (KB)':>16}")
+    for name, encode in paths.items():
+        results = []
+        for size in (20, 100):
+            page = make_page(size)
+            results.append(bench(lambda: encode(page), args.repeat))
+        size_kb = len(encode(make_page(100))) / 1024
+        print(f"{name:<28}{results[0]:>12.3f}{results[1]:>12.3f}{size_kb:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
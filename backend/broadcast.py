@@ -0,0 +1,217 @@
+"""
+实时推送模块
+进程内的发布/订阅中心，为 SSE 和 WebSocket 连接推送新便签、点赞和评论
+"""
+
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+import logging
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 心跳间隔（秒）和每个连接的最大积压事件数
+HEARTBEAT_SECONDS = float(os.getenv("REALTIME_HEARTBEAT_SECONDS", "25"))
+MAX_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+# 单个连接最多订阅的主题数
+MAX_TOPICS_PER_CONNECTION = 50
+
+# 全站动态主题；单个便签的主题为 "post:<post_id>"
+FEED_TOPIC = "feed"
+
+# 事件帧：(事件名, 已编码的JSON数据)
+Frame = Tuple[str, str]
+
+
+def post_topic(post_id: str) -> str:
+    """单个便签的订阅主题"""
+    return f"post:{post_id}"
+
+
+def parse_topics(raw: Iterable[str]) -> List[str]:
+    """
+    解析并校验客户端请求的主题列表
+
+    支持逗号分隔，只允许 "feed" 和 "post:<id>" 两类主题
+
+    Raises:
+        ValueError: 主题格式不正确或数量超限
+    """
+    topics: List[str] = []
+    for item in raw:
+        for topic in item.split(","):
+            topic = topic.strip()
+            if not topic:
+                continue
+            if topic != FEED_TOPIC and not (topic.startswith("post:") and len(topic) > 5):
+                raise ValueError(f"不支持的订阅主题: {topic}")
+            if topic not in topics:
+                topics.append(topic)
+    if len(topics) > MAX_TOPICS_PER_CONNECTION:
+        raise ValueError(f"订阅主题数量不能超过 {MAX_TOPICS_PER_CONNECTION}")
+    return topics or [FEED_TOPIC]
+
+
+def format_sse(frame: Frame) -> str:
+    """编码为 Server-Sent Events 帧"""
+    event, data = frame
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def format_ws(frame: Frame) -> str:
+    """编码为 WebSocket 文本消息"""
+    event, data = frame
+    return f'{{"event":"{event}","data":{data}}}'
+
+
+class Subscription:
+    """
+    单个连接的订阅状态
+
+    每个连接持有一个有界队列：
+    - 普通事件按顺序入队，积压超过上限时清空队列并只下发一次 resync 事件，
+      由客户端重新拉取，避免慢连接无限占用内存
+    - 点赞数更新按 post_id 合并，只保留最新值
+    """
+
+    __slots__ = ("topics", "max_queue", "_queue", "_coalesced", "_wakeup", "_lagged", "dropped")
+
+    def __init__(self, topics: Iterable[str], max_queue: int = MAX_QUEUE_SIZE):
+        self.topics: Set[str] = set(topics)
+        self.max_queue = max_queue
+        self._queue: Deque[Frame] = deque()
+        self._coalesced: Dict[str, Frame] = {}
+        self._wakeup = asyncio.Event()
+        self._lagged = False
+        self.dropped = 0
+
+    def push(self, frame: Frame, coalesce_key: Optional[str] = None) -> None:
+        """投递事件（在事件循环线程中调用，不会阻塞）"""
+        if self._lagged:
+            # 已经需要全量刷新，后续增量事件没有意义
+            self.dropped += 1
+            return
+
+        if coalesce_key is not None and coalesce_key in self._coalesced:
+            # 同一便签的点赞数尚未下发，直接覆盖为最新值
+            self._coalesced[coalesce_key] = frame
+            return
+
+        if len(self._queue) + len(self._coalesced) >= self.max_queue:
+            # 背压：客户端消费太慢，丢弃积压并要求其重新同步
+            self.dropped += len(self._queue) + len(self._coalesced) + 1
+            self._queue.clear()
+            self._coalesced.clear()
+            self._lagged = True
+        elif coalesce_key is not None:
+            self._coalesced[coalesce_key] = frame
+        else:
+            self._queue.append(frame)
+        self._wakeup.set()
+
+    async def next_batch(self, timeout: float = HEARTBEAT_SECONDS) -> Optional[List[Frame]]:
+        """
+        等待并取出所有待发送事件
+
+        Returns:
+            事件列表；超时没有事件时返回 None（调用方应发送心跳）
+        """
+        if not self._wakeup.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        self._wakeup.clear()
+        if self._lagged:
+            self._lagged = False
+            return [("resync", '{"reason":"lagged"}')]
+
+        frames = list(self._queue)
+        frames.extend(self._coalesced.values())
+        self._queue.clear()
+        self._coalesced.clear()
+        return frames
+
+
+class BroadcastHub:
+    """进程内发布/订阅中心"""
+
+    def __init__(self):
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self.connections = 0
+        self.published = 0
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        """创建订阅"""
+        subscription = Subscription(topics)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        self.connections += 1
+        return subscription
+
+    def update_topics(self, subscription: Subscription, add: Iterable[str] = (), remove: Iterable[str] = ()) -> None:
+        """修改已有订阅的主题"""
+        for topic in remove:
+            subscription.topics.discard(topic)
+            self._discard(topic, subscription)
+        for topic in add:
+            if len(subscription.topics) >= MAX_TOPICS_PER_CONNECTION:
+                break
+            subscription.topics.add(topic)
+            self._topics.setdefault(topic, set()).add(subscription)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """取消订阅"""
+        for topic in subscription.topics:
+            self._discard(topic, subscription)
+        self.connections -= 1
+
+    def _discard(self, topic: str, subscription: Subscription) -> None:
+        subscribers = self._topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._topics[topic]
+
+    def publish(self, topics: Iterable[str], event: str, data: Dict[str, Any], coalesce_key: Optional[str] = None) -> int:
+        """
+        向多个主题发布事件
+
+        数据只编码一次；同时订阅多个主题的连接只会收到一次
+
+        Returns:
+            int: 收到事件的连接数
+        """
+        receivers: Set[Subscription] = set()
+        for topic in topics:
+            subscribers = self._topics.get(topic)
+            if subscribers:
+                receivers.update(subscribers)
+        if not receivers:
+            return 0
+
+        frame = (event, json.dumps(data, ensure_ascii=False, default=str, separators=(",", ":")))
+        for subscription in receivers:
+            subscription.push(frame, coalesce_key)
+        self.published += 1
+        return len(receivers)
+
+    def stats(self) -> Dict[str, int]:
+        """连接与主题统计"""
+        return {
+            "connections": self.connections,
+            "topics": len(self._topics),
+            "published": self.published,
+        }
+
+
+# 创建全局广播中心实例
+broadcast_hub = BroadcastHub()
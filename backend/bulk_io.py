@@ -0,0 +1,421 @@
+"""
+便签批量导入/导出模块
+以 NDJSON / CSV 流式读写便签数据，用于数据迁移、备份和预发环境灌数
+
+- 导入：逐行解析并用 Pydantic 模型校验，按批次（默认2000行）写入，
+  每批成功后记录检查点，中断后可从检查点继续
+- 导出：按 (created_at, id) 键集分页读取，内存占用与数据总量无关
+
+命令行用法:
+    python bulk_io.py import posts.ndjson --checkpoint import.ckpt
+    python bulk_io.py export posts.csv --batch-size 5000
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Type
+import logging
+
+from pydantic import BaseModel, ValidationError
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 默认批次大小
+DEFAULT_BATCH_SIZE = 2000
+# 最多保留的错误明细条数
+MAX_ERROR_SAMPLES = 100
+
+# 导出字段（也是CSV表头）
+EXPORT_COLUMNS = [
+    'id', 'user_id', 'content', 'image_url', 'audio_url', 'location_data', 'weather_data',
+    'likes_count', 'comments_count', 'rewards_count', 'rewards_amount', 'is_deleted', 'created_at',
+]
+# CSV中以JSON字符串存储的字段
+JSON_COLUMNS = {'location_data', 'weather_data'}
+
+SUPPORTED_FORMATS = ('ndjson', 'csv')
+
+
+def detect_format(path: str) -> str:
+    """根据文件扩展名推断格式"""
+    suffix = Path(path).suffix.lower()
+    if suffix in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    if suffix == '.csv':
+        return 'csv'
+    raise ValueError(f"无法识别的文件格式: {path}，请使用 --format 指定")
+
+
+# ================================
+# 解析与编码
+# ================================
+
+def iter_ndjson(stream: TextIO) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+    """逐行解析NDJSON，产出 (行号, 数据)；空行跳过，无法解析的行数据为 None"""
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except json.JSONDecodeError:
+            yield line_no, None
+
+
+def iter_csv(stream: TextIO) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+    """逐行解析CSV，空字符串视为空值，JSON字段反序列化；无法解析的行数据为 None"""
+    reader = csv.DictReader(stream)
+    for line_no, row in enumerate(reader, start=2):
+        record: Optional[Dict[str, Any]] = {}
+        for key, value in row.items():
+            if value == '' or value is None:
+                continue
+            if key in JSON_COLUMNS:
+                try:
+                    value = json.loads(value)
+                except json.JSONDecodeError:
+                    record = None
+                    break
+            record[key] = value
+        yield line_no, record
+
+
+def iter_records(stream: TextIO, fmt: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+    """按格式解析输入流"""
+    if fmt == 'ndjson':
+        return iter_ndjson(stream)
+    if fmt == 'csv':
+        return iter_csv(stream)
+    raise ValueError(f"不支持的格式: {fmt}")
+
+
+def encode_ndjson(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """编码为NDJSON行"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, default=str) + '\n'
+
+
+def encode_csv(rows: Iterable[Dict[str, Any]], include_header: bool = True) -> Iterator[str]:
+    """编码为CSV行，JSON字段序列化为字符串"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+    if include_header:
+        writer.writeheader()
+    for row in rows:
+        writer.writerow({
+            key: json.dumps(value, ensure_ascii=False) if key in JSON_COLUMNS and value is not None else value
+            for key, value in row.items()
+        })
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # 没有数据行时只输出表头
+        yield buffer.getvalue()
+
+
+def encode_records(rows: Iterable[Dict[str, Any]], fmt: str, include_header: bool = True) -> Iterator[str]:
+    """按格式编码输出"""
+    if fmt == 'ndjson':
+        return encode_ndjson(rows)
+    if fmt == 'csv':
+        return encode_csv(rows, include_header)
+    raise ValueError(f"不支持的格式: {fmt}")
+
+
+# ================================
+# 检查点与统计
+# ================================
+
+class Checkpoint:
+    """检查点文件，记录已完成的进度（导入为行数，导出为游标）"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = Path(path) if path else None
+
+    def load(self) -> Dict[str, Any]:
+        if self.path and self.path.exists():
+            return json.loads(self.path.read_text(encoding='utf-8'))
+        return {}
+
+    def save(self, state: Dict[str, Any]) -> None:
+        if not self.path:
+            return
+        # 先写临时文件再替换，避免中断时留下损坏的检查点
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp_path.write_text(json.dumps(state, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+
+    def clear(self) -> None:
+        if self.path and self.path.exists():
+            self.path.unlink()
+
+
+class BulkStats:
+    """批量任务统计"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.processed = 0
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self.batches = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def add_error(self, line_no: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_ERROR_SAMPLES:
+            self.errors.append({'line': line_no, 'error': message})
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.processed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'rows_done': self.skipped + self.processed,
+            'processed': self.processed,
+            'written': self.written,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'batches': self.batches,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'errors': self.errors,
+        }
+
+
+# ================================
+# 导入
+# ================================
+
+class PostImporter:
+    """
+    便签批量导入器
+
+    Args:
+        client: Supabase客户端
+        model: 校验用的Pydantic模型（至少包含 PostCreate 的字段）
+        batch_size: 每批写入的行数
+        checkpoint_path: 检查点文件路径，为空则不可续传
+    """
+
+    def __init__(
+        self,
+        client,
+        model: Type[BaseModel],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        checkpoint_path: Optional[str] = None,
+        on_batch: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ):
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.on_batch = on_batch
+
+    def _write_batch(self, rows: List[Dict[str, Any]]) -> int:
+        """
+        写入一批数据
+
+        - 带ID的行重复导入时忽略，保证续传幂等
+        - 不回传写入的行（returning=minimal），只取影响行数
+        - 缺失字段使用列默认值而不是NULL（default_to_null=False）
+        """
+        with_id = [row for row in rows if row.get('id')]
+        without_id = [row for row in rows if not row.get('id')]
+        written = 0
+        if with_id:
+            response = self.client.table('posts').upsert(
+                with_id, on_conflict='id', ignore_duplicates=True,
+                count='exact', returning='minimal', default_to_null=False
+            ).execute()
+            written += response.count or 0
+        if without_id:
+            response = self.client.table('posts').insert(
+                without_id, count='exact', returning='minimal', default_to_null=False
+            ).execute()
+            written += response.count or 0
+        return written
+
+    def run(self, records: Iterable[Tuple[int, Optional[Dict[str, Any]]]], skip_rows: Optional[int] = None) -> BulkStats:
+        """
+        执行导入，返回统计信息
+
+        Args:
+            records: (行号, 数据) 序列
+            skip_rows: 跳过前N行；为空时从检查点读取
+        """
+        stats = BulkStats()
+        resume_after = skip_rows if skip_rows is not None else int(self.checkpoint.load().get('rows_done', 0))
+        if resume_after:
+            logger.info(f"从检查点继续导入，跳过前 {resume_after} 行")
+
+        batch: List[Dict[str, Any]] = []
+        rows_seen = 0
+
+        def flush():
+            if batch:
+                stats.written += self._write_batch(batch)
+                stats.batches += 1
+                if self.on_batch:
+                    self.on_batch(batch)
+                batch.clear()
+            self.checkpoint.save({'rows_done': rows_seen})
+            logger.info(
+                f"已处理 {stats.processed} 行，写入 {stats.written} 行，"
+                f"失败 {stats.failed} 行，{stats.rows_per_second:.0f} 行/秒"
+            )
+
+        for line_no, record in records:
+            rows_seen += 1
+            if rows_seen <= resume_after:
+                stats.skipped += 1
+                continue
+            stats.processed += 1
+            if not isinstance(record, dict):
+                stats.add_error(line_no, "无法解析的行")
+                continue
+            try:
+                row = self.model.model_validate(record).model_dump(mode='json', exclude_none=True)
+            except ValidationError as e:
+                stats.add_error(line_no, str(e.errors()[0].get('msg', e)))
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                flush()
+
+        flush()
+        return stats
+
+
+# ================================
+# 导出
+# ================================
+
+def parse_export_cursor(created_at: Any, row_id: Any) -> Dict[str, str]:
+    """
+    校验导出游标（校验后才能拼入PostgREST过滤条件，避免构造出任意表达式）
+
+    Raises:
+        ValueError: created_at 不是ISO时间或 id 不是UUID
+    """
+    try:
+        datetime.fromisoformat(created_at)
+        uuid.UUID(row_id)
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError(f"导出游标不合法: {created_at!r}, {row_id!r}")
+    return {'created_at': created_at, 'id': row_id}
+
+
+def iter_posts(
+    client,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    cursor: Optional[Dict[str, str]] = None,
+    include_deleted: bool = False,
+    on_page: Optional[Callable[[Dict[str, str]], None]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    按 (created_at, id) 升序键集分页读取便签，每页从索引 idx_posts_created_at_id 的游标位置开始扫描
+
+    Args:
+        cursor: 上次导出的最后一行 {'created_at', 'id'}，从其之后继续
+        on_page: 每页读取完成后回调最新游标（用于保存检查点）
+
+    Raises:
+        ValueError: 游标不合法
+    """
+    if cursor:
+        cursor = parse_export_cursor(cursor.get('created_at'), cursor.get('id'))
+    while True:
+        query = client.table('posts').select(', '.join(EXPORT_COLUMNS))
+        if not include_deleted:
+            query = query.eq('is_deleted', False)
+        if cursor:
+            # gte 给出索引扫描的起点，or 再排除起点上已导出的行
+            query = query.gte('created_at', cursor['created_at']).or_(
+                f'created_at.gt."{cursor["created_at"]}",'
+                f'and(created_at.eq."{cursor["created_at"]}",id.gt."{cursor["id"]}")'
+            )
+        rows = query.order('created_at').order('id').limit(batch_size).execute().data
+        if not rows:
+            return
+        yield from rows
+        cursor = {'created_at': rows[-1]['created_at'], 'id': rows[-1]['id']}
+        if on_page:
+            on_page(cursor)
+        if len(rows) < batch_size:
+            return
+
+
+# ================================
+# 命令行入口
+# ================================
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="便签批量导入/导出")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('path', help="输入/输出文件路径，'-' 表示标准输入/输出")
+    parser.add_argument('--format', choices=SUPPORTED_FORMATS, help="默认按扩展名推断")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--checkpoint', help="检查点文件路径，用于中断后续传")
+    parser.add_argument('--include-deleted', action='store_true', help="导出时包含已删除的便签")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.path)
+
+    # 复用应用的数据库连接和数据模型（会按 ENVIRONMENT 加载环境变量）
+    from main import supabase, PostImport
+
+    if args.action == 'import':
+        importer = PostImporter(supabase, PostImport, args.batch_size, args.checkpoint)
+        stream = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8', newline='')
+        with stream:
+            stats = importer.run(iter_records(stream, fmt))
+        print(json.dumps(stats.to_dict(), ensure_ascii=False, indent=2))
+        return 1 if stats.failed else 0
+
+    checkpoint = Checkpoint(args.checkpoint)
+    cursor = checkpoint.load().get('cursor')
+    resuming = cursor is not None and args.path != '-'
+    stats = BulkStats()
+
+    def save_cursor(page_cursor):
+        stream.flush()
+        checkpoint.save({'cursor': page_cursor})
+        logger.info(f"已导出 {stats.processed} 行，{stats.rows_per_second:.0f} 行/秒")
+
+    def counted(rows):
+        for row in rows:
+            stats.processed += 1
+            yield row
+
+    stream = sys.stdout if args.path == '-' else open(args.path, 'a' if resuming else 'w', encoding='utf-8', newline='')
+    with stream:
+        rows = counted(iter_posts(supabase, args.batch_size, cursor, args.include_deleted, save_cursor))
+        for chunk in encode_records(rows, fmt, include_header=not resuming):
+            stream.write(chunk)
+    print(json.dumps(stats.to_dict(), ensure_ascii=False, indent=2), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+进程内缓存模块
+提供带过期时间的LRU缓存，用于缓存用户资料等读多写少的数据
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class TTLCache:
+    """
+    带过期时间的LRU缓存
+
+    - 超过 maxsize 时淘汰最久未使用的条目
+    - 过期条目在读取时惰性删除
+    - 只在事件循环线程中使用，不加锁
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取缓存，未命中或已过期返回 default"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_many(self, keys: Iterable[Hashable]) -> Tuple[Dict[Hashable, Any], List[Hashable]]:
+        """
+        批量读取缓存
+
+        Returns:
+            (命中的键值字典, 未命中的键列表)
+        """
+        found: Dict[Hashable, Any] = {}
+        missing: List[Hashable] = []
+        sentinel = object()
+        for key in keys:
+            value = self.get(key, sentinel)
+            if value is sentinel:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """写入缓存"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set_many(self, items: Dict[Hashable, Any]) -> None:
+        """批量写入缓存"""
+        for key, value in items.items():
+            self.set(key, value)
+
+    def delete(self, key: Hashable) -> None:
+        """删除单个缓存条目"""
+        self._data.pop(key, None)
+
+    def delete_many(self, keys: Iterable[Hashable]) -> None:
+        """批量删除缓存条目"""
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """缓存统计"""
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# 用户资料缓存（昵称、头像），资料更新时主动失效，其他 worker 通过 invalidation 模块收到失效通知
+profile_cache = TTLCache(
+    maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", "300")),
+)
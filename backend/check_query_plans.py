@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+查询计划回归检查
+在本地Postgres上灌入测试数据，对路由发出的每种读查询以及外键级联删除的查找执行 EXPLAIN，
+出现顺序扫描、没有使用预期索引或计划相对基线发生变化时以非零状态退出
+
+查询语句由 repository.AsyncpgRepository 生成（录制后再 EXPLAIN），与线上代码保持一致；
+PostgREST 后端发出的查询条件和排序相同，命中的索引也相同
+
+用法:
+    createdb little_joys_plans
+    psql little_joys_plans -f ../database/local_auth_stub.sql -f ../database/setup.sql
+    export DATABASE_URL=postgresql://localhost/little_joys_plans
+    python check_query_plans.py --seed                          # 首次运行灌入数据
+    python check_query_plans.py --baseline query_plans.json --update-baseline
+    python check_query_plans.py --baseline query_plans.json     # 之后每次修改SQL/索引后检查
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from repository import AsyncpgRepository, POST_FIELDS, COMMENT_FIELDS, SORT_HOTTEST
+from resilience import register_upstream
+
+# 不允许出现顺序扫描的表
+CHECKED_TABLES = {'posts', 'comments', 'likes', 'user_profiles'}
+# 数据量太小时规划器会优先选择顺序扫描，检查结果没有意义
+MIN_POSTS = 10000
+
+FEED_FIELDS = ['id', 'user_id', 'content', 'image_url', 'audio_url', 'location_data', 'weather_data',
+               'likes_count', 'comments_count', 'rewards_count', 'rewards_amount', 'created_at']
+COMPACT_FIELDS = ['id', 'user_id', 'content', 'location_name', 'weather_icon', 'likes_count', 'created_at']
+COMMENT_LIST_FIELDS = ['id', 'content', 'created_at', 'user_id']
+
+# 测试数据：触发器（计数、任务队列等）在灌数据期间关闭，需要本地超级用户
+SEED_STATEMENTS = [
+    "SET session_replication_role = replica",
+    "INSERT INTO auth.users (id) SELECT gen_random_uuid() FROM generate_series(1, $1::int)",
+    """
+    INSERT INTO user_profiles (id, nickname)
+    SELECT u.id, 'User_' || substr(u.id::text, 1, 8) FROM auth.users u
+    WHERE NOT EXISTS (SELECT 1 FROM user_profiles p WHERE p.id = u.id)
+    """,
+    """
+    INSERT INTO posts (user_id, content, location_data, weather_data, likes_count, is_deleted, created_at)
+    SELECT u.ids[1 + g % array_length(u.ids, 1)],
+           '测试便签 ' || g,
+           jsonb_build_object('name', '地点' || g % 100),
+           jsonb_build_object('weather', jsonb_build_object('icon_code', '01d')),
+           (random() * 200)::int,
+           random() < 0.05,
+           NOW() - g * INTERVAL '1 minute'
+    FROM generate_series(1, $1::int) g, (SELECT array_agg(id) AS ids FROM auth.users) u
+    """,
+    """
+    INSERT INTO comments (user_id, post_id, content, is_deleted, created_at)
+    SELECT u.ids[1 + g % array_length(u.ids, 1)],
+           p.ids[1 + (g * 7) % array_length(p.ids, 1)],
+           '评论 ' || g,
+           random() < 0.05,
+           NOW() - g * INTERVAL '1 second'
+    FROM generate_series(1, $1::int) g,
+         (SELECT array_agg(id) AS ids FROM auth.users) u,
+         (SELECT array_agg(id) AS ids FROM posts) p
+    """,
+    """
+    INSERT INTO likes (user_id, post_id)
+    SELECT u.ids[1 + g % array_length(u.ids, 1)], p.ids[1 + (g * 13) % array_length(p.ids, 1)]
+    FROM generate_series(1, $1::int) g,
+         (SELECT array_agg(id) AS ids FROM auth.users) u,
+         (SELECT array_agg(id) AS ids FROM posts) p
+    ON CONFLICT DO NOTHING
+    """,
+    "SET session_replication_role = DEFAULT",
+]
+
+
+async def seed(connection, users: int, posts: int, comments: int, likes: int) -> None:
+    counts = [None, users, None, posts, comments, likes, None]
+    async with connection.transaction():
+        for statement, count in zip(SEED_STATEMENTS, counts):
+            if count is None:
+                await connection.execute(statement)
+            else:
+                await connection.execute(statement, count)
+    await connection.execute("ANALYZE")
+    print(f"已灌入测试数据: {users}用户 {posts}便签 {comments}评论 {likes}点赞")
+
+
+class RecordingPool:
+    """代替连接池，只记录 AsyncpgRepository 发出的语句和参数"""
+
+    def __init__(self):
+        self.statements: List[Tuple[str, tuple]] = []
+
+    async def fetch(self, sql: str, *args):
+        self.statements.append((sql, args))
+        return []
+
+    async def fetchval(self, sql: str, *args):
+        self.statements.append((sql, args))
+        return 0
+
+
+class Samples:
+    """查询参数：从已有数据中挑选评论最多的便签、便签最多的用户等"""
+
+    post_id: str
+    user_id: str
+    post_ids: List[str]
+    user_ids: List[str]
+    after: Dict[str, str]
+
+    @classmethod
+    async def load(cls, connection) -> "Samples":
+        samples = cls()
+        samples.post_id = str(await connection.fetchval(
+            "SELECT post_id FROM comments WHERE is_deleted = FALSE GROUP BY post_id ORDER BY COUNT(*) DESC LIMIT 1"
+        ))
+        samples.user_id = str(await connection.fetchval(
+            "SELECT user_id FROM posts WHERE is_deleted = FALSE GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"
+        ))
+        samples.post_ids = [str(row['id']) for row in await connection.fetch(
+            "SELECT id FROM posts WHERE is_deleted = FALSE ORDER BY created_at DESC LIMIT 20"
+        )]
+        samples.user_ids = [str(row['id']) for row in await connection.fetch("SELECT id FROM user_profiles LIMIT 20")]
+        first = await connection.fetchrow(
+            "SELECT created_at, id FROM comments WHERE post_id = $1::uuid AND is_deleted = FALSE ORDER BY created_at, id LIMIT 1 OFFSET 10",
+            samples.post_id
+        )
+        samples.after = {'created_at': first['created_at'].isoformat(), 'id': str(first['id'])}
+        return samples
+
+
+# (名称, 调用数据访问层的函数, 预期使用的索引；None 表示只检查不出现顺序扫描)
+QueryShape = Tuple[str, Callable[[AsyncpgRepository, Samples], Any], Optional[str]]
+
+
+def cascade_lookup(table: str, column: str, sample: Callable[[Samples], str]) -> Callable[[AsyncpgRepository, Samples], Any]:
+    """
+    删除用户/便签时，外键的 ON DELETE CASCADE 按外键列查找引用行；这类查询不经过数据访问层，
+    直接录制等价的查询，确保外键列上有非部分索引（部分索引不能用于级联）
+    """
+    return lambda repo, s: repo.pool.fetch(f"SELECT 1 FROM ONLY {table} WHERE {column} = $1::uuid", sample(s))
+
+
+QUERY_SHAPES: List[QueryShape] = [
+    ("post_detail", lambda repo, s: repo.get_post(s.post_id, FEED_FIELDS, s.user_id), "posts_pkey"),
+    ("feed_latest", lambda repo, s: repo.list_posts(FEED_FIELDS, 0, 20), "idx_posts_live_created_at"),
+    ("feed_latest_compact", lambda repo, s: repo.list_posts(COMPACT_FIELDS, 200, 20), "idx_posts_live_created_at"),
+    ("feed_hottest", lambda repo, s: repo.list_posts(FEED_FIELDS, 0, 20, SORT_HOTTEST), "idx_posts_live_likes"),
+    ("user_posts", lambda repo, s: repo.list_posts(FEED_FIELDS, 0, 20, user_id=s.user_id), "idx_posts_live_user_created_at"),
+    ("count_posts", lambda repo, s: repo.count_posts(), None),
+    ("count_user_posts", lambda repo, s: repo.count_posts(s.user_id), "idx_posts_live_user_created_at"),
+    ("posts_by_ids", lambda repo, s: repo.get_posts_by_ids(s.post_ids, FEED_FIELDS), "posts_pkey"),
+    ("liked_post_ids", lambda repo, s: repo.get_liked_post_ids(s.user_id, s.post_ids), "likes_user_id_post_id_key"),
+    ("user_profiles", lambda repo, s: repo.get_user_profiles(s.user_ids), "user_profiles_pkey"),
+    ("comments_page", lambda repo, s: repo.list_comments(s.post_id, COMMENT_LIST_FIELDS, 11), "idx_comments_live_post_created_at"),
+    ("comments_cursor", lambda repo, s: repo.list_comments(s.post_id, COMMENT_LIST_FIELDS, 11, after=s.after), "idx_comments_live_post_created_at"),
+    ("count_comments", lambda repo, s: repo.count_comments(s.post_id), "idx_comments_live_post_created_at"),
+    ("comment_previews", lambda repo, s: repo.get_comment_previews(s.post_ids, 3), None),
+    ("cascade_user_posts", cascade_lookup('posts', 'user_id', lambda s: s.user_id), "idx_posts_user_id"),
+    ("cascade_post_comments", cascade_lookup('comments', 'post_id', lambda s: s.post_id), "idx_comments_post_id"),
+    ("cascade_user_comments", cascade_lookup('comments', 'user_id', lambda s: s.user_id), "idx_comments_user_id"),
+    ("cascade_post_likes", cascade_lookup('likes', 'post_id', lambda s: s.post_id), "idx_likes_post_id"),
+]
+
+
+def plan_nodes(plan: Dict[str, Any]) -> List[Dict[str, Optional[str]]]:
+    """按深度优先展开计划树：[{'node', 'relation', 'index'}]"""
+    nodes = [{
+        'node': plan.get('Node Type'),
+        'relation': plan.get('Relation Name'),
+        'index': plan.get('Index Name'),
+    }]
+    for child in plan.get('Plans', []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def check_plan(name: str, plan: Dict[str, Any], expected_index: Optional[str], baseline: Optional[Dict[str, Any]], cost_tolerance: float) -> List[str]:
+    """返回问题列表，为空表示通过"""
+    problems = []
+    nodes = plan_nodes(plan)
+    for node in nodes:
+        if node['node'] == 'Seq Scan' and node['relation'] in CHECKED_TABLES:
+            problems.append(f"{name}: 顺序扫描 {node['relation']}")
+    if expected_index and expected_index not in {node['index'] for node in nodes}:
+        used = sorted({node['index'] for node in nodes if node['index']})
+        problems.append(f"{name}: 未使用 {expected_index}（实际: {', '.join(used) or '无索引'}）")
+    if baseline:
+        if baseline['nodes'] != nodes:
+            problems.append(f"{name}: 计划结构与基线不同")
+        cost = plan.get('Total Cost', 0.0)
+        if cost > baseline['cost'] * (1 + cost_tolerance):
+            problems.append(f"{name}: 估算代价 {cost:.1f} 超过基线 {baseline['cost']:.1f}")
+    return problems
+
+
+async def explain_all(connection, samples: Samples) -> Dict[str, Dict[str, Any]]:
+    """录制每种查询的SQL并执行 EXPLAIN，返回 名称 -> 计划根节点"""
+    recorder = RecordingPool()
+    repo = AsyncpgRepository("recording", register_upstream('postgres', timeout=30, attempts=1))
+    repo.pool = recorder
+    plans = {}
+    for name, call, _ in QUERY_SHAPES:
+        recorder.statements.clear()
+        await call(repo, samples)
+        sql, args = recorder.statements[-1]
+        result = await connection.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+        plans[name] = json.loads(result)[0]['Plan']
+    return plans
+
+
+async def main(args) -> int:
+    dsn = args.dsn or os.getenv("DATABASE_URL")
+    if not dsn:
+        print("需要 --dsn 或 DATABASE_URL")
+        return 2
+
+    connection = await asyncpg.connect(dsn)
+    try:
+        if args.seed:
+            await seed(connection, args.users, args.posts, args.comments, args.likes)
+        post_count = await connection.fetchval("SELECT COUNT(*) FROM posts")
+        if post_count < MIN_POSTS:
+            print(f"posts 只有 {post_count} 行（至少需要 {MIN_POSTS}），请先使用 --seed 灌入数据")
+            return 2
+
+        samples = await Samples.load(connection)
+        plans = await explain_all(connection, samples)
+    finally:
+        await connection.close()
+
+    baseline: Dict[str, Any] = {}
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    problems = []
+    for name, _, expected_index in QUERY_SHAPES:
+        shape_problems = check_plan(name, plans[name], expected_index, baseline.get(name), args.cost_tolerance)
+        problems.extend(shape_problems)
+        status = "FAIL" if shape_problems else "ok"
+        print(f"{status:>4}  {name:<22} cost={plans[name].get('Total Cost', 0.0):>10.1f}  "
+              f"{', '.join(sorted({node['index'] for node in plan_nodes(plans[name]) if node['index']})) or '-'}")
+
+    if args.update_baseline and args.baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                name: {'nodes': plan_nodes(plan), 'cost': plan.get('Total Cost', 0.0)}
+                for name, plan in plans.items()
+            }, f, ensure_ascii=False, indent=2)
+        print(f"已更新基线: {args.baseline}")
+
+    if problems:
+        print("\n查询计划检查失败:")
+        for problem in problems:
+            print(f"  - {problem}")
+        return 1
+    print("\n全部查询计划检查通过")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="读查询的 EXPLAIN 回归检查")
+    parser.add_argument("--dsn", help="Postgres连接串，默认读取 DATABASE_URL")
+    parser.add_argument("--seed", action="store_true", help="先灌入测试数据")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--posts", type=int, default=50000)
+    parser.add_argument("--comments", type=int, default=200000)
+    parser.add_argument("--likes", type=int, default=100000)
+    parser.add_argument("--baseline", help="计划基线文件（JSON）")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖基线")
+    parser.add_argument("--cost-tolerance", type=float, default=0.5, help="估算代价相对基线允许的增幅")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,226 @@
+"""
+响应压缩模块
+按 Accept-Encoding 协商 brotli / zstd / gzip 压缩JSON和文本响应
+
+- 小于阈值或不在类型白名单内的响应原样返回
+- 可压缩类型的响应无论是否压缩都带 Vary: Accept-Encoding，避免共享缓存把未压缩版本发给支持压缩的客户端
+- 流式响应（SSE、批量导出）不缓冲、不压缩
+- 大响应在线程池中压缩，不阻塞事件循环
+- 压缩结果按 (编码, 内容摘要) 缓存，热门页面重复命中时不再重复压缩
+"""
+
+import asyncio
+import gzip
+import hashlib
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+
+from cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 可选依赖
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 可选依赖
+    zstandard = None
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 默认压缩阈值（字节），更小的响应压缩收益低于CPU开销
+DEFAULT_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# 超过该大小的响应放到线程池压缩
+DEFAULT_OFFLOAD_SIZE = int(os.getenv("COMPRESSION_OFFLOAD_SIZE", str(64 * 1024)))
+
+# 允许压缩的Content-Type前缀
+DEFAULT_CONTENT_TYPES = (
+    "application/json",
+    "text/plain",
+    "text/html",
+    "text/csv",
+    "application/x-ndjson",
+)
+# 即使在白名单内也不压缩的类型
+EXCLUDED_CONTENT_TYPES = ("text/event-stream",)
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+# 编码名 -> 压缩函数；按服务端偏好排序（同等q值时优先选前面的）
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=5)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _zstd_compress
+COMPRESSORS["gzip"] = lambda data: gzip.compress(data, compresslevel=6)
+
+
+def choose_encoding(accept_encoding: str, available: Iterable[str] = None) -> Optional[str]:
+    """
+    根据 Accept-Encoding 选择编码
+
+    Returns:
+        编码名；客户端不接受任何可用编码时返回 None
+    """
+    available = list(available if available is not None else COMPRESSORS)
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best: Optional[str] = None
+    best_q = 0.0
+    for name in available:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def _add_vary(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    """在响应头的 Vary 中加入 Accept-Encoding（合并已有的 Vary）"""
+    vary = b", ".join(value for name, value in headers if name == b"vary")
+    if b"accept-encoding" in vary.lower() or vary.strip() == b"*":
+        return headers
+    vary = vary + b", Accept-Encoding" if vary else b"Accept-Encoding"
+    return [(name, value) for name, value in headers if name != b"vary"] + [(b"vary", vary)]
+
+
+class CompressionMiddleware:
+    """
+    ASGI响应压缩中间件
+
+    Args:
+        minimum_size: 压缩阈值（字节）
+        offload_size: 超过该大小时在线程池中压缩
+        content_types: 允许压缩的Content-Type前缀
+        cache_size: 压缩结果缓存条数，0表示不缓存
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = DEFAULT_MINIMUM_SIZE,
+        offload_size: int = DEFAULT_OFFLOAD_SIZE,
+        content_types: Tuple[str, ...] = DEFAULT_CONTENT_TYPES,
+        cache_size: int = 256,
+        cache_ttl: float = 300.0,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.content_types = content_types
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_size else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope.get("headers", ()):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept_encoding) if accept_encoding else None
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                if self._skip(message["headers"]):
+                    passthrough = True
+                    await send(message)
+                    return
+                # 是否压缩取决于请求的 Accept-Encoding，可压缩的响应都要声明
+                message = {**message, "headers": _add_vary(message["headers"])}
+                if encoding is None:
+                    passthrough = True
+                    await send(message)
+                else:
+                    # 等第一个body消息到达后再决定是否压缩
+                    start_message = message
+                return
+
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.minimum_size:
+                # 流式响应或小响应：原样发送
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = await self._compress(body, encoding)
+            headers = [
+                (name, value) for name, value in start_message["headers"]
+                if name != b"content-length"
+            ]
+            headers.extend([
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+            ])
+            await send({**start_message, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _skip(self, headers: List[Tuple[bytes, bytes]]) -> bool:
+        """已编码或类型不在白名单内的响应不压缩"""
+        content_type = ""
+        for name, value in headers:
+            if name == b"content-encoding":
+                return True
+            if name == b"content-type":
+                content_type = value.decode("latin-1").lower()
+        if content_type.startswith(EXCLUDED_CONTENT_TYPES):
+            return True
+        return not content_type.startswith(self.content_types)
+
+    async def _compress(self, body: bytes, encoding: str) -> bytes:
+        """压缩响应体，优先读取压缩结果缓存"""
+        key = None
+        if self.cache is not None:
+            key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        compressor = COMPRESSORS[encoding]
+        if len(body) >= self.offload_size:
+            compressed = await asyncio.to_thread(compressor, body)
+        else:
+            compressed = compressor(body)
+
+        if key is not None:
+            self.cache.set(key, compressed)
+        return compressed
@@ -0,0 +1,263 @@
+"""
+读写分离路由
+写操作始终走主库；动态流、便签详情、评论列表等读请求分发到只读副本
+
+- 副本选择：轮询，跳过健康检查失败或复制延迟超过 max_lag 的副本，没有可用副本时回到主库
+- 健康检查：每轮先读主库的 WAL 插入位置和时钟，再读各副本已回放到的 WAL 位置（数据库函数 replica_status()）；
+  副本回放位置越过主库某次采样的位置时，才算追平到该次采样的主库时间点
+- 读自己的写：用户写入后记录写入时间并通过 X-Read-After 响应头交给客户端；
+  之后该用户的读请求（本 worker 的记录或客户端回传的头，取较晚者）只发往已追平到该时间点的副本，
+  都没追上时读主库
+- 时间统一用主库的时钟表示：本地时间按健康检查时测得的时钟偏差换算，取偏差上界，
+  宁可多读一次主库也不读到旧数据；不同 worker、不同主机之间交换的 X-Read-After 因此可以直接比较
+
+本地用两个 Postgres 验证（主库 + pg_basebackup -R 创建的流复制备库）:
+    DB_BACKEND=asyncpg DATABASE_URL=postgresql://localhost:5432/little_joys \\
+    DB_READ_REPLICAS=postgresql://localhost:5433/little_joys python main.py
+"""
+
+import asyncio
+import itertools
+import math
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import logging
+
+from cache import TTLCache
+from repository import Repository
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+READ_AFTER_HEADER = "X-Read-After"
+
+# 主库采样：(WAL插入位置, 主库时间)
+WalSample = Tuple[int, float]
+
+
+def parse_read_after(value: Optional[str]) -> Optional[float]:
+    """解析客户端回传的 X-Read-After（主库时钟的Unix时间戳），格式不对时忽略"""
+    if not value:
+        return None
+    try:
+        timestamp = float(value)
+    except ValueError:
+        return None
+    return timestamp if math.isfinite(timestamp) else None
+
+
+def _timestamp(value: Any) -> float:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+class ReadReplica:
+    """
+    只读副本及其健康状态
+
+    Args:
+        name: 名称（用于指标）
+        repository: 指向副本的数据访问层
+    """
+
+    def __init__(self, name: str, repository: Repository):
+        self.name = name
+        self.repository = repository
+        self.started = False
+        self.healthy = False
+        # 已追平到的主库时间点，以及做出判断时最新的主库采样时间（均为主库时钟）
+        self.replayed_until = 0.0
+        self.checked_at = 0.0
+        self.replay_lsn = 0
+        self.failures = 0
+        self.reads = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def lag(self) -> float:
+        """按最近一次检查估算的复制延迟（秒）"""
+        if not self.checked_at:
+            return float("inf")
+        return max(0.0, self.checked_at - self.replayed_until)
+
+    async def start(self) -> None:
+        """打开连接；失败时只记录，之后的健康检查会重试"""
+        try:
+            await self.repository.startup()
+            self.started = True
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.error(f"只读副本 {self.name} 连接失败: {self.last_error}")
+
+    async def check(self, samples: List[WalSample]) -> None:
+        """
+        Args:
+            samples: 最近的主库采样，按时间升序；必须在本次读取副本状态之前采集
+        """
+        try:
+            if not self.started:
+                await self.repository.startup()
+                self.started = True
+                logger.info(f"只读副本 {self.name} 已连接")
+            status = await self.repository.replica_status()
+            self.replay_lsn = int(status['lsn'])
+            for sample_lsn, sample_at in reversed(samples):
+                if self.replay_lsn >= sample_lsn:
+                    self.replayed_until = max(self.replayed_until, sample_at)
+                    break
+            if samples:
+                self.checked_at = samples[-1][1]
+            self.healthy = True
+            self.last_error = None
+        except Exception as e:
+            self.healthy = False
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"只读副本 {self.name} 健康检查失败: {self.last_error}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "lag_seconds": round(self.lag, 3) if self.checked_at else None,
+            "replay_lsn": self.replay_lsn,
+            "reads": self.reads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class DatabaseRouter:
+    """
+    读请求路由
+
+    Args:
+        primary: 主库的数据访问层
+        replicas: 只读副本
+        max_lag: 允许的最大复制延迟（秒），超过后副本暂不参与轮询
+        check_interval: 健康检查间隔（秒）
+        write_window: 本 worker 记住用户写入时间的时长（秒），应大于正常的复制延迟
+    """
+
+    def __init__(
+        self,
+        primary: Repository,
+        replicas: Optional[List[ReadReplica]] = None,
+        max_lag: float = 5.0,
+        check_interval: float = 2.0,
+        write_window: float = 60.0,
+    ):
+        self.primary = primary
+        self.replicas = replicas or []
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._recent_writes = TTLCache(maxsize=100000, ttl=write_window)
+        # 保留覆盖 max_lag 的主库采样，副本略有延迟时也能按较早的采样得到追平时间点
+        self._samples: Deque[WalSample] = deque(maxlen=max(2, math.ceil(max_lag / check_interval) + 2))
+        # 主库时钟 - 本地时钟 的上界；首次采样前没有健康副本，读请求都走主库
+        self._clock_offset = 0.0
+        self._next = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        self.primary_reads = 0
+        self.pinned_reads = 0
+        self.primary_check_failures = 0
+
+    def primary_clock(self) -> float:
+        """以主库时钟表示的当前时间（取偏差上界，不早于主库的实际时间）"""
+        return time.time() + self._clock_offset
+
+    def record_write(self, user_id: Optional[str]) -> str:
+        """
+        记录用户刚完成一次写入（在写操作返回之后调用）
+
+        Returns:
+            X-Read-After 响应头的值
+        """
+        written_at = self.primary_clock()
+        if user_id:
+            self._recent_writes.set(user_id, written_at)
+        return f"{written_at:.3f}"
+
+    def for_read(self, user_id: Optional[str] = None, read_after: Optional[float] = None) -> Repository:
+        """选择本次读请求使用的数据源"""
+        if not self.replicas:
+            return self.primary
+
+        # 不接受未来的时间，避免客户端把所有读请求钉在主库上
+        floor = min(read_after, self.primary_clock()) if read_after is not None else None
+        if user_id:
+            written_at = self._recent_writes.get(user_id)
+            if written_at is not None and (floor is None or written_at > floor):
+                floor = written_at
+
+        candidates = [
+            replica for replica in self.replicas
+            if replica.healthy and replica.lag <= self.max_lag
+        ]
+        if floor is not None:
+            eligible = [replica for replica in candidates if replica.replayed_until >= floor]
+            if not eligible and candidates:
+                self.pinned_reads += 1
+            candidates = eligible
+        if not candidates:
+            self.primary_reads += 1
+            return self.primary
+
+        replica = candidates[next(self._next) % len(candidates)]
+        replica.reads += 1
+        return replica.repository
+
+    async def startup(self) -> None:
+        """打开副本连接并开始健康检查；首次检查完成前读请求都走主库"""
+        for replica in self.replicas:
+            await replica.start()
+        if self.replicas and self._task is None:
+            self._task = asyncio.create_task(self._health_loop())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.repository.shutdown()
+
+    async def _sample_primary(self) -> None:
+        """读取主库的 WAL 插入位置和时钟，并更新时钟偏差"""
+        sent = time.time()
+        try:
+            status = await self.primary.replica_status()
+            primary_at = _timestamp(status['now'])
+            self._samples.append((int(status['lsn']), primary_at))
+        except Exception as e:
+            self.primary_check_failures += 1
+            logger.warning(f"主库WAL位置读取失败: {type(e).__name__}: {e}")
+            return
+        # 主库读时钟发生在 sent 之后，用 sent 得到偏差的上界
+        self._clock_offset = primary_at - sent
+
+    async def _health_loop(self) -> None:
+        while True:
+            await self._sample_primary()
+            samples = list(self._samples)
+            await asyncio.gather(*(replica.check(samples) for replica in self.replicas))
+            await asyncio.sleep(self.check_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_lag_seconds": self.max_lag,
+            "clock_offset_seconds": round(self._clock_offset, 3),
+            "primary_reads": self.primary_reads,
+            "pinned_to_primary": self.pinned_reads,
+            "primary_check_failures": self.primary_check_failures,
+            "replicas": {replica.name: replica.snapshot() for replica in self.replicas},
+        }
@@ -3,6 +3,7 @@ FastAPI 依赖函数
 用于在API路由中注入认证和其他依赖
 """
 
+import os
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -15,8 +16,15 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+# 管理员用户ID（逗号分隔），用于批量导入导出等运维接口
+ADMIN_USER_IDS = {
+    user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()
+}
+
 # HTTP Bearer认证方案
 security = HTTPBearer()
+# 可选认证方案：未携带Token时不报错，交给依赖函数返回None
+optional_security = HTTPBearer(auto_error=False)
 
 async def get_current_user_id(
     credentials: HTTPAuthorizationCredentials = Depends(security)
@@ -103,7 +111,7 @@ async def get_current_user_info(
         )
 
 async def get_optional_user_id(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
 ) -> Optional[str]:
     """
     获取可选的当前用户ID
@@ -134,4 +142,25 @@ async def get_optional_user_id(
         return None
     except Exception:
         # 对于可选认证，出现任何错误都返回None
-        return None 
\ No newline at end of file
+        return None
+
+async def require_admin(
+    current_user_id: str = Depends(get_current_user_id)
+) -> str:
+    """
+    要求当前用户为管理员
+    
+    管理员通过 ADMIN_USER_IDS 环境变量配置
+    
+    Returns:
+        str: 管理员用户ID
+        
+    Raises:
+        HTTPException: 当前用户不是管理员
+    """
+    if current_user_id not in ADMIN_USER_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="需要管理员权限",
+        )
+    return current_user_id
@@ -0,0 +1,166 @@
+"""
+便签位置与天气补全
+客户端发布便签时只需提交坐标，地址和天气由后台任务通过带缓存的高德/OpenWeatherMap客户端补全
+
+- 并发的逆地理编码请求在短时间窗口内合并，使用高德 batch 模式一次解析最多20个坐标
+  （批量导入时大量 post.enrich 任务同时执行，上游请求数约为便签数的1/20）
+- 天气只补全最近发布的便签，历史数据导入时不写入"当前天气"
+"""
+
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from external_apis import AMapClient, OpenWeatherClient
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# location_data 中标记待补全的字段
+ENRICHMENT_PENDING = "pending"
+# 发布超过该时长（秒）的便签不再补全天气
+WEATHER_MAX_AGE = float(os.getenv("ENRICH_WEATHER_MAX_AGE", str(3 * 3600)))
+
+
+def pending_location(latitude: float, longitude: float) -> Dict[str, Any]:
+    """只有坐标、等待服务端补全的 location_data"""
+    return {
+        "coordinates": {
+            "latitude": latitude,
+            "longitude": longitude
+        },
+        "enrichment": ENRICHMENT_PENDING
+    }
+
+
+class GeocodeBatcher:
+    """
+    逆地理编码请求合并
+
+    第一个请求到达后最多等待 max_wait 秒，或攒满 max_batch 个坐标，然后一次调用 reverse_geocode_many；
+    每个坐标单独得到结果或异常，一个坐标失败不影响同批的其他便签
+
+    Args:
+        client: 高德地图客户端
+        max_batch: 单批最多坐标数
+        max_wait: 攒批最长等待时间（秒）
+    """
+
+    def __init__(self, client: AMapClient, max_batch: int = AMapClient.BATCH_SIZE, max_wait: float = 0.05):
+        self.client = client
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: List[Tuple[float, float, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.points = 0
+
+    async def reverse_geocode(self, latitude: float, longitude: float) -> Tuple[Dict[str, Any], bool]:
+        """
+        Returns:
+            ({'formatted_address', 'coordinates'}, 是否降级)
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((latitude, longitude, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._resolve(batch))
+
+    async def _resolve(self, batch: List[Tuple[float, float, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.points += len(batch)
+        try:
+            results = await self.client.reverse_geocode_many(
+                [(latitude, longitude) for latitude, longitude, _ in batch],
+                return_exceptions=True
+            )
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "points": self.points,
+            "avg_batch_size": round(self.points / self.batches, 1) if self.batches else 0.0,
+        }
+
+
+class PostEnricher:
+    """
+    根据 post.enrich 任务的 payload 计算便签需要更新的字段
+
+    Args:
+        geocoder: 逆地理编码（合并请求）
+        weather_client: 天气客户端，为 None 时不补全天气
+    """
+
+    def __init__(self, geocoder: GeocodeBatcher, weather_client: Optional[OpenWeatherClient], weather_max_age: float = WEATHER_MAX_AGE):
+        self.geocoder = geocoder
+        self.weather_client = weather_client
+        self.weather_max_age = weather_max_age
+
+    def _weather_wanted(self, payload: Dict[str, Any]) -> bool:
+        if self.weather_client is None or not payload.get("needs_weather"):
+            return False
+        created_at = payload.get("created_at")
+        if not created_at:
+            return True
+        created = datetime.fromisoformat(created_at)
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=timezone.utc)
+        return (datetime.now(timezone.utc) - created).total_seconds() <= self.weather_max_age
+
+    async def enrich(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Args:
+            payload: {'post_id', 'latitude', 'longitude', 'needs_weather', 'created_at'}
+
+        Returns:
+            需要写回 posts 的字段（location_data / weather_data）
+
+        Raises:
+            UpstreamUnavailable / ExternalAPIError: 上游失败且没有可用缓存，由任务队列重试
+        """
+        latitude = float(payload["latitude"])
+        longitude = float(payload["longitude"])
+
+        lookups = [self.geocoder.reverse_geocode(latitude, longitude)]
+        if self._weather_wanted(payload):
+            lookups.append(self.weather_client.current_weather(latitude, longitude))
+        results = await asyncio.gather(*lookups)
+
+        location, _ = results[0]
+        update = {
+            "location_data": {
+                "name": location["formatted_address"],
+                "formatted_address": location["formatted_address"],
+                "coordinates": location["coordinates"]
+            }
+        }
+        if len(results) > 1:
+            update["weather_data"], _ = results[1]
+        return update
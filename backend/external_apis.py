@@ -0,0 +1,307 @@
+"""
+第三方API客户端
+高德地图逆地理编码和 OpenWeatherMap 当前天气，带结果缓存和降级
+
+- 新鲜缓存命中时直接返回，不调用上游
+- 上游故障（熔断、超时、5xx）时回退到过期但仍保留的缓存，并标记为降级数据
+- 相同坐标的并发请求合并为一次上游调用
+- 逆地理编码支持高德 batch 模式，一次请求最多解析20个坐标
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+import logging
+
+from cache import TTLCache
+from resilience import Upstream, UpstreamError, UpstreamUnavailable
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class ExternalAPIError(Exception):
+    """第三方API返回了业务错误（密钥无效、参数错误、数据格式不符等），不重试"""
+
+
+def _raise_for_status(response, service: str) -> None:
+    """5xx和429视为上游故障（可重试、计入熔断），其他非200视为业务错误"""
+    if response.status_code >= 500 or response.status_code == 429:
+        raise UpstreamError(f"{service} HTTP {response.status_code}")
+    if response.status_code != 200:
+        raise ExternalAPIError(f"{service} API错误: HTTP {response.status_code} - {response.text}")
+
+
+class CachedUpstreamClient:
+    """
+    带缓存与降级的上游客户端基类
+
+    Args:
+        upstream: 容错包装后的上游
+        fresh_ttl: 缓存视为新鲜的时长（秒）
+        stale_ttl: 缓存最长保留时长（秒），用于上游故障时降级
+    """
+
+    def __init__(self, upstream: Upstream, fresh_ttl: float, stale_ttl: float, maxsize: int = 5000):
+        self.upstream = upstream
+        self.fresh_ttl = fresh_ttl
+        self.cache = TTLCache(maxsize=maxsize, ttl=stale_ttl)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def _cached(self, key: Hashable, fetch: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """
+        读取缓存或调用上游
+
+        Returns:
+            (数据, 是否为降级数据)
+
+        Raises:
+            UpstreamUnavailable / ExternalAPIError: 上游失败且没有可用缓存
+        """
+        entry = self.cache.get(key)
+        if entry is not None and asyncio.get_running_loop().time() - entry[0] < self.fresh_ttl:
+            return entry[1], False
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            try:
+                data = await self.upstream.call(fetch)
+                self.cache.set(key, (asyncio.get_running_loop().time(), data))
+                result = (data, False)
+            except (UpstreamUnavailable, ExternalAPIError) as e:
+                if entry is None:
+                    raise
+                # 上游故障时返回过期缓存
+                self.upstream.fallbacks += 1
+                logger.warning(f"{self.upstream.name} 不可用，使用缓存降级: {e}")
+                result = (entry[1], True)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # 避免没有其他等待者时出现 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+
+class AMapClient(CachedUpstreamClient):
+    """高德地图逆地理编码客户端"""
+
+    REGEO_URL = "https://restapi.amap.com/v3/geocode/regeo"
+    # batch 模式单次最多的坐标数（高德限制）
+    BATCH_SIZE = 20
+
+    def __init__(self, api_key: Optional[str], upstream: Upstream, fresh_ttl: float = 86400, stale_ttl: float = 7 * 86400):
+        super().__init__(upstream, fresh_ttl, stale_ttl)
+        self.api_key = api_key
+
+    @staticmethod
+    def _key(latitude: float, longitude: float) -> Tuple[float, float]:
+        """坐标保留4位小数（约11米）作为缓存键"""
+        return (round(latitude, 4), round(longitude, 4))
+
+    @staticmethod
+    def _format(regeocode: Dict[str, Any], latitude: float, longitude: float) -> Dict[str, Any]:
+        return {
+            "formatted_address": regeocode.get("formatted_address") or "",
+            "coordinates": {
+                "latitude": latitude,
+                "longitude": longitude
+            }
+        }
+
+    async def _request(self, locations: List[Tuple[float, float]], batch: bool) -> Dict[str, Any]:
+        response = await self.upstream.client.get(
+            self.REGEO_URL,
+            params={
+                "key": self.api_key,
+                "location": "|".join(f"{longitude},{latitude}" for latitude, longitude in locations),
+                "poitype": "",
+                "radius": 1000,
+                "extensions": "base",
+                "batch": "true" if batch else "false",
+                "roadlevel": 0
+            }
+        )
+        _raise_for_status(response, "高德地图")
+        data = response.json()
+        if data.get("status") != "1":
+            raise ExternalAPIError(f"高德地图API错误: {data.get('info', '未知错误')}")
+        return data
+
+    async def reverse_geocode(self, latitude: float, longitude: float) -> Tuple[Dict[str, Any], bool]:
+        """
+        坐标转地址
+
+        Returns:
+            ({'formatted_address', 'coordinates'}, 是否降级)
+        """
+        async def fetch():
+            data = await self._request([(latitude, longitude)], batch=False)
+            return self._format(data.get("regeocode", {}), latitude, longitude)
+
+        return await self._cached(self._key(latitude, longitude), fetch)
+
+    async def _reverse_geocode_key(self, key: Tuple[float, float]) -> Tuple[Dict[str, Any], bool]:
+        """按缓存键（取整后的坐标）单独解析"""
+        async def fetch():
+            data = await self._request([key], batch=False)
+            return self._format(data.get("regeocode", {}), *key)
+
+        return await self._cached(key, fetch)
+
+    async def reverse_geocode_many(self, points: List[Tuple[float, float]], return_exceptions: bool = False) -> List[Any]:
+        """
+        批量坐标转地址
+
+        新鲜缓存命中的坐标不请求上游，其余按缓存键去重后每 BATCH_SIZE 个一组用 batch=true 请求；
+        某组请求失败时，有过期缓存的坐标回退到缓存；批量接口返回业务错误时该组逐个重新解析，
+        只有解析不了的坐标失败
+
+        Args:
+            return_exceptions: 为 True 时失败的坐标在结果中对应异常对象（同 asyncio.gather），不影响其他坐标
+
+        Returns:
+            与 points 一一对应的 (数据, 是否降级)
+
+        Raises:
+            UpstreamUnavailable / ExternalAPIError: return_exceptions 为 False 且有坐标解析失败、没有可用缓存
+        """
+        now = asyncio.get_running_loop().time
+        resolved: Dict[Hashable, Any] = {}
+        stale: Dict[Hashable, Dict[str, Any]] = {}
+        missing: List[Tuple[float, float]] = []
+        for key in dict.fromkeys(self._key(latitude, longitude) for latitude, longitude in points):
+            entry = self.cache.get(key)
+            if entry is not None and now() - entry[0] < self.fresh_ttl:
+                resolved[key] = (entry[1], False)
+                continue
+            if entry is not None:
+                stale[key] = entry[1]
+            missing.append(key)
+
+        for start in range(0, len(missing), self.BATCH_SIZE):
+            chunk = missing[start:start + self.BATCH_SIZE]
+
+            async def fetch(chunk=chunk):
+                data = await self._request(chunk, batch=True)
+                regeocodes = data.get("regeocodes") or []
+                if len(regeocodes) != len(chunk):
+                    raise ExternalAPIError(f"高德地图批量接口返回 {len(regeocodes)} 条结果，预期 {len(chunk)} 条")
+                return [self._format(regeocode, *key) for regeocode, key in zip(regeocodes, chunk)]
+
+            try:
+                results = await self.upstream.call(fetch)
+            except (UpstreamUnavailable, ExternalAPIError) as e:
+                if isinstance(e, ExternalAPIError) and len(chunk) > 1:
+                    # 可能只是个别坐标导致整组报错，逐个解析
+                    logger.warning(f"{self.upstream.name} 批量逆地理编码失败，逐个解析{len(chunk)}个坐标: {e}")
+                    outcomes = await asyncio.gather(*(self._reverse_geocode_key(key) for key in chunk), return_exceptions=True)
+                    resolved.update(zip(chunk, outcomes))
+                    continue
+                if any(key in stale for key in chunk):
+                    self.upstream.fallbacks += 1
+                    logger.warning(f"{self.upstream.name} 不可用，批量逆地理编码使用缓存降级: {e}")
+                resolved.update((key, (stale[key], True) if key in stale else e) for key in chunk)
+                continue
+            for key, result in zip(chunk, results):
+                self.cache.set(key, (now(), result))
+                resolved[key] = (result, False)
+
+        output = []
+        for latitude, longitude in points:
+            outcome = resolved[self._key(latitude, longitude)]
+            if isinstance(outcome, BaseException):
+                if not return_exceptions:
+                    raise outcome
+                output.append(outcome)
+                continue
+            data, degraded = outcome
+            output.append(({**data, "coordinates": {"latitude": latitude, "longitude": longitude}}, degraded))
+        return output
+
+
+class OpenWeatherClient(CachedUpstreamClient):
+    """OpenWeatherMap 当前天气客户端"""
+
+    WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+    def __init__(self, api_key: Optional[str], upstream: Upstream, fresh_ttl: float = 600, stale_ttl: float = 6 * 3600):
+        super().__init__(upstream, fresh_ttl, stale_ttl)
+        self.api_key = api_key
+
+    async def current_weather(self, latitude: float, longitude: float, units: str = "metric", lang: str = "zh_cn") -> Tuple[Dict[str, Any], bool]:
+        """
+        获取当前天气
+
+        坐标保留2位小数（约1公里）作为缓存键
+
+        Returns:
+            (格式化后的天气数据, 是否降级)
+        """
+        key = (round(latitude, 2), round(longitude, 2), units, lang)
+
+        async def fetch():
+            response = await self.upstream.client.get(
+                self.WEATHER_URL,
+                params={
+                    "lat": latitude,
+                    "lon": longitude,
+                    "appid": self.api_key,
+                    "units": units,
+                    "lang": lang
+                }
+            )
+            _raise_for_status(response, "OpenWeatherMap")
+            data = response.json()
+
+            # 检查API错误响应
+            if "cod" in data and data["cod"] != 200:
+                raise ExternalAPIError(f"OpenWeatherMap API错误: {data.get('message', '未知错误')}")
+
+            # 验证必需的数据字段
+            if "main" not in data:
+                raise ExternalAPIError(f"OpenWeatherMap API返回数据格式错误: 缺少main字段。响应: {data}")
+            if "weather" not in data or len(data["weather"]) == 0:
+                raise ExternalAPIError(f"OpenWeatherMap API返回数据格式错误: 缺少weather字段。响应: {data}")
+
+            return {
+                "location_name": data.get("name", ""),
+                "coordinates": {
+                    "latitude": latitude,
+                    "longitude": longitude
+                },
+                "temperature": {
+                    "current": data["main"]["temp"],
+                    "feels_like": data["main"]["feels_like"],
+                    "min": data["main"]["temp_min"],
+                    "max": data["main"]["temp_max"],
+                    "unit": "celsius" if units == "metric" else "fahrenheit"
+                },
+                "weather": {
+                    "main_condition": data["weather"][0]["main"],
+                    "description": data["weather"][0]["description"],
+                    "icon_code": data["weather"][0]["icon"]
+                },
+                "humidity_percent": data["main"]["humidity"],
+                "wind": {
+                    "speed_mps": data["wind"]["speed"],
+                    "direction_deg": data["wind"].get("deg", 0)
+                },
+                "pressure_hpa": data["main"]["pressure"],
+                "visibility_km": data.get("visibility", 0) / 1000,
+                "timestamp_utc": datetime.utcnow().isoformat() + "Z"
+            }
+
+        return await self._cached(key, fetch)
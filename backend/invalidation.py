@@ -0,0 +1,176 @@
+"""
+跨 worker 缓存失效
+多个 uvicorn worker 各自持有进程内缓存（用户资料等），一个 worker 上的写操作需要让其他 worker 的缓存失效
+
+- 数据库触发器在数据变化时 pg_notify('cache_invalidation', '命名空间:键')（见 database/setup.sql 第10节）
+- 每个 worker 用一条独立连接 LISTEN，收到的键按命名空间去重，攒一小段时间后批量交给缓存的淘汰函数
+- 连接断开期间的通知会丢失，重新连上后对所有缓存做全量失效，然后恢复增量淘汰
+- 未配置 DATABASE_URL 或未安装 asyncpg 时不启动（单 worker 部署只依赖本地失效和TTL）
+
+LISTEN 需要直连或 session 模式的连接池地址，transaction 模式的 pgbouncer 不能转发通知
+"""
+
+import asyncio
+import random
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Set
+import logging
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover - 可选依赖
+    asyncpg = None
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+
+# 命名空间（与 database/setup.sql 第10节的触发器一致，新增命名空间时需同时添加触发器和订阅的缓存）
+NS_PROFILE = "profile"
+
+Evictor = Callable[[List[str]], None]
+
+
+class InvalidationBus:
+    """
+    缓存失效总线
+
+    Args:
+        dsn: Postgres连接串，为空时不启动监听
+        flush_interval: 收到第一个键后攒批的时间（秒）
+        keepalive: 空闲时探测连接的间隔（秒），用于发现半开连接
+        max_backoff: 重连退避上限（秒）
+    """
+
+    def __init__(self, dsn: Optional[str], flush_interval: float = 0.05, keepalive: float = 30.0, max_backoff: float = 30.0):
+        self.dsn = dsn
+        self.flush_interval = flush_interval
+        self.keepalive = keepalive
+        self.max_backoff = max_backoff
+        self._evictors: Dict[str, List[Evictor]] = defaultdict(list)
+        self._resetters: List[Callable[[], None]] = []
+        self._pending: Dict[str, Set[str]] = defaultdict(set)
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+        self.connects = 0
+        self.received = 0
+        self.evicted = 0
+        self.batches = 0
+        self.resets = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.dsn) and asyncpg is not None
+
+    def subscribe(self, namespace: str, evict: Evictor, reset: Callable[[], None]) -> None:
+        """
+        登记缓存
+
+        Args:
+            namespace: 关注的命名空间
+            evict: 批量淘汰函数，接收去重后的键列表
+            reset: 全量失效函数（重连后调用）
+        """
+        self._evictors[namespace].append(evict)
+        if reset not in self._resetters:
+            self._resetters.append(reset)
+
+    def start(self) -> None:
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._flush()
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        namespace, _, key = payload.partition(":")
+        if not key or namespace not in self._evictors:
+            return
+        self.received += 1
+        self._pending[namespace].add(key)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._flush)
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, defaultdict(set)
+        for namespace, keys in pending.items():
+            batch = list(keys)
+            for evict in self._evictors.get(namespace, ()):
+                try:
+                    evict(batch)
+                except Exception as e:
+                    logger.warning(f"缓存淘汰失败（{namespace}）: {e}")
+            self.evicted += len(batch)
+        if pending:
+            self.batches += 1
+
+    def _reset(self) -> None:
+        """丢弃待处理的键，清空所有登记的缓存"""
+        self._pending.clear()
+        self.resets += 1
+        for reset in self._resetters:
+            try:
+                reset()
+            except Exception as e:
+                logger.warning(f"缓存全量失效失败: {e}")
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(CHANNEL, self._on_notify)
+                self.connected = True
+                self.connects += 1
+                # 开始监听之前（首次启动或断线期间）的变化无法补发，全量失效
+                self._reset()
+                backoff = 1.0
+                logger.info("缓存失效监听已连接")
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), self.keepalive)
+                    except asyncio.TimeoutError:
+                        await asyncio.wait_for(connection.fetchval("SELECT 1"), self.keepalive)
+                logger.warning("缓存失效监听连接已断开")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"缓存失效监听失败: {e}")
+            finally:
+                self.connected = False
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+            # 断线期间可能漏掉通知，先清空一次，避免在重连前继续读到旧数据
+            self._reset()
+            await asyncio.sleep(random.uniform(0, backoff))
+            backoff = min(self.max_backoff, backoff * 2)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "connected": self.connected,
+            "connects": self.connects,
+            "received": self.received,
+            "evicted": self.evicted,
+            "batches": self.batches,
+            "resets": self.resets,
+        }
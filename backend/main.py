@@ -5,19 +5,32 @@
 """
 
 import os
+import asyncio
 import httpx
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
-from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any, List
-from datetime import datetime
+from supabase import create_client, Client, ClientOptions
+from pydantic import BaseModel, Field, model_validator
+from typing import Optional, Dict, Any, List, Iterable
+from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo
+from types import MappingProxyType
+import io
+import math
 import json
+import uuid
+import base64
+import hmac
 from dotenv import load_dotenv
 from pathlib import Path
 import logging
 
+from schemas import FastJSONResponse, instrument_serialization, ApiResponse, PostOut, PostListData, PostBatchData, CommentListData, SyncData
+from resilience import register_upstream, upstreams_snapshot, close_upstreams, UpstreamUnavailable, STATE_OPEN
+
 # ================================
 # 环境配置
 # ================================
@@ -90,11 +103,45 @@ app = FastAPI(
     title="生活小确幸 API",
     description="记录生活中每一个温暖的小瞬间",
     version="1.0.0",
+    # 使用orjson编码响应
+    default_response_class=FastJSONResponse,
     # 生产环境隐藏文档
     docs_url="/docs" if ENVIRONMENT != "production" else None,
     redoc_url="/redoc" if ENVIRONMENT != "production" else None,
 )
 
+# ================================
+# 响应压缩
+# ================================
+
+from compression import CompressionMiddleware
+
+# 最先注册，位于中间件链最内层，只处理最终的响应体
+app.add_middleware(CompressionMiddleware)
+
+# ================================
+# 限流配置
+# ================================
+
+from rate_limit import RateLimitMiddleware, RateLimitRule, KEY_BY_USER, KEY_BY_IP
+
+# 写操作按用户限流，第三方API代理按IP限流（保护高德/OpenWeatherMap额度）
+RATE_LIMIT_RULES = [
+    RateLimitRule('create_post', 'POST', '/api/v1/posts', rate=10, period=60, burst=5, key_by=KEY_BY_USER),
+    RateLimitRule('create_comment', 'POST', '/api/v1/posts/{post_id}/comments', rate=30, period=60, burst=10, key_by=KEY_BY_USER),
+    RateLimitRule('toggle_like', 'POST', '/api/v1/posts/{post_id}/like', rate=60, period=60, burst=20, key_by=KEY_BY_USER),
+    RateLimitRule('create_reward', 'POST', '/api/v1/posts/{post_id}/rewards', rate=20, period=60, burst=5, key_by=KEY_BY_USER),
+    RateLimitRule('reverse_geocode', 'GET', '/api/v1/location/reverse-geocode', rate=30, period=60, burst=10, key_by=KEY_BY_IP),
+    RateLimitRule('current_weather', 'GET', '/api/v1/weather/current', rate=30, period=60, burst=10, key_by=KEY_BY_IP),
+]
+
+# 先于CORS注册，使CORS中间件位于外层，429响应同样带跨域头
+app.add_middleware(
+    RateLimitMiddleware,
+    rules=RATE_LIMIT_RULES,
+    enabled=os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true",
+)
+
 # ================================
 # CORS配置
 # ================================
@@ -134,17 +181,74 @@ else:
         allow_headers=["*"],
     )
 
+# ================================
+# 性能剖析
+# ================================
+
+from profiling import ProfilingMiddleware, timed, stack_sampler
+
+# Server-Timing 的 serialize 阶段包含 FastAPI 的响应校验和编码，而不只是 orjson 渲染
+instrument_serialization()
+
+# 自动采样比例（0~1），命中的请求返回 Server-Timing 头
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# 生产环境需要 X-Profile 头与 PROFILE_TOKEN 一致才启用；开发环境任意值即可
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+
+# 最后注册，位于最外层，耗时包含限流中的JWT解析
+app.add_middleware(
+    ProfilingMiddleware,
+    sample_rate=PROFILE_SAMPLE_RATE,
+    token=PROFILE_TOKEN,
+    allow_header=ENVIRONMENT != "production" or bool(PROFILE_TOKEN),
+)
+
+# ================================
+# 全局异常处理
+# ================================
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    """上游熔断或重试耗尽时快速返回503，而不是等待超时后返回500"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"服务暂时不可用: {str(exc)}"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after or 30)))}
+    )
+
 # ================================
 # 健康检查端点
 # ================================
 
 @app.get("/health")
 async def health_check():
-    """健康检查API"""
+    """健康检查API（任一上游熔断时状态为 degraded）"""
+    upstream_states = upstreams_snapshot()
+    degraded = any(state["breaker"]["state"] == STATE_OPEN for state in upstream_states.values())
     return {
-        "status": "healthy",
+        "status": "degraded" if degraded else "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "service": "Little Joys API"
+        "service": "Little Joys API",
+        "upstreams": {name: state["breaker"]["state"] for name, state in upstream_states.items()}
+    }
+
+@app.get("/api/v1/debug/metrics")
+async def debug_metrics():
+    """运行指标：上游调用与熔断状态、缓存命中与失效、实时推送连接数、打赏回调入库、后台任务队列"""
+    return {
+        "upstreams": upstreams_snapshot(),
+        "caches": {
+            "profiles": profile_cache.stats(),
+            "geocode": amap_client.cache.stats(),
+            "weather": weather_client.cache.stats()
+        },
+        "geocode_batching": geocode_batcher.stats(),
+        "realtime": broadcast_hub.stats(),
+        "reward_ingest": reward_ingestor.stats(),
+        "task_queue": task_queue.stats(),
+        "cache_invalidation": invalidation_bus.stats(),
+        "db_router": db_router.stats(),
+        "timestamp": datetime.utcnow().isoformat()
     }
 
 @app.get("/api/v1/debug/config")
@@ -174,18 +278,100 @@ async def root():
         "health_check": "/health"
     }
 
+# ================================
+# 上游服务配置（超时、重试、熔断）
+# ================================
+
+from external_apis import AMapClient, OpenWeatherClient, ExternalAPIError
+from enrichment import GeocodeBatcher, PostEnricher, pending_location
+from repository import Repository, SupabaseRepository, create_repository, BACKEND_SUPABASE, BACKEND_ASYNCPG, POST_FIELDS, COMMENT_FIELDS
+from db_router import DatabaseRouter, ReadReplica, READ_AFTER_HEADER, parse_read_after
+
+# Supabase写操作不幂等，不做重试，只做超时和熔断；读查询单独熔断，失败时带抖动重试
+supabase_upstream = register_upstream('supabase', timeout=10, attempts=1)
+supabase_read_upstream = register_upstream('supabase_read', timeout=10)
+amap_upstream = register_upstream('amap', timeout=3)
+openweathermap_upstream = register_upstream('openweathermap', timeout=3)
+
 # Supabase配置
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=supabase_upstream.timeout)
+)
+
+def db_execute(query, idempotent: Optional[bool] = None):
+    """
+    执行Supabase查询（经过熔断器，熔断中直接抛出 UpstreamUnavailable）
+
+    Args:
+        query: PostgREST 查询
+        idempotent: 是否可重试，默认按请求方法判断（select 为 GET/HEAD）；只读的 rpc 需显式传 True
+    """
+    if idempotent is None:
+        idempotent = query.http_method in ('GET', 'HEAD')
+    upstream = supabase_read_upstream if idempotent else supabase_upstream
+    with timed("db"):
+        return upstream.call_sync(query.execute, idempotent=idempotent)
+
+async def db_call(query, idempotent: Optional[bool] = None):
+    """在异步路由中执行查询：db_execute 放到线程池，上游超时和重试退避不阻塞事件循环"""
+    return await run_in_threadpool(db_execute, query, idempotent)
+
+# 读查询的数据访问层：supabase（PostgREST，默认）或 asyncpg（直连Postgres连接池）
+# 写操作仍通过 Supabase 客户端执行
+DB_BACKEND = os.getenv("DB_BACKEND", BACKEND_SUPABASE)
+postgres_upstream = register_upstream('postgres', timeout=5) if DB_BACKEND == BACKEND_ASYNCPG else None
+repository = create_repository(DB_BACKEND, lambda: supabase, db_call, postgres_upstream)
+
+# 只读副本（逗号分隔）：asyncpg 后端为副本连接串，supabase 后端为只读副本的API地址
+DB_READ_REPLICAS = [target.strip() for target in os.getenv("DB_READ_REPLICAS", "").split(",") if target.strip()]
+
+def create_replica_repository(index: int, target: str) -> Repository:
+    """为一个只读副本创建数据访问层，每个副本单独熔断"""
+    if DB_BACKEND == BACKEND_ASYNCPG:
+        return create_repository(DB_BACKEND, None, None, register_upstream(f'postgres_replica_{index}', timeout=5), dsn=target)
+    replica_upstream = register_upstream(f'supabase_replica_{index}', timeout=10)
+    replica_client = create_client(
+        target,
+        SUPABASE_KEY,
+        options=ClientOptions(postgrest_client_timeout=replica_upstream.timeout)
+    )
+    
+    def replica_execute_sync(query):
+        # 副本上只有读查询，都可以重试
+        with timed("db"):
+            return replica_upstream.call_sync(query.execute, idempotent=True)
+
+    async def replica_execute(query, idempotent: Optional[bool] = None):
+        return await run_in_threadpool(replica_execute_sync, query)
+    return SupabaseRepository(lambda: replica_client, replica_execute)
+
+db_router = DatabaseRouter(
+    repository,
+    [ReadReplica(f'replica_{index}', create_replica_repository(index, target)) for index, target in enumerate(DB_READ_REPLICAS)],
+    max_lag=float(os.getenv("DB_READ_MAX_LAG", "5")),
+)
 
 # API密钥配置
 AMAP_API_KEY = os.getenv("AMAP_API_KEY")
 OPENWEATHERMAP_API_KEY = os.getenv("OPENWEATHERMAP_API_KEY")
 
+# 带缓存和降级的第三方API客户端
+amap_client = AMapClient(AMAP_API_KEY, amap_upstream)
+weather_client = OpenWeatherClient(OPENWEATHERMAP_API_KEY, openweathermap_upstream)
+
 # 认证配置
 security = HTTPBearer()
 
 # 导入新的认证依赖
-from dependencies import get_current_user_id, get_current_user_info, get_optional_user_id
+from dependencies import get_current_user_id, get_current_user_info, get_optional_user_id, require_admin
+from bulk_io import PostImporter, iter_records, encode_records, iter_posts, parse_export_cursor, detect_format, SUPPORTED_FORMATS, DEFAULT_BATCH_SIZE
+from cache import profile_cache
+from broadcast import broadcast_hub, parse_topics, post_topic, format_sse, format_ws, FEED_TOPIC, HEARTBEAT_SECONDS
+from reward_ingest import RewardIngestor, QueueFullError, OUTCOME_STORED, OUTCOME_DUPLICATE, OUTCOME_IGNORED, OUTCOME_CONFLICT, OUTCOME_FAILED
+from task_queue import TaskQueue, SupabaseJobStore
+from invalidation import InvalidationBus, NS_PROFILE
 
 # ================================
 # 数据模型定义
@@ -203,6 +389,25 @@ class PostCreate(BaseModel):
     location_data: Optional[Dict[str, Any]] = None
     weather_data: Optional[Dict[str, Any]] = None
     user_id: str = Field(..., min_length=1)
+    # 只提交坐标时，位置和天气由后台任务补全（不写入数据库列）
+    latitude: Optional[float] = Field(None, ge=-90, le=90, exclude=True)
+    longitude: Optional[float] = Field(None, ge=-180, le=180, exclude=True)
+    
+    @model_validator(mode='after')
+    def attach_coordinates(self):
+        if (self.latitude is None) != (self.longitude is None):
+            raise ValueError("latitude 和 longitude 需要同时提供")
+        if self.latitude is not None and self.location_data is None:
+            self.location_data = pending_location(self.latitude, self.longitude)
+        return self
+
+class PostImport(PostCreate):
+    """批量导入的便签，可携带原始ID和创建时间用于迁移"""
+    id: Optional[uuid.UUID] = None
+    created_at: Optional[datetime] = None
+
+class PostBatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=100)
 
 class CommentCreate(BaseModel):
     content: str = Field(..., min_length=1, max_length=200)
@@ -211,11 +416,185 @@ class RewardCreate(BaseModel):
     payment_method: str = Field(..., pattern="^(wechat|alipay)$")
     transaction_id: str = Field(..., min_length=1)
 
+class RewardCallback(BaseModel):
+    """支付网关转发的打赏回调（已完成验签）"""
+    payment_method: str = Field(..., pattern="^(wechat|alipay)$")
+    transaction_id: str = Field(..., min_length=1, max_length=100)
+    from_user_id: uuid.UUID
+    post_id: uuid.UUID
+    amount: float = Field(1.00, gt=0)
+    status: str = Field("completed", pattern="^(pending|completed|failed)$")
+    paid_at: Optional[datetime] = None
+
 class PaymentAccountCreate(BaseModel):
     payment_type: str = Field(..., pattern="^(wechat|alipay)$")
     account_info: Dict[str, Any]
     real_name: str = Field(..., max_length=50)
 
+# ================================
+# 公共查询
+# ================================
+
+# 便签详情/列表 view=full 返回的字段
+POST_COLUMNS = ('id', 'content', 'image_url', 'audio_url', 'location_data', 'weather_data', 'likes_count', 'comments_count', 'rewards_count', 'rewards_amount', 'created_at', 'user_id')
+# 列表卡片只需要位置名和天气图标，不返回完整的 location_data / weather_data
+POST_COMPACT_FIELDS = ('id', 'user_id', 'content', 'image_url', 'audio_url', 'location_name', 'weather_icon', 'likes_count', 'comments_count', 'created_at')
+
+COMMENT_COLUMNS = ('id', 'content', 'created_at', 'user_id')
+# 评论行本身已经很小，view=compact 的作者信息只保留昵称，不返回头像URL
+COMMENT_COMPACT_FIELDS = COMMENT_COLUMNS
+# 游标分页依赖的评论字段，fields 参数未指定时也会查询
+COMMENT_CURSOR_FIELDS = ('id', 'user_id', 'created_at')
+# 每条便签最多内嵌的预览评论数
+MAX_PREVIEW_COMMENTS = 10
+
+def build_select(
+    fields: Optional[str],
+    view: str,
+    selectable: Iterable[str],
+    full_columns: Iterable[str],
+    compact_fields: Optional[Iterable[str]] = None,
+    required: Iterable[str] = ('id', 'user_id')
+) -> List[str]:
+    """
+    根据 fields / view 参数确定要查询的字段名（由数据访问层转换为 PostgREST select 或 SQL）
+    
+    - fields 优先，逗号分隔的字段名，required 中的字段总会包含（默认 id 和 user_id，用于组装作者信息）
+    - view=compact 使用精简字段，view=full 返回全部字段
+    
+    Raises:
+        HTTPException: 字段名或视图不合法（400）
+    """
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in selectable]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"不支持的字段: {', '.join(unknown)}")
+        return list(dict.fromkeys(list(required) + names))
+    
+    if view == 'full':
+        return list(full_columns)
+    if view == 'compact' and compact_fields is not None:
+        return list(compact_fields)
+    raise HTTPException(status_code=400, detail=f"不支持的视图: {view}")
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """把一页最后一行的 (created_at, id) 编码为不透明游标"""
+    raw = json.dumps([row['created_at'], row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Dict[str, str]:
+    """
+    解析游标
+    
+    Raises:
+        HTTPException: 游标格式不合法（400）
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        # 校验后再拼入过滤条件，避免构造出任意PostgREST表达式
+        datetime.fromisoformat(created_at)
+        uuid.UUID(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="分页游标不合法")
+    return {'created_at': created_at, 'id': row_id}
+
+async def fetch_comment_previews(post_ids: List[str], per_post: int, source: Optional[Repository] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    一次查询获取多条便签各自最早的 per_post 条评论
+    
+    调用数据库函数 get_comment_previews（row_number() OVER (PARTITION BY post_id)），
+    避免按便签逐条查询评论
+    
+    Args:
+        source: 读取的数据源，默认主库
+    
+    Returns:
+        Dict: 便签ID -> 评论列表（按时间正序）
+    """
+    previews: Dict[str, List[Dict[str, Any]]] = {post_id: [] for post_id in post_ids}
+    if not post_ids or per_post <= 0:
+        return previews
+    for comment in await (source or repository).get_comment_previews(post_ids, per_post):
+        previews.setdefault(comment['post_id'], []).append(comment)
+    return previews
+
+# 用户资料不存在时的默认展示信息（只读，挂到响应上时用 profile_for 复制）
+UNKNOWN_USER_PROFILE = MappingProxyType({
+    'nickname': '未知用户',
+    'avatar_url': None
+})
+
+def profile_for(users_data: Dict[str, Dict[str, Any]], user_id: str) -> Dict[str, Any]:
+    """取出用户展示信息的副本；缓存中的字典和默认值被多个响应共享，不能直接挂到响应上"""
+    return dict(users_data.get(user_id, UNKNOWN_USER_PROFILE))
+
+async def fetch_user_profiles(user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    批量获取用户展示信息（昵称、头像）
+    
+    优先读取进程内缓存，未命中的用户用一次 in 查询补齐
+    
+    Returns:
+        Dict: 用户ID -> {'nickname', 'avatar_url'}
+    """
+    profiles, missing = profile_cache.get_many(set(user_ids))
+    if missing:
+        fetched = {
+            user['id']: {
+                'nickname': user['nickname'],
+                'avatar_url': user['avatar_url']
+            }
+            for user in await repository.get_user_profiles(missing)
+        }
+        profile_cache.set_many(fetched)
+        profiles.update(fetched)
+    return profiles
+
+async def read_repository(request: Request, current_user_id: Optional[str] = Depends(get_optional_user_id)) -> Repository:
+    """读请求的数据源：只读副本轮询，用户刚写入过时只用已追上的副本或主库"""
+    return db_router.for_read(current_user_id, parse_read_after(request.headers.get(READ_AFTER_HEADER)))
+
+def mark_written(response: Response, user_id: Optional[str]) -> None:
+    """写操作成功后调用：记录写入时间，并通过响应头交给客户端，使其他 worker 也能保证读到自己的写"""
+    response.headers[READ_AFTER_HEADER] = db_router.record_write(user_id)
+
+# ================================
+# 跨worker缓存失效
+# ================================
+
+# 其他 worker 上的资料修改通过数据库通知淘汰本地缓存（未配置数据库直连地址时只依赖TTL）
+invalidation_bus = InvalidationBus(os.getenv("INVALIDATION_DATABASE_URL") or os.getenv("DATABASE_URL"))
+invalidation_bus.subscribe(NS_PROFILE, profile_cache.delete_many, profile_cache.clear)
+
+# ================================
+# 后台任务
+# ================================
+
+# 发布便签等写操作的附加处理由数据库触发器写入 job_queue，在这里异步执行，不占用请求时间
+task_queue = TaskQueue(SupabaseJobStore(supabase, db_execute))
+
+@task_queue.handler('post.created', concurrency=4)
+async def on_post_created(payload: Dict[str, Any]):
+    """便签发布后的附加处理：预热作者资料缓存，动态流渲染时直接命中"""
+    await fetch_user_profiles([payload['user_id']])
+
+# 位置/天气补全：并发任务的逆地理编码请求合并为高德 batch 请求
+geocode_batcher = GeocodeBatcher(amap_client)
+post_enricher = PostEnricher(geocode_batcher, weather_client if OPENWEATHERMAP_API_KEY else None)
+
+@task_queue.handler('post.enrich', concurrency=40)
+async def on_post_enrich(payload: Dict[str, Any]):
+    """补全只提交了坐标的便签的地址和天气，上游失败时由任务队列退避重试"""
+    update = await post_enricher.enrich(payload)
+    post_id = payload['post_id']
+    await run_in_threadpool(
+        db_execute,
+        supabase.table('posts').update(update, returning='minimal').eq('id', post_id)
+    )
+    broadcast_hub.publish([FEED_TOPIC, post_topic(post_id)], 'post.enriched', {'post_id': post_id, **update})
+
 # ================================
 # 认证相关
 # ================================
@@ -243,9 +622,9 @@ async def get_current_user_me(current_user_id: str = Depends(get_current_user_id
     """
     try:
         # 从数据库获取用户信息
-        response = supabase.table('user_profiles').select(
+        response = await db_call(supabase.table('user_profiles').select(
             'id, nickname, avatar_url, bio, total_rewards, post_count, is_verified, created_at'
-        ).eq('id', current_user_id).single().execute()
+        ).eq('id', current_user_id).single())
         
         return {
             "success": True,
@@ -285,125 +664,53 @@ async def get_auth_info(user_info: dict = Depends(get_current_user_info)):
 async def reverse_geocode(latitude: float, longitude: float, lang: str = "zh-CN"):
     """逆地理编码 - 将坐标转换为地址"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://restapi.amap.com/v3/geocode/regeo",
-                params={
-                    "key": AMAP_API_KEY,
-                    "location": f"{longitude},{latitude}",
-                    "poitype": "",
-                    "radius": 1000,
-                    "extensions": "base",
-                    "batch": "false",
-                    "roadlevel": 0
-                }
-            )
-            data = response.json()
-            
-            if data.get("status") == "1":
-                regeocode = data.get("regeocode", {})
-                formatted_address = regeocode.get("formatted_address", "")
-                
-                return {
-                    "data": {
-                        "formatted_address": formatted_address,
-                        "coordinates": {
-                            "latitude": latitude,
-                            "longitude": longitude
-                        }
-                    },
-                    "message": "位置详情获取成功"
-                }
-            else:
-                raise HTTPException(status_code=503, detail="地理编码服务暂时不可用")
-                
+        data, degraded = await amap_client.reverse_geocode(latitude, longitude)
+    except (UpstreamUnavailable, ExternalAPIError) as e:
+        # 降级：地址服务不可用时只返回坐标，不阻塞前端发布流程
+        logger.warning(f"逆地理编码降级: {e}")
+        data = {
+            "formatted_address": "",
+            "coordinates": {
+                "latitude": latitude,
+                "longitude": longitude
+            }
+        }
+        degraded = True
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取位置信息失败: {str(e)}")
+    
+    return {
+        "data": data,
+        "degraded": degraded,
+        "message": "位置服务暂时不可用，返回降级数据" if degraded else "位置详情获取成功"
+    }
 
 @app.get("/api/v1/weather/current")
 async def get_current_weather(latitude: float, longitude: float, units: str = "metric", lang: str = "zh_cn"):
     """获取当前天气信息"""
+    # 检查API密钥是否配置
+    if not OPENWEATHERMAP_API_KEY:
+        raise HTTPException(status_code=500, detail="OpenWeatherMap API密钥未配置")
+    
     try:
-        # 检查API密钥是否配置
-        if not OPENWEATHERMAP_API_KEY:
-            raise HTTPException(status_code=500, detail="OpenWeatherMap API密钥未配置")
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.openweathermap.org/data/2.5/weather",
-                params={
-                    "lat": latitude,
-                    "lon": longitude,
-                    "appid": OPENWEATHERMAP_API_KEY,
-                    "units": units,
-                    "lang": lang
-                }
-            )
-            
-            # 检查HTTP响应状态
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=503, 
-                    detail=f"OpenWeatherMap API错误: HTTP {response.status_code} - {response.text}"
-                )
-            
-            data = response.json()
-            
-            # 检查API错误响应
-            if "cod" in data and data["cod"] != 200:
-                raise HTTPException(
-                    status_code=503,
-                    detail=f"OpenWeatherMap API错误: {data.get('message', '未知错误')}"
-                )
-            
-            # 验证必需的数据字段
-            if "main" not in data:
-                raise HTTPException(
-                    status_code=503,
-                    detail=f"OpenWeatherMap API返回数据格式错误: 缺少main字段。响应: {data}"
-                )
-            
-            if "weather" not in data or len(data["weather"]) == 0:
-                raise HTTPException(
-                    status_code=503,
-                    detail=f"OpenWeatherMap API返回数据格式错误: 缺少weather字段。响应: {data}"
-                )
-            
-            return {
-                "data": {
-                    "location_name": data.get("name", ""),
-                    "coordinates": {
-                        "latitude": latitude,
-                        "longitude": longitude
-                    },
-                    "temperature": {
-                        "current": data["main"]["temp"],
-                        "feels_like": data["main"]["feels_like"],
-                        "min": data["main"]["temp_min"],
-                        "max": data["main"]["temp_max"],
-                        "unit": "celsius" if units == "metric" else "fahrenheit"
-                    },
-                    "weather": {
-                        "main_condition": data["weather"][0]["main"],
-                        "description": data["weather"][0]["description"],
-                        "icon_code": data["weather"][0]["icon"]
-                    },
-                    "humidity_percent": data["main"]["humidity"],
-                    "wind": {
-                        "speed_mps": data["wind"]["speed"],
-                        "direction_deg": data["wind"].get("deg", 0)
-                    },
-                    "pressure_hpa": data["main"]["pressure"],
-                    "visibility_km": data.get("visibility", 0) / 1000,
-                    "timestamp_utc": datetime.utcnow().isoformat() + "Z"
-                },
-                "message": "当前天气数据获取成功"
-            }
-    except HTTPException:
-        # 重新抛出HTTP异常
-        raise
+        data, degraded = await weather_client.current_weather(latitude, longitude, units, lang)
+    except UpstreamUnavailable as e:
+        # 没有可用缓存，快速失败并告知客户端何时重试
+        raise HTTPException(
+            status_code=503,
+            detail=f"天气服务暂时不可用: {str(e)}",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after or 30)))}
+        )
+    except ExternalAPIError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取天气信息失败: {str(e)}")
+    
+    return {
+        "data": data,
+        "degraded": degraded,
+        "message": "天气服务暂时不可用，返回缓存数据" if degraded else "当前天气数据获取成功"
+    }
 
 # ================================
 # 用户相关API（使用新的认证系统）
@@ -413,40 +720,123 @@ async def get_current_weather(latitude: float, longitude: float, units: str = "m
 async def get_user_profile(current_user_id: str = Depends(get_current_user_id)):
     """获取当前用户信息"""
     try:
-        response = supabase.table('user_profiles').select(
+        response = await db_call(supabase.table('user_profiles').select(
             'id, nickname, avatar_url, bio, total_rewards, post_count, is_verified, created_at'
-        ).eq('id', current_user_id).single().execute()
+        ).eq('id', current_user_id).single())
         
         return {
             "success": True,
             "data": response.data,
             "message": "用户信息获取成功"
         }
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"用户信息不存在: {str(e)}")
 
 @app.put("/api/v1/users/profile")
 async def update_user_profile(
     profile_data: UserProfile,
+    response: Response,
     current_user_id: str = Depends(get_current_user_id)
 ):
     """更新用户资料"""
     try:
-        response = supabase.table('user_profiles').update({
+        update_response = await db_call(supabase.table('user_profiles').update({
             'nickname': profile_data.nickname,
             'bio': profile_data.bio,
             'avatar_url': profile_data.avatar_url,
             'updated_at': datetime.utcnow().isoformat()
-        }).eq('id', current_user_id).execute()
+        }).eq('id', current_user_id))
+        
+        # 昵称/头像已变更，使缓存失效
+        profile_cache.delete(current_user_id)
+        mark_written(response, current_user_id)
         
         return {
             "success": True,
-            "data": response.data[0],
+            "data": update_response.data[0],
             "message": "用户资料更新成功"
         }
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"更新用户资料失败: {str(e)}")
 
+# 用户统计计数（由 user_stats 表的触发器维护），没有记录时视为全部为0
+USER_STATS_COLUMNS = 'posts_count, likes_received, comments_received, rewards_received, rewards_amount, updated_at'
+EMPTY_USER_STATS = {
+    'posts_count': 0,
+    'likes_received': 0,
+    'comments_received': 0,
+    'rewards_received': 0,
+    'rewards_amount': 0,
+    'updated_at': None
+}
+# 对账任务间隔（秒），0 表示不启动
+USER_STATS_RECONCILE_INTERVAL = float(os.getenv("USER_STATS_RECONCILE_INTERVAL", "3600"))
+# 应用启动时创建的后台任务，关闭时统一取消
+background_tasks: List[asyncio.Task] = []
+
+def fetch_user_stats(user_id: str) -> Dict[str, Any]:
+    """按主键读取一行计数，不做任何聚合"""
+    response = db_execute(supabase.table('user_stats').select(USER_STATS_COLUMNS).eq('user_id', user_id))
+    stats = response.data[0] if response.data else dict(EMPTY_USER_STATS)
+    stats['user_id'] = user_id
+    return stats
+
+def reconcile_user_stats() -> int:
+    """从明细表重算用户统计并修正偏差，返回修正的用户数"""
+    response = db_execute(supabase.rpc('reconcile_user_stats'))
+    return response.data or 0
+
+async def user_stats_reconcile_loop():
+    """定期对账，修正触发器之外的写入（手工改数、历史数据）造成的计数偏差"""
+    while True:
+        await asyncio.sleep(USER_STATS_RECONCILE_INTERVAL)
+        try:
+            fixed = await run_in_threadpool(reconcile_user_stats)
+            if fixed:
+                logger.warning(f"用户统计对账修正了 {fixed} 个用户的计数")
+        except Exception as e:
+            logger.error(f"用户统计对账失败: {e}")
+
+@app.get("/api/v1/users/stats")
+async def get_my_stats(current_user_id: str = Depends(get_current_user_id)):
+    """获取当前用户的统计（发布数、收到的点赞/评论/打赏）"""
+    try:
+        return {
+            "success": True,
+            "data": await run_in_threadpool(fetch_user_stats, current_user_id),
+            "message": "用户统计获取成功"
+        }
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取用户统计失败: {str(e)}")
+
+@app.get("/api/v1/users/{user_id}/stats")
+async def get_user_stats(user_id: str):
+    """获取指定用户的公开统计"""
+    try:
+        uuid.UUID(user_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="用户ID格式不正确")
+    try:
+        return {
+            "success": True,
+            "data": await run_in_threadpool(fetch_user_stats, user_id),
+            "message": "用户统计获取成功"
+        }
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取用户统计失败: {str(e)}")
+
 # ================================
 # 便签相关API
 # ================================
@@ -454,6 +844,7 @@ async def update_user_profile(
 @app.post("/api/v1/posts")
 async def create_post(
     post_data: PostCreate,
+    response: Response,
     # current_user_id: str = Depends(get_current_user_id)
 ):
     """创建新便签"""
@@ -470,76 +861,74 @@ async def create_post(
         # 移除空值
         insert_data = {k: v for k, v in insert_data.items() if v is not None}
         
-        response = supabase.table('posts').insert(insert_data).execute()
+        insert_response = await db_call(supabase.table('posts').insert(insert_data))
+        post = insert_response.data[0] if insert_response.data else None
+        mark_written(response, post_data.user_id)
+        
+        # 推送给订阅了动态流的客户端
+        if post:
+            broadcast_hub.publish([FEED_TOPIC], 'post.created', post)
+            # 附加处理任务已由触发器写入 job_queue，唤醒本实例的调度循环立即领取
+            task_queue.notify()
         
         return {
             "success": True,
-            "data": response.data[0] if response.data else None,
+            "data": post,
             "message": "便签创建成功"
         }
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建便签失败: {str(e)}")
 
-@app.get("/api/v1/posts")
+@app.get("/api/v1/posts", response_model=None, responses={200: {"model": ApiResponse[PostListData]}})
 async def get_posts_list(
     page: int = 1,
     limit: int = 20,
     sort_type: str = "latest",
-    user_id: Optional[str] = None
+    user_id: Optional[str] = None,
+    view: str = "full",
+    fields: Optional[str] = None,
+    preview_comments: int = Query(0, ge=0, le=MAX_PREVIEW_COMMENTS),
+    source: Repository = Depends(read_repository)
 ):
-    """获取便签列表"""
+    """
+    获取便签列表
+    
+    view=compact 只返回卡片需要的字段（位置名、天气图标代替完整的JSONB）；
+    fields 可指定逗号分隔的字段列表；
+    preview_comments=K 时每条便签附带最早的K条评论（所有便签的预览评论合并为一次查询）
+    """
+    select_fields = build_select(fields, view, POST_FIELDS, POST_COLUMNS, POST_COMPACT_FIELDS)
     try:
         offset = (page - 1) * limit
-
         
         # 第一步：查询便签数据（不包含用户信息）
-        query = supabase.table('posts').select(
-            'id, content, image_url, audio_url, location_data, weather_data, likes_count, comments_count, rewards_count, rewards_amount, created_at, user_id'
-        ).eq('is_deleted', False)
+        posts_data = await source.list_posts(select_fields, offset, limit, sort_type, user_id)
         
-        if user_id:
-            query = query.eq('user_id', user_id)
+        # 第二步：一次查询获取本页所有便签的预览评论
+        previews = await fetch_comment_previews([post['id'] for post in posts_data], preview_comments, source)
+        preview_comments_data = [comment for comments in previews.values() for comment in comments]
         
-        if sort_type == 'hottest':
-            query = query.order('likes_count', desc=True)
-        else:
-            query = query.order('created_at', desc=True)
-        
-        posts_response = query.range(offset, offset + limit - 1).execute()
-        posts_data = posts_response.data
-        
-        # 第二步：获取所有相关用户的ID
-        user_ids = list(set([post['user_id'] for post in posts_data]))
-        
-        # 第三步：批量查询用户信息
-        users_data = {}
-        if user_ids:
-            users_response = supabase.table('user_profiles').select(
-                'id, nickname, avatar_url'
-            ).in_('id', user_ids).execute()
-            
-            # 将用户数据转换为字典，方便查找
-            for user in users_response.data:
-                users_data[user['id']] = {
-                    'nickname': user['nickname'],
-                    'avatar_url': user['avatar_url']
-                }
+        # 第三步：批量获取便签和评论作者信息（带缓存）
+        users_data = await fetch_user_profiles(
+            [post['user_id'] for post in posts_data] +
+            [comment['user_id'] for comment in preview_comments_data]
+        )
         
         # 第四步：组合数据
+        for comment in preview_comments_data:
+            comment['user_profiles'] = profile_for(users_data, comment['user_id'])
         for post in posts_data:
-            user_info = users_data.get(post['user_id'], {
-                'nickname': '未知用户',
-                'avatar_url': None
-            })
-            post['user_profiles'] = user_info
+            post['user_profiles'] = profile_for(users_data, post['user_id'])
+            if preview_comments:
+                post['comments_preview'] = previews.get(post['id'], [])
         
         # 获取总数
-        count_query = supabase.table('posts').select('id', count='exact').eq('is_deleted', False)
-        if user_id:
-            count_query = count_query.eq('user_id', user_id)
-        total_count = count_query.execute().count
+        total_count = await source.count_posts(user_id)
         
-        return {
+        return FastJSONResponse({
             "success": True,
             "data": {
                 "posts": posts_data,
@@ -551,65 +940,129 @@ async def get_posts_list(
                 }
             },
             "message": "便签列表获取成功"
-        }
+        })
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取便签列表失败: {str(e)}")
 
-@app.get("/api/v1/posts/{post_id}")
-async def get_post_detail(post_id: str, current_user_id: Optional[str] = Depends(get_current_user_id)):
-    """获取便签详情"""
+@app.post("/api/v1/posts/batch", response_model=None, responses={200: {"model": ApiResponse[PostBatchData]}})
+async def get_posts_batch(
+    batch_request: PostBatchRequest,
+    view: str = "full",
+    fields: Optional[str] = None,
+    current_user_id: Optional[str] = Depends(get_optional_user_id)
+):
+    """
+    批量获取便签详情
+    
+    无论请求多少个ID，最多执行3次查询（便签、作者、点赞状态）。
+    返回的 posts 与请求的 ids 一一对应，不存在或已删除的位置为 null，
+    并分别列在 missing / deleted 中
+    """
+    select_fields = build_select(fields, view, POST_FIELDS, POST_COLUMNS, POST_COMPACT_FIELDS)
     try:
-        # 第一步：查询便签数据
-        posts_response = supabase.table('posts').select(
-            'id, content, image_url, audio_url, location_data, weather_data, likes_count, comments_count, rewards_count, rewards_amount, created_at, user_id'
-        ).eq('id', post_id).eq('is_deleted', False).single().execute()
+        # 非法UUID直接视为不存在，避免整个in查询报错
+        valid_ids = []
+        for post_id in dict.fromkeys(batch_request.ids):
+            try:
+                uuid.UUID(post_id)
+                valid_ids.append(post_id)
+            except ValueError:
+                pass
         
-        post_data = posts_response.data
+        # 第一步：批量查询便签（包含已删除的，用于区分删除和不存在）
+        posts_by_id = {}
+        if valid_ids:
+            posts_by_id = {post['id']: post for post in await repository.get_posts_by_ids(valid_ids, select_fields)}
         
-        # 第二步：查询用户信息
-        try:
-            user_response = supabase.table('user_profiles').select(
-                'id, nickname, avatar_url'
-            ).eq('id', post_data['user_id']).single().execute()
-            
-            post_data['user_profiles'] = {
-                'nickname': user_response.data['nickname'],
-                'avatar_url': user_response.data['avatar_url']
-            }
-        except:
-            # 如果用户信息不存在，使用默认值
-            post_data['user_profiles'] = {
-                'nickname': '未知用户',
-                'avatar_url': None
-            }
+        live_posts = {
+            post_id: post for post_id, post in posts_by_id.items()
+            if not post.pop('is_deleted', False)
+        }
         
-        # 检查当前用户是否已点赞
-        is_liked = False
-        if current_user_id:
-            like_response = supabase.table('likes').select('id').eq('post_id', post_id).eq('user_id', current_user_id).execute()
-            is_liked = len(like_response.data) > 0
+        # 第二步：批量获取作者信息（带缓存）
+        users_data = await fetch_user_profiles(post['user_id'] for post in live_posts.values())
         
-        post_data['is_liked'] = is_liked
+        # 第三步：批量查询当前用户的点赞状态
+        liked_ids = set()
+        if current_user_id and live_posts:
+            liked_ids = await repository.get_liked_post_ids(current_user_id, list(live_posts))
         
-        return {
+        for post_id, post in live_posts.items():
+            post['user_profiles'] = profile_for(users_data, post['user_id'])
+            post['is_liked'] = post_id in liked_ids
+        
+        # 按请求顺序组装结果
+        posts = [live_posts.get(post_id) for post_id in batch_request.ids]
+        deleted = [post_id for post_id in dict.fromkeys(batch_request.ids) if post_id in posts_by_id and post_id not in live_posts]
+        missing = [post_id for post_id in dict.fromkeys(batch_request.ids) if post_id not in posts_by_id]
+        
+        return FastJSONResponse({
+            "success": True,
+            "data": {
+                "posts": posts,
+                "missing": missing,
+                "deleted": deleted
+            },
+            "message": "便签批量获取成功"
+        })
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量获取便签失败: {str(e)}")
+
+@app.get("/api/v1/posts/{post_id}", response_model=None, responses={200: {"model": ApiResponse[PostOut]}})
+async def get_post_detail(
+    post_id: str,
+    fields: Optional[str] = None,
+    current_user_id: Optional[str] = Depends(get_current_user_id),
+    source: Repository = Depends(read_repository)
+):
+    """
+    获取便签详情（默认返回全部字段，可用 fields 指定字段列表）
+    
+    asyncpg 后端下便签和点赞状态在一条语句中查询，作者信息通常命中缓存
+    """
+    select_fields = build_select(fields, 'full', POST_FIELDS, POST_COLUMNS)
+    try:
+        # 第一步：查询便签数据和当前用户的点赞状态
+        post_data = await source.get_post(post_id, select_fields, current_user_id)
+        if post_data is None:
+            raise HTTPException(status_code=404, detail="便签不存在或已删除")
+        post_data.setdefault('is_liked', False)
+        
+        # 第二步：查询用户信息（带缓存），不存在时使用默认值
+        users_data = await fetch_user_profiles([post_data['user_id']])
+        post_data['user_profiles'] = profile_for(users_data, post_data['user_id'])
+        
+        return FastJSONResponse({
             "success": True,
             "data": post_data,
             "message": "便签详情获取成功"
-        }
+        })
+    except HTTPException:
+        raise
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"便签不存在或已删除: {str(e)}")
 
 @app.delete("/api/v1/posts/{post_id}")
-async def delete_post(post_id: str, current_user_id: str = Depends(get_current_user_id)):
+async def delete_post(post_id: str, response: Response, current_user_id: str = Depends(get_current_user_id)):
     """删除便签（软删除）"""
     try:
         # 验证便签归属
-        post_check = supabase.table('posts').select('user_id').eq('id', post_id).single().execute()
+        post_check = await db_call(supabase.table('posts').select('user_id').eq('id', post_id).single())
         if post_check.data['user_id'] != current_user_id:
             raise HTTPException(status_code=403, detail="无权删除此便签")
         
         # 软删除
-        supabase.table('posts').update({'is_deleted': True}).eq('id', post_id).execute()
+        await db_call(supabase.table('posts').update({'is_deleted': True}).eq('id', post_id))
+        mark_written(response, current_user_id)
         
         return {
             "success": True,
@@ -617,6 +1070,9 @@ async def delete_post(post_id: str, current_user_id: str = Depends(get_current_u
         }
     except HTTPException:
         raise
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除便签失败: {str(e)}")
 
@@ -625,30 +1081,39 @@ async def delete_post(post_id: str, current_user_id: str = Depends(get_current_u
 # ================================
 
 @app.post("/api/v1/posts/{post_id}/like")
-async def toggle_like(post_id: str, current_user_id: str = Depends(get_current_user_id)):
+async def toggle_like(post_id: str, response: Response, current_user_id: str = Depends(get_current_user_id)):
     """切换点赞状态"""
     try:
         # 检查是否已点赞
-        existing_like = supabase.table('likes').select('id').eq('post_id', post_id).eq('user_id', current_user_id).execute()
+        existing_like = await db_call(supabase.table('likes').select('id').eq('post_id', post_id).eq('user_id', current_user_id))
         
         if existing_like.data:
             # 取消点赞
-            supabase.table('likes').delete().eq('post_id', post_id).eq('user_id', current_user_id).execute()
+            await db_call(supabase.table('likes').delete().eq('post_id', post_id).eq('user_id', current_user_id))
             action = 'unliked'
             message = '取消点赞成功'
         else:
             # 添加点赞
-            supabase.table('likes').insert({
+            await db_call(supabase.table('likes').insert({
                 'post_id': post_id,
                 'user_id': current_user_id
-            }).execute()
+            }))
             action = 'liked'
             message = '点赞成功'
+        mark_written(response, current_user_id)
         
         # 获取最新点赞数
-        post_response = supabase.table('posts').select('likes_count').eq('id', post_id).single().execute()
+        post_response = await db_call(supabase.table('posts').select('likes_count').eq('id', post_id).single())
         likes_count = post_response.data['likes_count']
         
+        # 推送最新点赞数（同一便签的连续更新会在连接队列中合并）
+        broadcast_hub.publish(
+            [FEED_TOPIC, post_topic(post_id)],
+            'post.likes',
+            {'post_id': post_id, 'likes_count': likes_count},
+            coalesce_key=post_id
+        )
+        
         return {
             "success": True,
             "data": {
@@ -657,6 +1122,9 @@ async def toggle_like(post_id: str, current_user_id: str = Depends(get_current_u
             },
             "message": message
         }
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"点赞操作失败: {str(e)}")
 
@@ -668,87 +1136,752 @@ async def toggle_like(post_id: str, current_user_id: str = Depends(get_current_u
 async def create_comment(
     post_id: str,
     comment_data: CommentCreate,
+    response: Response,
     current_user_id: str = Depends(get_current_user_id)
 ):
     """创建评论"""
     try:
         # 验证便签存在且未删除
-        post_check = supabase.table('posts').select('id').eq('id', post_id).eq('is_deleted', False).execute()
+        post_check = await db_call(supabase.table('posts').select('id').eq('id', post_id).eq('is_deleted', False))
         if not post_check.data:
             raise HTTPException(status_code=404, detail="便签不存在或已删除")
         
-        response = supabase.table('comments').insert({
+        insert_response = await db_call(supabase.table('comments').insert({
             'post_id': post_id,
             'user_id': current_user_id,
             'content': comment_data.content
-        }).execute()
+        }))
+        comment = insert_response.data[0] if insert_response.data else None
+        mark_written(response, current_user_id)
+        
+        # 推送给订阅了该便签的客户端
+        if comment:
+            broadcast_hub.publish([post_topic(post_id)], 'comment.created', comment)
         
         return {
             "success": True,
-            "data": response.data[0] if response.data else None,
+            "data": comment,
             "message": "评论创建成功"
         }
     except HTTPException:
         raise
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建评论失败: {str(e)}")
 
-@app.get("/api/v1/posts/{post_id}/comments")
-async def get_comments_list(post_id: str, page: int = 1, limit: int = 10):
-    """获取便签评论列表"""
+@app.get("/api/v1/posts/{post_id}/comments", response_model=None, responses={200: {"model": ApiResponse[CommentListData]}})
+async def get_comments_list(
+    post_id: str,
+    page: int = 1,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    view: str = "full",
+    fields: Optional[str] = None,
+    source: Repository = Depends(read_repository)
+):
+    """
+    获取便签评论列表（按时间正序，可用 fields 指定字段列表）
+    
+    view=compact 时作者信息只返回昵称（不含头像URL）
+    
+    - 传入 cursor 时按 (created_at, id) 键集分页，沿 idx_comments_live_post_created_at 索引定位，
+      不做 offset 扫描也不统计总数
+    - 不传 cursor 时保持 page/limit 分页
+    两种方式都会在还有下一页时返回 next_cursor
+    """
+    select_fields = build_select(fields, view, COMMENT_FIELDS, COMMENT_COLUMNS, COMMENT_COMPACT_FIELDS, required=COMMENT_CURSOR_FIELDS)
+    after = decode_cursor(cursor) if cursor else None
     try:
-        offset = (page - 1) * limit
+        # 第一步：查询评论数据，多取一条用于判断是否还有下一页
+        comments_data = await source.list_comments(post_id, select_fields, limit + 1, (page - 1) * limit, after)
+        has_more = len(comments_data) > limit
+        comments_data = comments_data[:limit]
         
-        # 第一步：查询评论数据
-        comments_response = supabase.table('comments').select(
-            'id, content, created_at, user_id'
-        ).eq('post_id', post_id).eq('is_deleted', False).order('created_at', desc=False).range(offset, offset + limit - 1).execute()
-        
-        comments_data = comments_response.data
-        
-        # 第二步：获取所有相关用户的ID
-        user_ids = list(set([comment['user_id'] for comment in comments_data]))
-        
-        # 第三步：批量查询用户信息
-        users_data = {}
-        if user_ids:
-            users_response = supabase.table('user_profiles').select(
-                'id, nickname, avatar_url'
-            ).in_('id', user_ids).execute()
-            
-            # 将用户数据转换为字典，方便查找
-            for user in users_response.data:
-                users_data[user['id']] = {
-                    'nickname': user['nickname'],
-                    'avatar_url': user['avatar_url']
-                }
+        # 第二步：批量获取相关用户信息（带缓存）
+        users_data = await fetch_user_profiles(comment['user_id'] for comment in comments_data)
         
-        # 第四步：组合数据
+        # 第三步：组合数据
         for comment in comments_data:
-            user_info = users_data.get(comment['user_id'], {
-                'nickname': '未知用户',
-                'avatar_url': None
+            profile = profile_for(users_data, comment['user_id'])
+            comment['user_profiles'] = {'nickname': profile['nickname']} if view == 'compact' else profile
+        
+        pagination = {
+            "limit": limit,
+            "has_more": has_more,
+        }
+        if has_more:
+            pagination["next_cursor"] = encode_cursor(comments_data[-1])
+        if not after:
+            # 页码分页保留总数统计
+            total_count = await source.count_comments(post_id)
+            pagination.update({
+                "page": page,
+                "total": total_count,
+                "pages": (total_count + limit - 1) // limit
             })
-            comment['user_profiles'] = user_info
         
-        # 获取总数
-        total_count = supabase.table('comments').select('id', count='exact').eq('post_id', post_id).eq('is_deleted', False).execute().count
+        return FastJSONResponse({
+            "success": True,
+            "data": {
+                "comments": comments_data,
+                "pagination": pagination
+            },
+            "message": "评论列表获取成功"
+        })
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取评论列表失败: {str(e)}")
+
+# ================================
+# 增量同步API
+# ================================
+
+# 单次同步最多读取的变更记录数
+SYNC_MAX_CHANGES = 1000
+# 变更日志保留天数，令牌早于保留期的客户端需要全量刷新
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+# 变更日志压缩间隔（秒），0 表示不在本实例压缩
+CHANGE_LOG_COMPACT_INTERVAL = float(os.getenv("CHANGE_LOG_COMPACT_INTERVAL", "3600"))
+
+SYNC_COMMENT_FIELDS = ('id', 'post_id', 'user_id', 'content', 'created_at')
+
+def encode_sync_token(txid: str, change_id: int) -> str:
+    """把变更日志位置 (事务ID, 记录ID) 编码为不透明令牌"""
+    raw = json.dumps([str(txid), int(change_id)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_sync_token(token: str) -> tuple:
+    """
+    解析同步令牌
+    
+    Raises:
+        HTTPException: 令牌格式不合法（400）
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        txid, change_id = json.loads(raw)
+        if not str(txid).isdigit() or not isinstance(change_id, int) or change_id < 0:
+            raise ValueError(token)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="同步令牌不合法")
+    return str(txid), change_id
+
+def compact_change_log() -> int:
+    """删除被覆盖和过期的变更记录，返回删除的行数"""
+    response = db_execute(supabase.rpc('compact_change_log', {'retention_days': CHANGE_LOG_RETENTION_DAYS}))
+    return response.data or 0
+
+async def change_log_compact_loop():
+    """定期压缩变更日志，表的大小只与保留期内变化过的实体数有关"""
+    while True:
+        await asyncio.sleep(CHANGE_LOG_COMPACT_INTERVAL)
+        try:
+            removed = await run_in_threadpool(compact_change_log)
+            if removed:
+                logger.info(f"变更日志压缩删除了 {removed} 条记录")
+        except Exception as e:
+            logger.error(f"变更日志压缩失败: {e}")
+
+@app.get("/api/v1/sync", response_model=None, responses={200: {"model": ApiResponse[SyncData]}})
+async def sync_changes(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=SYNC_MAX_CHANGES),
+    view: str = "full",
+    fields: Optional[str] = None
+):
+    """
+    增量同步：返回同步令牌之后新增或修改的便签、只变了点赞/评论数的便签、评论，以及删除的便签和评论
+    
+    - 不传 since（首次同步）或令牌已过期时返回 reset=true 和新令牌，客户端先保存令牌再用列表接口全量加载
+    - 同一实体在窗口内多次变化只返回一次当前状态
+    - has_more=true 时立即用 next_token 继续同步
+    """
+    select_fields = build_select(fields, view, POST_FIELDS, POST_COLUMNS, POST_COMPACT_FIELDS)
+    since_txid, since_id = decode_sync_token(since) if since else ('0', 0)
+    try:
+        result = await repository.get_changes(since_txid, since_id, limit if since else 1)
+        
+        empty = {
+            "posts": [],
+            "post_counts": [],
+            "comments": [],
+            "deleted": {"posts": [], "comments": []},
+            "has_more": False,
+        }
+        if not since or result['truncated']:
+            return FastJSONResponse({
+                "success": True,
+                "data": {**empty, "next_token": encode_sync_token(result['horizon'], 0), "reset": True},
+                "message": "需要全量刷新"
+            })
+        
+        has_more = result['rows'] >= limit
+        if has_more:
+            next_token = encode_sync_token(result['last_txid'], result['last_id'])
+        elif int(result['horizon']) > int(since_txid):
+            # 快照 xmin 之前的变化已全部返回，下次从 xmin 开始
+            next_token = encode_sync_token(result['horizon'], 0)
+        else:
+            next_token = since
+        
+        # 第一步：按实体类型分组
+        changed = {'post': [], 'post_counts': [], 'comment': []}
+        for change in result['changes']:
+            changed[change['entity']].append(change['entity_id'])
+        post_ids = list(dict.fromkeys(changed['post']))
+        count_ids = [post_id for post_id in dict.fromkeys(changed['post_counts']) if post_id not in post_ids]
+        
+        # 第二步：读取变化实体的当前状态（便签一次查询、评论一次查询）
+        posts_by_id = {}
+        if post_ids or count_ids:
+            post_fields = list(dict.fromkeys(select_fields + ['likes_count', 'comments_count']))
+            posts_by_id = {post['id']: post for post in await repository.get_posts_by_ids(post_ids + count_ids, post_fields)}
+        comments_data = []
+        if changed['comment']:
+            comments_data = await repository.get_comments_by_ids(list(dict.fromkeys(changed['comment'])), list(SYNC_COMMENT_FIELDS))
+        
+        data = {**empty, "has_more": has_more, "next_token": next_token}
+        for post_id in post_ids + count_ids:
+            post = posts_by_id.get(post_id)
+            if post is None or post.pop('is_deleted', False):
+                data['deleted']['posts'].append(post_id)
+            elif post_id in count_ids:
+                data['post_counts'].append({
+                    'id': post_id,
+                    'likes_count': post['likes_count'],
+                    'comments_count': post['comments_count']
+                })
+            else:
+                data['posts'].append(post)
+        comments_by_id = {comment['id']: comment for comment in comments_data}
+        for comment_id in dict.fromkeys(changed['comment']):
+            comment = comments_by_id.get(comment_id)
+            if comment is None or comment.pop('is_deleted', False):
+                data['deleted']['comments'].append(comment_id)
+            else:
+                data['comments'].append(comment)
+        
+        # 第三步：批量获取作者信息（带缓存）
+        users_data = await fetch_user_profiles(
+            [post['user_id'] for post in data['posts']] +
+            [comment['user_id'] for comment in data['comments']]
+        )
+        for item in data['posts'] + data['comments']:
+            item['user_profiles'] = profile_for(users_data, item['user_id'])
+        
+        return FastJSONResponse({
+            "success": True,
+            "data": data,
+            "message": "增量同步成功"
+        })
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"增量同步失败: {str(e)}")
+
+# ================================
+# 打赏相关API
+# ================================
+
+# 每笔打赏固定1元
+REWARD_AMOUNT = 1.00
+# 收益日汇总的日期划分时区，与 database/setup.sql 中的 update_reward_rollups 保持一致
+REWARD_STATS_TIMEZONE = ZoneInfo('Asia/Shanghai')
+# 单次统计查询允许的最大天数
+MAX_REWARD_STATS_DAYS = 3 * 366
+
+# 支付回调共享密钥，由支付网关在 X-Callback-Secret 头中携带
+PAYMENT_CALLBACK_SECRET = os.getenv("PAYMENT_CALLBACK_SECRET")
+
+# 支付回调等待入库结果的最长时间（秒），超时返回503让支付平台重试
+PAYMENT_CALLBACK_TIMEOUT = float(os.getenv("PAYMENT_CALLBACK_TIMEOUT", "10"))
+
+def write_reward_batch(rewards: List[Dict[str, Any]]) -> Dict[str, str]:
+    """一次RPC写入一批打赏回调，返回每条回调的 {幂等键: 结果}"""
+    response = db_execute(supabase.rpc('ingest_rewards', {'rows': rewards}))
+    return {row['idempotency_key']: row['outcome'] for row in response.data or []}
+
+def publish_completed_rewards(rewards: List[Dict[str, Any]]) -> None:
+    """支付完成的打赏计入统计后推送给便签的订阅者"""
+    for reward in rewards:
+        if reward['status'] == 'completed':
+            broadcast_hub.publish([post_topic(reward['post_id'])], 'reward.created', {
+                'post_id': reward['post_id'],
+                'amount': reward['amount']
+            })
+
+reward_ingestor = RewardIngestor(write_reward_batch, on_stored=publish_completed_rewards)
+
+def resolve_stats_range(start_date: Optional[date], end_date: Optional[date]) -> tuple:
+    """
+    统计区间，默认最近30天（含今天）
+    
+    Raises:
+        HTTPException: 区间不合法或过长（400）
+    """
+    end_date = end_date or datetime.now(REWARD_STATS_TIMEZONE).date()
+    start_date = start_date or end_date - timedelta(days=29)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+    if (end_date - start_date).days >= MAX_REWARD_STATS_DAYS:
+        raise HTTPException(status_code=400, detail=f"统计区间不能超过{MAX_REWARD_STATS_DAYS}天")
+    return start_date, end_date
+
+def summarize_rollups(rows: List[Dict[str, Any]], granularity: str) -> Dict[str, Any]:
+    """
+    汇总日汇总行：按天或按月输出序列，并计算区间合计
+    
+    一年的数据最多365行，在应用层合并即可
+    """
+    buckets: Dict[str, Dict[str, Any]] = {}
+    total_count = 0
+    total_amount = 0.0
+    for row in rows:
+        key = row['day'] if granularity == 'day' else row['day'][:7]
+        bucket = buckets.setdefault(key, {'period': key, 'rewards_count': 0, 'rewards_amount': 0.0})
+        bucket['rewards_count'] += row['rewards_count']
+        bucket['rewards_amount'] += float(row['rewards_amount'])
+        total_count += row['rewards_count']
+        total_amount += float(row['rewards_amount'])
+    series = [bucket for bucket in buckets.values() if bucket['rewards_count'] or bucket['rewards_amount']]
+    series.sort(key=lambda bucket: bucket['period'])
+    for bucket in series:
+        bucket['rewards_amount'] = round(bucket['rewards_amount'], 2)
+    return {
+        'granularity': granularity,
+        'total_count': total_count,
+        'total_amount': round(total_amount, 2),
+        'series': series
+    }
+
+@app.post("/api/v1/posts/{post_id}/rewards")
+async def create_reward(
+    post_id: str,
+    reward_data: RewardCreate,
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """
+    创建打赏订单（每人每条便签限一次）
+    
+    交易号由客户端提供、未经验证，记录以 pending 状态写入，不计入便签和收益统计；
+    只有经过验签的支付回调（/api/v1/payments/callback）能把它改为 completed
+    """
+    try:
+        post_check = await db_call(supabase.table('posts').select('id, user_id').eq('id', post_id).eq('is_deleted', False))
+        if not post_check.data:
+            raise HTTPException(status_code=404, detail="便签不存在或已删除")
+        to_user_id = post_check.data[0]['user_id']
+        if to_user_id == current_user_id:
+            raise HTTPException(status_code=400, detail="不能打赏自己的便签")
+        
+        existing = await db_call(supabase.table('rewards').select('id').eq('post_id', post_id).eq('from_user_id', current_user_id))
+        if existing.data:
+            raise HTTPException(status_code=409, detail="已经打赏过该便签")
+        
+        response = await db_call(supabase.table('rewards').insert({
+            'from_user_id': current_user_id,
+            'to_user_id': to_user_id,
+            'post_id': post_id,
+            'amount': REWARD_AMOUNT,
+            'payment_method': reward_data.payment_method,
+            'transaction_id': reward_data.transaction_id,
+            'status': 'pending'
+        }))
+        reward = response.data[0] if response.data else None
+        
+        return {
+            "success": True,
+            "data": reward,
+            "message": "打赏已提交，等待支付确认"
+        }
+    except HTTPException:
+        raise
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"打赏失败: {str(e)}")
+
+@app.post("/api/v1/payments/callback")
+async def payment_callback(callback: RewardCallback, request: Request):
+    """
+    支付回调入口（微信/支付宝，经支付网关验签后转发）
+    
+    回调入队后等待所在批次提交（多个回调合并为一次写库），提交成功才返回成功；
+    写库失败或超时返回503，由支付平台重试。重复投递的回调直接返回成功，不会再次写库；
+    与已有打赏记录不一致（交易号被其他打赏占用等）时返回409，支付平台会重试，需人工核对
+    """
+    provided = request.headers.get('x-callback-secret', '')
+    if not PAYMENT_CALLBACK_SECRET or not hmac.compare_digest(provided, PAYMENT_CALLBACK_SECRET):
+        raise HTTPException(status_code=401, detail="回调鉴权失败")
+    
+    try:
+        outcome = reward_ingestor.submit(callback.model_dump(mode='json'))
+        # shield：请求被取消时不影响同一回调的其他等待者和后台写库
+        outcome = await asyncio.wait_for(asyncio.shield(outcome), PAYMENT_CALLBACK_TIMEOUT)
+    except QueueFullError:
+        # 返回失败，让支付平台稍后重试
+        raise HTTPException(status_code=503, detail="回调处理繁忙，请稍后重试", headers={"Retry-After": "5"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="回调处理超时，请稍后重试", headers={"Retry-After": "5"})
+    
+    if outcome == OUTCOME_FAILED:
+        raise HTTPException(status_code=503, detail="回调写入失败，请稍后重试", headers={"Retry-After": "5"})
+    if outcome == OUTCOME_CONFLICT:
+        raise HTTPException(status_code=409, detail="回调与已有打赏记录不一致，未入账")
+    
+    messages = {
+        OUTCOME_STORED: "回调已处理",
+        OUTCOME_DUPLICATE: "重复回调，已忽略",
+        OUTCOME_IGNORED: "回调无需处理",
+    }
+    return {
+        "success": True,
+        "data": {
+            "transaction_id": callback.transaction_id,
+            "status": outcome
+        },
+        "message": messages[outcome]
+    }
+
+@app.get("/api/v1/rewards")
+async def get_rewards_list(
+    direction: str = Query("received", pattern="^(received|sent)$"),
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """
+    获取当前用户收到（received）或送出（sent）的打赏记录
+    
+    按时间倒序，沿 idx_rewards_to_user_created_at 读取；不统计总数，用 has_more 判断是否有下一页
+    """
+    try:
+        user_column = 'to_user_id' if direction == 'received' else 'from_user_id'
+        offset = (page - 1) * limit
+        response = await db_call(supabase.table('rewards').select(
+            'id, from_user_id, to_user_id, post_id, amount, payment_method, status, created_at'
+        ).eq(user_column, current_user_id).order('created_at', desc=True).range(offset, offset + limit))
+        
+        rewards_data = response.data[:limit]
+        has_more = len(response.data) > limit
+        
+        # 附带对方的昵称和头像
+        counterpart_column = 'from_user_id' if direction == 'received' else 'to_user_id'
+        users_data = await fetch_user_profiles(reward[counterpart_column] for reward in rewards_data)
+        for reward in rewards_data:
+            reward['user_profiles'] = profile_for(users_data, reward[counterpart_column])
         
         return {
             "success": True,
             "data": {
-                "comments": comments_data,
+                "rewards": rewards_data,
                 "pagination": {
                     "page": page,
                     "limit": limit,
-                    "total": total_count,
-                    "pages": (total_count + limit - 1) // limit
+                    "has_more": has_more
                 }
             },
-            "message": "评论列表获取成功"
+            "message": "打赏记录获取成功"
         }
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取评论列表失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取打赏记录失败: {str(e)}")
+
+@app.get("/api/v1/rewards/stats")
+async def get_reward_stats(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    granularity: str = Query("day", pattern="^(day|month)$"),
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """
+    当前用户的收益统计（按天或按月）
+    
+    只读取 reward_daily_user_stats 日汇总表，一年区间最多365行，不扫描打赏明细
+    """
+    start_date, end_date = resolve_stats_range(start_date, end_date)
+    try:
+        response = await db_call(supabase.table('reward_daily_user_stats').select(
+            'day, rewards_count, rewards_amount'
+        ).eq('to_user_id', current_user_id).gte('day', start_date.isoformat()).lte('day', end_date.isoformat()).order('day'))
+        
+        stats = summarize_rollups(response.data, granularity)
+        stats.update({
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat()
+        })
+        return {
+            "success": True,
+            "data": stats,
+            "message": "收益统计获取成功"
+        }
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取收益统计失败: {str(e)}")
+
+@app.get("/api/v1/posts/{post_id}/rewards/stats")
+async def get_post_reward_stats(
+    post_id: str,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    granularity: str = Query("day", pattern="^(day|month)$"),
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """单条便签的收益统计，仅作者可见，读取 reward_daily_post_stats 日汇总表"""
+    start_date, end_date = resolve_stats_range(start_date, end_date)
+    try:
+        # to_user_id 即便签作者，按作者过滤同时完成权限校验
+        response = await db_call(supabase.table('reward_daily_post_stats').select(
+            'day, rewards_count, rewards_amount'
+        ).eq('post_id', post_id).eq('to_user_id', current_user_id).gte(
+            'day', start_date.isoformat()
+        ).lte('day', end_date.isoformat()).order('day'))
+        
+        stats = summarize_rollups(response.data, granularity)
+        stats.update({
+            'post_id': post_id,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat()
+        })
+        return {
+            "success": True,
+            "data": stats,
+            "message": "便签收益统计获取成功"
+        }
+    except UpstreamUnavailable:
+        # 交给全局处理器返回503
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取便签收益统计失败: {str(e)}")
+
+# ================================
+# 管理员批量导入导出API
+# ================================
+
+# 导出格式对应的Content-Type
+EXPORT_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+@app.post("/api/v1/admin/users/stats/reconcile")
+async def admin_reconcile_user_stats(admin_id: str = Depends(require_admin)):
+    """立即执行一次用户统计对账"""
+    fixed = await run_in_threadpool(reconcile_user_stats)
+    return {
+        "success": True,
+        "data": {"fixed": fixed},
+        "message": f"对账完成，修正了 {fixed} 个用户的统计"
+    }
+
+# 采样剖析结果的保存目录，为空时只返回给调用方
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR")
+
+@app.get("/api/v1/admin/profile")
+async def admin_profile(
+    seconds: float = Query(10, gt=0, le=60),
+    interval: float = Query(0.005, ge=0.001, le=1),
+    admin_id: str = Depends(require_admin)
+):
+    """
+    对当前worker进程采样剖析 seconds 秒，返回 folded 格式的调用栈文件
+    
+    可用 flamegraph.pl 生成火焰图，或直接拖入 https://www.speedscope.app 查看；
+    采样在线程池中进行，事件循环照常处理请求
+    """
+    try:
+        stacks, rounds = await run_in_threadpool(stack_sampler.sample, seconds, interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    content = stack_sampler.folded(stacks)
+    filename = f"profile-{os.getpid()}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.folded"
+    if PROFILE_OUTPUT_DIR:
+        output_path = Path(PROFILE_OUTPUT_DIR) / filename
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(content, encoding="utf-8")
+        logger.info(f"采样剖析结果已保存: {output_path}")
+    
+    return StreamingResponse(
+        iter([content.encode("utf-8")]),
+        media_type="text/plain; charset=utf-8",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Profile-Samples": str(rounds)
+        }
+    )
+
+@app.post("/api/v1/admin/posts/import")
+async def admin_import_posts(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    batch_size: int = Form(DEFAULT_BATCH_SIZE),
+    skip_rows: int = Form(0),
+    admin_id: str = Depends(require_admin)
+):
+    """
+    批量导入便签（NDJSON/CSV）
+    
+    逐行流式解析并分批写入；导入中断后可用已返回的 rows_done 设置 skip_rows 续传，
+    携带 id 的行重复导入会被忽略
+    """
+    try:
+        fmt = format or detect_format(file.filename or '')
+        if fmt not in SUPPORTED_FORMATS:
+            raise ValueError(f"不支持的格式: {fmt}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        importer = PostImporter(supabase, PostImport, batch_size=max(1, min(batch_size, 10000)))
+        text_stream = io.TextIOWrapper(file.file, encoding='utf-8', newline='')
+        stats = await run_in_threadpool(importer.run, iter_records(text_stream, fmt), skip_rows)
+        
+        return {
+            "success": True,
+            "data": stats.to_dict(),
+            "message": "便签导入完成"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"导入便签失败: {str(e)}")
+
+@app.get("/api/v1/admin/posts/export")
+async def admin_export_posts(
+    format: str = "ndjson",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    after_created_at: Optional[str] = None,
+    after_id: Optional[str] = None,
+    include_deleted: bool = False,
+    admin_id: str = Depends(require_admin)
+):
+    """
+    流式导出便签（NDJSON/CSV）
+    
+    按 (created_at, id) 升序输出；传入上次导出最后一行的 created_at 和 id 可续传
+    """
+    if format not in SUPPORTED_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+    
+    cursor = None
+    if after_created_at or after_id:
+        try:
+            cursor = parse_export_cursor(after_created_at, after_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="after_created_at 须为ISO时间，after_id 须为UUID，且需同时提供")
+    
+    rows = iter_posts(supabase, max(1, min(batch_size, 10000)), cursor, include_deleted)
+    # 同步生成器由Starlette在线程池中迭代，不阻塞事件循环
+    return StreamingResponse(
+        encode_records(rows, format, include_header=cursor is None),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="posts.{format}"'}
+    )
+
+# ================================
+# 实时推送API
+# ================================
+
+@app.get("/api/v1/stream")
+async def stream_events(request: Request, topics: List[str] = Query(default=[FEED_TOPIC])):
+    """
+    Server-Sent Events 实时推送
+    
+    topics 可重复或逗号分隔，支持 "feed"（新便签和点赞数）和 "post:<id>"（单个便签的点赞和评论）
+    """
+    try:
+        topic_list = parse_topics(topics)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def event_stream():
+        subscription = broadcast_hub.subscribe(topic_list)
+        try:
+            # 断线后客户端3秒重连
+            yield "retry: 3000\n\n"
+            while True:
+                frames = await subscription.next_batch(HEARTBEAT_SECONDS)
+                if await request.is_disconnected():
+                    break
+                if frames is None:
+                    # 心跳，防止代理断开空闲连接
+                    yield ": ping\n\n"
+                else:
+                    yield "".join(format_sse(frame) for frame in frames)
+        finally:
+            broadcast_hub.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+@app.websocket("/api/v1/ws")
+async def websocket_events(websocket: WebSocket, topics: List[str] = Query(default=[FEED_TOPIC])):
+    """
+    WebSocket 实时推送
+    
+    客户端可发送 {"action": "subscribe" | "unsubscribe", "topics": [...]} 调整订阅，
+    发送 {"action": "ping"} 会收到 pong
+    """
+    try:
+        topic_list = parse_topics(topics)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    subscription = broadcast_hub.subscribe(topic_list)
+    
+    async def receive_commands():
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except WebSocketDisconnect:
+                return
+            except ValueError:
+                # 忽略非JSON消息
+                continue
+            action = message.get('action') if isinstance(message, dict) else None
+            if action == 'ping':
+                await websocket.send_text('{"event":"pong","data":{}}')
+            elif action in ('subscribe', 'unsubscribe') and message.get('topics'):
+                try:
+                    changed = parse_topics(message['topics'])
+                except (ValueError, AttributeError, TypeError):
+                    continue
+                if action == 'subscribe':
+                    broadcast_hub.update_topics(subscription, add=changed)
+                else:
+                    broadcast_hub.update_topics(subscription, remove=changed)
+    
+    receiver = asyncio.create_task(receive_commands())
+    try:
+        while not receiver.done():
+            frames = await subscription.next_batch(HEARTBEAT_SECONDS)
+            if frames is None:
+                await websocket.send_text('{"event":"ping","data":{}}')
+            else:
+                for frame in frames:
+                    await websocket.send_text(format_ws(frame))
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        receiver.cancel()
+        broadcast_hub.unsubscribe(subscription)
 
 # ================================
 # 启动信息
@@ -763,7 +1896,7 @@ async def startup_event():
     
     # 测试数据库连接
     try:
-        supabase.table('user_profiles').select('count').limit(1).execute()
+        await db_call(supabase.table('user_profiles').select('count').limit(1))
         print("✅ Supabase 数据库连接正常")
     except Exception as e:
         print(f"❌ Supabase 数据库连接失败: {e}")
@@ -779,6 +1912,42 @@ async def startup_event():
     print(f"   - 高德地图 API: {'✅ 已配置' if AMAP_API_KEY else '❌ 未配置'}")
     print(f"   - OpenWeatherMap API: {'✅ 已配置' if OPENWEATHERMAP_API_KEY else '❌ 未配置'}")
     print(f"   - Supabase: {'✅ 已配置' if SUPABASE_URL and SUPABASE_KEY else '❌ 未配置'}")
+    
+    # 创建直连数据库连接池（DB_BACKEND=asyncpg 时）
+    try:
+        await repository.startup()
+        print(f"✅ 数据访问层: {DB_BACKEND}")
+    except Exception as e:
+        print(f"❌ 数据库连接池创建失败: {e}")
+    # 只读副本：连接失败的副本由健康检查标记为不可用，读请求回到主库
+    await db_router.startup()
+    if DB_READ_REPLICAS:
+        print(f"✅ 只读副本: {len(DB_READ_REPLICAS)} 个")
+    
+    # 启动支付回调批量入库任务和后台任务队列
+    reward_ingestor.start()
+    task_queue.start()
+    invalidation_bus.start()
+    
+    # 启动用户统计定期对账
+    if USER_STATS_RECONCILE_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(user_stats_reconcile_loop()))
+    # 启动变更日志定期压缩
+    if CHANGE_LOG_COMPACT_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(change_log_compact_loop()))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭事件"""
+    for task in background_tasks:
+        task.cancel()
+    # 先写完已接收的支付回调、等待执行中的后台任务，再关闭上游连接
+    await reward_ingestor.stop()
+    await task_queue.stop()
+    await invalidation_bus.stop()
+    await db_router.shutdown()
+    await repository.shutdown()
+    await close_upstreams()
 
 if __name__ == "__main__":
     import uvicorn
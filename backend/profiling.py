@@ -0,0 +1,198 @@
+"""
+请求级性能剖析
+按需统计单个请求各阶段耗时并通过 Server-Timing 响应头返回，以及对整个worker进程做采样剖析
+
+- 请求携带 X-Profile 头或按采样比例命中时启用，未启用的请求只多一次 contextvar 读取
+- 代码中用 timed("阶段名") 包裹耗时操作（JWT校验、Supabase查询、上游HTTP、JSON序列化），
+  同名阶段累加耗时和次数
+- StackSampler 定时采集所有线程的调用栈，输出 folded 格式（flamegraph.pl / speedscope 可直接打开）
+"""
+
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+
+class RequestTimer:
+    """单个请求的阶段耗时：阶段名 -> [累计秒数, 次数]"""
+
+    __slots__ = ("started", "phases")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, List[float]] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        entry = self.phases.get(name)
+        if entry is None:
+            self.phases[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def server_timing(self) -> str:
+        """生成 Server-Timing 头，total 为从进入中间件到响应开始的耗时"""
+        parts = []
+        for name, (seconds, count) in self.phases.items():
+            part = f"{name};dur={seconds * 1000:.2f}"
+            if count > 1:
+                part += f';desc="{int(count)}x"'
+            parts.append(part)
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current_timer: contextvars.ContextVar[Optional[RequestTimer]] = contextvars.ContextVar("request_timer", default=None)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """记录代码块耗时到当前请求（未启用剖析时不做任何事）；同步、异步代码中均可使用"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.record(name, time.perf_counter() - started)
+
+
+class ProfilingMiddleware:
+    """
+    为启用剖析的请求添加 Server-Timing 响应头
+
+    Args:
+        sample_rate: 自动采样比例（0~1）
+        token: X-Profile 头需要匹配的值；为空时任意非空值都可启用
+        allow_header: 是否允许通过 X-Profile 头启用
+    """
+
+    def __init__(self, app, sample_rate: float = 0.0, token: Optional[str] = None, allow_header: bool = True):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.token = token.encode() if token else None
+        self.allow_header = allow_header
+        self.profiled = 0
+
+    def _enabled(self, scope) -> bool:
+        if self.allow_header:
+            for name, value in scope.get("headers", ()):
+                if name == PROFILE_HEADER:
+                    if self.token is None:
+                        return bool(value) and value != b"0"
+                    return value == self.token
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._enabled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self.profiled += 1
+        timer = RequestTimer()
+        token = _current_timer.set(timer)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timer.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_timer.reset(token)
+
+
+# ================================
+# 进程采样剖析
+# ================================
+
+class StackSampler:
+    """
+    调用栈采样器
+
+    在后台线程中每隔 interval 秒读取一次所有线程的栈（sys._current_frames），
+    相同栈累计次数，输出 folded 格式：每行 "线程;外层帧;...;内层帧 次数"
+
+    Args:
+        interval: 采样间隔（秒）
+        max_depth: 单个栈最多保留的帧数
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def _stack(self, frame, thread_name: str) -> str:
+        frames: List[str] = []
+        while frame is not None and len(frames) < self.max_depth:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ";".join(reversed(frames))
+
+    def sample(self, seconds: float, interval: Optional[float] = None) -> Tuple[Counter, int]:
+        """
+        阻塞采样 seconds 秒（应在线程池中调用）
+
+        Args:
+            interval: 本次采样的间隔（秒），默认使用 self.interval；被拒绝的并发请求不会影响进行中的采样
+
+        Returns:
+            (folded栈 -> 次数, 采样轮数)
+
+        Raises:
+            RuntimeError: 已有采样在进行
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("已有采样在进行中")
+        interval = interval or self.interval
+        try:
+            me = threading.get_ident()
+            stacks: Counter = Counter()
+            rounds = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stacks[self._stack(frame, names.get(ident, f"thread-{ident}"))] += 1
+                rounds += 1
+                time.sleep(interval)
+            return stacks, rounds
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def folded(stacks: Counter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+stack_sampler = StackSampler()
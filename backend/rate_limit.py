@@ -0,0 +1,204 @@
+"""
+限流模块
+基于 GCRA（通用信元速率算法，令牌桶的等价形式）的按路由限流中间件
+
+- 已登录请求按 JWT 的 sub 计数，未登录请求按客户端IP计数
+- 默认使用进程内存储：每个键只保存一个浮点数（理论到达时间），过期惰性清理
+- 超限返回 429 并带 Retry-After 头
+- 存储通过 RateLimitStore 抽象，后续可替换为 Redis 等共享后端
+"""
+
+from abc import ABC, abstractmethod
+import math
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from auth import jwt_handler
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 是否信任反向代理传入的 X-Forwarded-For（Zeabur 等平台部署时开启）
+TRUST_PROXY_HEADERS = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+
+# 限流键类型
+KEY_BY_USER = "user"          # 仅按用户（无Token时退化为IP）
+KEY_BY_IP = "ip"              # 仅按IP
+
+
+class RateLimitRule:
+    """
+    单条限流规则
+
+    Args:
+        name: 规则名，作为限流键前缀
+        method: HTTP方法
+        path: 路由模板，如 /api/v1/posts/{post_id}/like
+        rate: 周期内允许的请求数
+        period: 周期（秒）
+        burst: 允许的突发请求数
+        key_by: 限流键类型（user / ip）
+    """
+
+    __slots__ = ("name", "method", "pattern", "rate", "period", "burst", "key_by", "emission_interval", "burst_tolerance")
+
+    def __init__(self, name: str, method: str, path: str, rate: int, period: float = 60.0, burst: Optional[int] = None, key_by: str = KEY_BY_USER):
+        self.name = name
+        self.method = method.upper()
+        self.pattern = re.compile("^" + re.sub(r"\{[^/]+\}", "[^/]+", path) + "/?$")
+        self.rate = rate
+        self.period = period
+        self.burst = burst or rate
+        self.key_by = key_by
+        # 每个请求占用的时间间隔，以及允许提前消耗的额度
+        self.emission_interval = period / rate
+        self.burst_tolerance = self.emission_interval * self.burst
+
+
+class RateLimitStore(ABC):
+    """限流存储接口"""
+
+    @abstractmethod
+    async def hit(self, key: str, rule: RateLimitRule, now: float) -> Tuple[bool, float, int]:
+        """
+        记录一次请求
+
+        Returns:
+            (是否允许, 需要等待的秒数, 剩余可用次数)
+        """
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    进程内GCRA存储
+
+    每个键只保存理论到达时间（TAT），TAT早于当前时间的条目等同于不存在；
+    每次写入时顺带清理少量最旧的过期条目，清理成本均摊为O(1)
+    """
+
+    # 每次写入最多检查的旧条目数
+    SWEEP_BATCH = 8
+
+    def __init__(self):
+        self._tat: Dict[str, float] = {}
+
+    async def hit(self, key: str, rule: RateLimitRule, now: float) -> Tuple[bool, float, int]:
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        new_tat = tat + rule.emission_interval
+        allow_at = new_tat - rule.burst_tolerance
+        if now < allow_at:
+            return False, allow_at - now, 0
+
+        # 重新插入使字典按最近写入排序，旧条目集中在头部
+        self._tat.pop(key, None)
+        self._tat[key] = new_tat
+        self._sweep(now)
+        remaining = int((now - allow_at) / rule.emission_interval)
+        return True, 0.0, remaining
+
+    def _sweep(self, now: float) -> None:
+        """惰性清理头部已过期的条目"""
+        for _ in range(self.SWEEP_BATCH):
+            key = next(iter(self._tat), None)
+            if key is None or self._tat[key] >= now:
+                return
+            del self._tat[key]
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+def _client_ip(scope) -> str:
+    """获取客户端IP"""
+    if TRUST_PROXY_HEADERS:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _user_id(scope) -> Optional[str]:
+    """从 Authorization 头中解析并验证 JWT，返回用户ID"""
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return jwt_handler.verify_token(token).get("sub")
+            except Exception:
+                # Token无效时按IP限流，由路由自身返回401
+                return None
+    return None
+
+
+class RateLimitMiddleware:
+    """
+    ASGI限流中间件
+
+    只对命中规则的请求做计算，其他请求直接放行
+    """
+
+    def __init__(self, app, rules: Iterable[RateLimitRule], store: Optional[RateLimitStore] = None, enabled: bool = True):
+        self.app = app
+        self.store = store or MemoryRateLimitStore()
+        self.enabled = enabled
+        # 按HTTP方法分组，减少匹配次数
+        self._rules: Dict[str, List[RateLimitRule]] = {}
+        for rule in rules:
+            self._rules.setdefault(rule.method, []).append(rule)
+        self.rejected = 0
+
+    def _match(self, method: str, path: str) -> Optional[RateLimitRule]:
+        for rule in self._rules.get(method, ()):
+            if rule.pattern.match(path):
+                return rule
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rule = self._match(scope["method"], scope["path"])
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        identity = None
+        if rule.key_by == KEY_BY_USER:
+            user_id = _user_id(scope)
+            if user_id:
+                identity = f"u:{user_id}"
+        if identity is None:
+            identity = f"ip:{_client_ip(scope)}"
+
+        allowed, retry_after, remaining = await self.store.hit(f"{rule.name}:{identity}", rule, time.monotonic())
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+
+        self.rejected += 1
+        body = '{"detail":"请求过于频繁，请稍后再试"}'.encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+                (b"x-ratelimit-limit", str(rule.rate).encode()),
+                (b"x-ratelimit-remaining", str(remaining).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
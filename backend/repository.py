@@ -0,0 +1,434 @@
+"""
+数据访问层
+便签、评论、用户资料的读查询，提供两种后端，路由代码对两者一致
+
+- SupabaseRepository：通过 supabase 客户端访问 PostgREST（默认）
+- AsyncpgRepository：asyncpg 连接池直连 Postgres，省去 PostgREST 的HTTP往返和JSON转码；
+  语句由 asyncpg 按连接缓存为预编译语句，多查询的路由（如便签详情）合并为一次往返
+
+两种后端返回相同结构的字典：UUID 和时间为字符串，金额为 float，JSONB 为 dict
+
+通过 DB_BACKEND=supabase|asyncpg 选择，asyncpg 后端需要 DATABASE_URL
+"""
+
+from abc import ABC, abstractmethod
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+import logging
+
+from profiling import timed
+from resilience import Upstream, UpstreamError
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover - 可选依赖，只有 asyncpg 后端需要
+    asyncpg = None
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BACKEND_SUPABASE = "supabase"
+BACKEND_ASYNCPG = "asyncpg"
+
+# 排序方式
+SORT_LATEST = "latest"
+SORT_HOTTEST = "hottest"
+
+# 可选字段：字段名 -> (PostgREST select 表达式, SQL 表达式)
+# JSONB 中的单个值由数据库提取，不返回整个对象
+POST_FIELDS: Dict[str, Tuple[str, str]] = {
+    'id': ('id', 'id'),
+    'user_id': ('user_id', 'user_id'),
+    'content': ('content', 'content'),
+    'image_url': ('image_url', 'image_url'),
+    'audio_url': ('audio_url', 'audio_url'),
+    'location_data': ('location_data', 'location_data'),
+    'weather_data': ('weather_data', 'weather_data'),
+    'likes_count': ('likes_count', 'likes_count'),
+    'comments_count': ('comments_count', 'comments_count'),
+    'rewards_count': ('rewards_count', 'rewards_count'),
+    'rewards_amount': ('rewards_amount', 'rewards_amount'),
+    'created_at': ('created_at', 'created_at'),
+    'location_name': ('location_name:location_data->>name', "location_data->>'name'"),
+    'weather_icon': ('weather_icon:weather_data->weather->>icon_code', "weather_data->'weather'->>'icon_code'"),
+}
+
+COMMENT_FIELDS: Dict[str, Tuple[str, str]] = {
+    'id': ('id', 'id'),
+    'post_id': ('post_id', 'post_id'),
+    'user_id': ('user_id', 'user_id'),
+    'content': ('content', 'content'),
+    'created_at': ('created_at', 'created_at'),
+    'updated_at': ('updated_at', 'updated_at'),
+}
+
+
+def _postgrest_select(fields: Iterable[str], available: Dict[str, Tuple[str, str]]) -> str:
+    return ', '.join(available[name][0] for name in fields)
+
+
+def _sql_select(fields: Iterable[str], available: Dict[str, Tuple[str, str]], alias: str = '') -> str:
+    """字段名均来自白名单，可以直接拼入SQL"""
+    prefix = f"{alias}." if alias else ''
+    columns = []
+    for name in fields:
+        expression = available[name][1]
+        if expression == name:
+            columns.append(f"{prefix}{name}")
+        else:
+            columns.append(f"({prefix}{expression}) AS {name}")
+    return ', '.join(columns)
+
+
+class Repository(ABC):
+    """数据访问接口，后端需实现全部抽象方法"""
+
+    async def startup(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @abstractmethod
+    async def get_post(self, post_id: str, fields: List[str], viewer_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """未删除的便签，不存在时返回 None；传入 viewer_id 时附带 is_liked"""
+
+    @abstractmethod
+    async def list_posts(self, fields: List[str], offset: int, limit: int, sort: str = SORT_LATEST, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def count_posts(self, user_id: Optional[str] = None) -> int:
+        ...
+
+    @abstractmethod
+    async def get_posts_by_ids(self, post_ids: List[str], fields: List[str]) -> List[Dict[str, Any]]:
+        """按ID批量读取（包含已删除的，附带 is_deleted）"""
+
+    @abstractmethod
+    async def get_liked_post_ids(self, user_id: str, post_ids: List[str]) -> Set[str]:
+        ...
+
+    @abstractmethod
+    async def get_user_profiles(self, user_ids: List[str]) -> List[Dict[str, Any]]:
+        """[{'id', 'nickname', 'avatar_url'}]"""
+
+    @abstractmethod
+    async def list_comments(self, post_id: str, fields: List[str], limit: int, offset: int = 0, after: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """按 (created_at, id) 升序；传入 after 时从游标之后读取，否则按 offset"""
+
+    @abstractmethod
+    async def count_comments(self, post_id: str) -> int:
+        ...
+
+    @abstractmethod
+    async def get_comment_previews(self, post_ids: List[str], per_post: int) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_comments_by_ids(self, comment_ids: List[str], fields: List[str]) -> List[Dict[str, Any]]:
+        """按ID批量读取评论（包含已删除的，附带 is_deleted）"""
+
+    @abstractmethod
+    async def get_changes(self, since_txid: str, since_id: int, limit: int) -> Dict[str, Any]:
+        """变更日志中令牌位置之后的变化，结构见 database/setup.sql 的 get_changes"""
+
+    @abstractmethod
+    async def replica_status(self) -> Dict[str, Any]:
+        """{'is_replica', 'lsn', 'now'}：WAL位置（主库为当前插入位置，备库为已回放位置）和本库时钟"""
+
+
+# ================================
+# Supabase（PostgREST）后端
+# ================================
+
+class SupabaseRepository(Repository):
+    """
+    Args:
+        client_getter: 返回当前 supabase 客户端的函数
+        execute: 执行查询的协程函数（经过熔断器，在线程池中调用同步客户端），只读的 rpc 调用时传 idempotent=True 以允许重试
+    """
+
+    def __init__(self, client_getter: Callable[[], Any], execute: Callable[..., Awaitable[Any]]):
+        self._client_getter = client_getter
+        self.execute = execute
+
+    @property
+    def client(self):
+        return self._client_getter()
+
+    async def get_post(self, post_id, fields, viewer_id=None):
+        response = await self.execute(self.client.table('posts').select(
+            _postgrest_select(fields, POST_FIELDS)
+        ).eq('id', post_id).eq('is_deleted', False).limit(1))
+        if not response.data:
+            return None
+        post = response.data[0]
+        if viewer_id:
+            like_response = await self.execute(self.client.table('likes').select('id').eq('post_id', post_id).eq('user_id', viewer_id))
+            post['is_liked'] = len(like_response.data) > 0
+        return post
+
+    async def list_posts(self, fields, offset, limit, sort=SORT_LATEST, user_id=None):
+        query = self.client.table('posts').select(_postgrest_select(fields, POST_FIELDS)).eq('is_deleted', False)
+        if user_id:
+            query = query.eq('user_id', user_id)
+        if sort == SORT_HOTTEST:
+            query = query.order('likes_count', desc=True)
+        else:
+            query = query.order('created_at', desc=True)
+        # id 作为并列时的次序，与部分索引的列顺序一致
+        query = query.order('id', desc=False)
+        return (await self.execute(query.range(offset, offset + limit - 1))).data
+
+    async def count_posts(self, user_id=None):
+        query = self.client.table('posts').select('id', count='exact').eq('is_deleted', False)
+        if user_id:
+            query = query.eq('user_id', user_id)
+        return (await self.execute(query)).count
+
+    async def get_posts_by_ids(self, post_ids, fields):
+        return (await self.execute(self.client.table('posts').select(
+            _postgrest_select(fields, POST_FIELDS) + ', is_deleted'
+        ).in_('id', post_ids))).data
+
+    async def get_liked_post_ids(self, user_id, post_ids):
+        response = await self.execute(self.client.table('likes').select('post_id').eq(
+            'user_id', user_id
+        ).in_('post_id', post_ids))
+        return {like['post_id'] for like in response.data}
+
+    async def get_user_profiles(self, user_ids):
+        return (await self.execute(self.client.table('user_profiles').select(
+            'id, nickname, avatar_url'
+        ).in_('id', user_ids))).data
+
+    async def list_comments(self, post_id, fields, limit, offset=0, after=None):
+        query = self.client.table('comments').select(
+            _postgrest_select(fields, COMMENT_FIELDS)
+        ).eq('post_id', post_id).eq('is_deleted', False)
+        if after:
+            # gte 让扫描从 (post_id, created_at) 索引的游标位置开始，or 再排除起点上已返回的行
+            query = query.gte('created_at', after['created_at']).or_(
+                f'created_at.gt."{after["created_at"]}",'
+                f'and(created_at.eq."{after["created_at"]}",id.gt."{after["id"]}")'
+            )
+        query = query.order('created_at', desc=False).order('id', desc=False)
+        if after:
+            query = query.limit(limit)
+        else:
+            query = query.range(offset, offset + limit - 1)
+        return (await self.execute(query)).data
+
+    async def count_comments(self, post_id):
+        return (await self.execute(self.client.table('comments').select(
+            'id', count='exact'
+        ).eq('post_id', post_id).eq('is_deleted', False))).count
+
+    async def get_comment_previews(self, post_ids, per_post):
+        response = await self.execute(self.client.rpc('get_comment_previews', {
+            'post_ids': post_ids,
+            'per_post': per_post
+        }), idempotent=True)
+        return response.data or []
+
+    async def get_comments_by_ids(self, comment_ids, fields):
+        return (await self.execute(self.client.table('comments').select(
+            _postgrest_select(fields, COMMENT_FIELDS) + ', is_deleted'
+        ).in_('id', comment_ids))).data
+
+    async def get_changes(self, since_txid, since_id, limit):
+        return (await self.execute(self.client.rpc('get_changes', {
+            'since_txid': since_txid,
+            'since_id': since_id,
+            'max_rows': limit
+        }), idempotent=True)).data
+
+    async def replica_status(self):
+        return (await self.execute(self.client.rpc('replica_status'), idempotent=True)).data
+
+
+# ================================
+# asyncpg 直连后端
+# ================================
+
+def _json_value(value: Any) -> Any:
+    """把 asyncpg 返回的类型转换为与 PostgREST 一致的JSON值"""
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _row(record) -> Dict[str, Any]:
+    return {key: _json_value(value) for key, value in record.items()}
+
+
+class AsyncpgRepository(Repository):
+    """
+    Args:
+        dsn: Postgres连接串（Supabase 需使用直连或 session 模式连接池地址）
+        upstream: 容错包装（超时、熔断，读查询重试）
+        min_size / max_size: 连接池大小
+        statement_cache_size: 每个连接缓存的预编译语句数；经过 transaction 模式的 pgbouncer 时需设为0
+    """
+
+    def __init__(self, dsn: str, upstream: Upstream, min_size: int = 2, max_size: int = 10, statement_cache_size: int = 256):
+        if asyncpg is None:
+            raise RuntimeError("DB_BACKEND=asyncpg 需要安装 asyncpg")
+        self.dsn = dsn
+        self.upstream = upstream
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.pool = None
+
+    @staticmethod
+    async def _init_connection(connection) -> None:
+        # JSONB 直接解码为 dict，与 PostgREST 返回一致
+        await connection.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+        await connection.set_type_codec('json', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+    async def startup(self) -> None:
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            statement_cache_size=self.statement_cache_size,
+            init=self._init_connection,
+        )
+        logger.info(f"asyncpg 连接池已创建（{self.min_size}-{self.max_size}）")
+
+    async def shutdown(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _call(self, method: str, sql: str, *args):
+        """执行只读查询：连接类错误计入熔断并重试，SQL错误原样抛出"""
+        async def run():
+            try:
+                return await getattr(self.pool, method)(sql, *args)
+            except (OSError, asyncpg.exceptions.PostgresConnectionError, asyncpg.exceptions.TooManyConnectionsError) as e:
+                raise UpstreamError(f"Postgres连接错误: {e}")
+
+        with timed("db"):
+            return await self.upstream.call(run)
+
+    async def _fetch(self, sql: str, *args) -> List[Dict[str, Any]]:
+        return [_row(record) for record in await self._call('fetch', sql, *args)]
+
+    async def get_post(self, post_id, fields, viewer_id=None):
+        # 便签和点赞状态在一条语句中查询
+        liked = "EXISTS (SELECT 1 FROM likes l WHERE l.post_id = p.id AND l.user_id = $2::uuid) AS is_liked" if viewer_id else None
+        columns = _sql_select(fields, POST_FIELDS, 'p') + (f", {liked}" if liked else '')
+        sql = f"SELECT {columns} FROM posts p WHERE p.id = $1::uuid AND p.is_deleted = FALSE"
+        args = [post_id] + ([viewer_id] if viewer_id else [])
+        rows = await self._fetch(sql, *args)
+        return rows[0] if rows else None
+
+    async def list_posts(self, fields, offset, limit, sort=SORT_LATEST, user_id=None):
+        order = "likes_count DESC, id" if sort == SORT_HOTTEST else "created_at DESC, id"
+        if user_id:
+            sql = f"SELECT {_sql_select(fields, POST_FIELDS)} FROM posts WHERE is_deleted = FALSE AND user_id = $3::uuid ORDER BY {order} OFFSET $1 LIMIT $2"
+            return await self._fetch(sql, offset, limit, user_id)
+        sql = f"SELECT {_sql_select(fields, POST_FIELDS)} FROM posts WHERE is_deleted = FALSE ORDER BY {order} OFFSET $1 LIMIT $2"
+        return await self._fetch(sql, offset, limit)
+
+    async def count_posts(self, user_id=None):
+        if user_id:
+            return await self._call('fetchval', "SELECT COUNT(*) FROM posts WHERE is_deleted = FALSE AND user_id = $1::uuid", user_id)
+        return await self._call('fetchval', "SELECT COUNT(*) FROM posts WHERE is_deleted = FALSE")
+
+    async def get_posts_by_ids(self, post_ids, fields):
+        sql = f"SELECT {_sql_select(fields, POST_FIELDS)}, is_deleted FROM posts WHERE id = ANY($1::uuid[])"
+        return await self._fetch(sql, post_ids)
+
+    async def get_liked_post_ids(self, user_id, post_ids):
+        rows = await self._fetch(
+            "SELECT post_id FROM likes WHERE user_id = $1::uuid AND post_id = ANY($2::uuid[])",
+            user_id, post_ids
+        )
+        return {row['post_id'] for row in rows}
+
+    async def get_user_profiles(self, user_ids):
+        return await self._fetch(
+            "SELECT id, nickname, avatar_url FROM user_profiles WHERE id = ANY($1::uuid[])",
+            list(user_ids)
+        )
+
+    async def list_comments(self, post_id, fields, limit, offset=0, after=None):
+        columns = _sql_select(fields, COMMENT_FIELDS)
+        if after:
+            # 行比较可以直接沿 (post_id, created_at) 索引定位
+            sql = (
+                f"SELECT {columns} FROM comments "
+                "WHERE post_id = $1::uuid AND is_deleted = FALSE AND (created_at, id) > ($2::timestamptz, $3::uuid) "
+                "ORDER BY created_at, id LIMIT $4"
+            )
+            return await self._fetch(sql, post_id, datetime.fromisoformat(after['created_at']), after['id'], limit)
+        sql = (
+            f"SELECT {columns} FROM comments "
+            "WHERE post_id = $1::uuid AND is_deleted = FALSE "
+            "ORDER BY created_at, id OFFSET $2 LIMIT $3"
+        )
+        return await self._fetch(sql, post_id, offset, limit)
+
+    async def count_comments(self, post_id):
+        return await self._call(
+            'fetchval',
+            "SELECT COUNT(*) FROM comments WHERE post_id = $1::uuid AND is_deleted = FALSE",
+            post_id
+        )
+
+    async def get_comment_previews(self, post_ids, per_post):
+        return await self._fetch("SELECT * FROM get_comment_previews($1::uuid[], $2)", post_ids, per_post)
+
+    async def get_comments_by_ids(self, comment_ids, fields):
+        sql = f"SELECT {_sql_select(fields, COMMENT_FIELDS)}, is_deleted FROM comments WHERE id = ANY($1::uuid[])"
+        return await self._fetch(sql, comment_ids)
+
+    async def get_changes(self, since_txid, since_id, limit):
+        return await self._call('fetchval', "SELECT get_changes($1, $2, $3)", since_txid, since_id, limit)
+
+    async def replica_status(self):
+        return await self._call('fetchval', "SELECT replica_status()")
+
+
+def create_repository(
+    backend: str,
+    supabase_getter: Callable[[], Any],
+    supabase_execute: Callable[..., Awaitable[Any]],
+    postgres_upstream: Optional[Upstream] = None,
+    dsn: Optional[str] = None,
+) -> Repository:
+    """
+    根据 DB_BACKEND 创建数据访问层
+
+    asyncpg 后端读取 DATABASE_URL（dsn 参数优先，用于只读副本）、DB_POOL_MIN_SIZE、DB_POOL_MAX_SIZE、DB_STATEMENT_CACHE_SIZE
+    """
+    if backend == BACKEND_ASYNCPG:
+        dsn = dsn or os.getenv("DATABASE_URL")
+        if not dsn:
+            raise ValueError("DB_BACKEND=asyncpg 需要配置 DATABASE_URL")
+        return AsyncpgRepository(
+            dsn,
+            postgres_upstream,
+            min_size=int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256")),
+        )
+    if backend != BACKEND_SUPABASE:
+        raise ValueError(f"不支持的 DB_BACKEND: {backend}")
+    return SupabaseRepository(supabase_getter, supabase_execute)
@@ -0,0 +1,325 @@
+"""
+上游依赖容错模块
+为高德地图、OpenWeatherMap、Supabase 等上游服务提供超时、重试和熔断
+
+- 超时：每个上游单独配置，避免慢请求长期占用worker
+- 重试：只对幂等读请求生效，使用带抖动的指数退避
+- 熔断：连续失败达到阈值后打开，冷却期后进入半开状态放行少量探测请求，
+  探测成功则关闭，失败则重新打开
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+import logging
+
+import httpx
+
+from profiling import timed
+
+try:
+    from postgrest.exceptions import APIError
+except ImportError:  # pragma: no cover - 只有 Supabase 客户端会抛出
+    APIError = None
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class UpstreamError(Exception):
+    """上游返回了可重试的错误（5xx、429等）"""
+
+
+class UpstreamUnavailable(Exception):
+    """上游不可用：熔断器打开或重试耗尽"""
+
+    def __init__(self, upstream: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    Args:
+        failure_threshold: 连续失败多少次后打开
+        recovery_timeout: 打开后多久进入半开状态（秒）
+        half_open_max_calls: 半开状态下同时放行的探测请求数
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.total_failures = 0
+        self.total_rejected = 0
+
+    def allow(self) -> bool:
+        """当前是否允许发起请求"""
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                self.total_rejected += 1
+                return False
+            self.state = STATE_HALF_OPEN
+            self.half_open_calls = 0
+            logger.info("熔断器进入半开状态，开始探测")
+        if self.half_open_calls >= self.half_open_max_calls:
+            self.total_rejected += 1
+            return False
+        self.half_open_calls += 1
+        return True
+
+    def record_success(self) -> None:
+        if self.state != STATE_CLOSED:
+            logger.info("探测成功，熔断器关闭")
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.half_open_calls = 0
+
+    def release(self) -> None:
+        """请求被取消、未得出结论时归还半开探测名额"""
+        if self.state == STATE_HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def record_failure(self) -> None:
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != STATE_OPEN:
+                logger.warning(f"连续失败 {self.consecutive_failures} 次，熔断器打开")
+            self.state = STATE_OPEN
+            self.opened_at = time.monotonic()
+            self.half_open_calls = 0
+
+    def retry_after(self) -> float:
+        """熔断打开时距离下次探测的秒数"""
+        if self.state != STATE_OPEN:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "total_rejected": self.total_rejected,
+            "retry_after_seconds": round(self.retry_after(), 1),
+        }
+
+
+class RetryPolicy:
+    """
+    重试策略（full jitter 指数退避）
+
+    Args:
+        attempts: 总尝试次数（含第一次）
+        base_delay: 退避基数（秒）
+        max_delay: 单次退避上限（秒）
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.1, max_delay: float = 1.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        """第 attempt 次失败后的等待时间"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+# 视为上游故障的异常：网络错误、超时、上游5xx
+RETRYABLE_ERRORS = (httpx.TransportError, asyncio.TimeoutError, UpstreamError)
+
+# PostgREST 错误体只带 SQLSTATE 或 PGRST 错误码，不带HTTP状态；
+# 以下是 PostgREST 映射为5xx的错误：连接失败、连接池超时、语句超时、资源不足、服务端内部错误
+SERVER_ERROR_SQLSTATE_CLASSES = ("08", "40", "53", "54", "55", "57", "58", "XX", "F0", "HV")
+SERVER_ERROR_PGRST_CODES = ("PGRST000", "PGRST001", "PGRST002", "PGRST003")
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """是否计入熔断：网络错误、超时和上游5xx；4xx等业务错误原样返回给调用方，不计入"""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    if APIError is not None and isinstance(error, APIError):
+        code = str(error.code or "")
+        if len(code) == 3 and code.isdigit():
+            # 错误体不是JSON（如网关返回的502页面）时 code 为HTTP状态码
+            return int(code) >= 500
+        return code in SERVER_ERROR_PGRST_CODES or code[:2] in SERVER_ERROR_SQLSTATE_CLASSES
+    return False
+
+
+class Upstream:
+    """
+    单个上游服务的容错包装
+
+    Args:
+        name: 上游名称
+        timeout: 单次请求超时（秒）
+        breaker: 熔断器
+        retry: 重试策略（只用于幂等请求）
+    """
+
+    def __init__(self, name: str, timeout: float, breaker: Optional[CircuitBreaker] = None, retry: Optional[RetryPolicy] = None):
+        self.name = name
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.retry = retry or RetryPolicy()
+        self.calls = 0
+        self.retries = 0
+        self.fallbacks = 0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享的HTTP客户端（连接复用），超时由 call() 统一控制"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 2.0)),
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _reject(self) -> UpstreamUnavailable:
+        return UpstreamUnavailable(self.name, "熔断中，暂停调用", self.breaker.retry_after())
+
+    async def call(self, fn: Callable[[], Awaitable[T]], idempotent: bool = True) -> T:
+        """
+        调用上游（异步）
+
+        Args:
+            fn: 发起请求的协程工厂，每次重试重新调用
+            idempotent: 是否幂等，非幂等请求不重试
+
+        Raises:
+            UpstreamUnavailable: 熔断中或重试耗尽
+            其他异常: 非上游故障类错误原样抛出
+        """
+        attempts = self.retry.attempts if idempotent else 1
+        last_error: Optional[BaseException] = None
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise self._reject()
+            self.calls += 1
+            try:
+                with timed(f"upstream_{self.name}"):
+                    result = await asyncio.wait_for(fn(), self.timeout)
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                last_error = e
+                logger.warning(f"{self.name} 调用失败（第{attempt + 1}次）: {type(e).__name__} {e}")
+                if attempt + 1 < attempts:
+                    self.retries += 1
+                    await asyncio.sleep(self.retry.delay(attempt))
+                continue
+            except Exception:
+                # 上游有响应，只是业务层面出错（如参数错误、数据格式不符）
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+        raise UpstreamUnavailable(self.name, f"重试{attempts}次后仍失败: {type(last_error).__name__}")
+
+    def call_sync(self, fn: Callable[[], T], idempotent: bool = False) -> T:
+        """
+        调用上游（同步，如Supabase客户端）；超时由客户端自身配置
+        幂等请求按重试策略重试，退避期间阻塞当前线程（退避上限为1秒）；
+        请求和退避都会阻塞，异步代码中须放到线程池执行（run_in_threadpool / asyncio.to_thread）
+
+        Raises:
+            UpstreamUnavailable: 熔断中
+            其他异常: 重试耗尽后抛出最后一次的错误，非上游故障类错误原样抛出
+        """
+        attempts = self.retry.attempts if idempotent else 1
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise self._reject()
+            self.calls += 1
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_upstream_failure(e):
+                    # 上游有响应，只是请求本身有问题（4xx、约束冲突等）
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                logger.warning(f"{self.name} 调用失败（第{attempt + 1}次）: {type(e).__name__} {e}")
+                if attempt + 1 >= attempts:
+                    raise
+                self.retries += 1
+                time.sleep(self.retry.delay(attempt))
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "timeout_seconds": self.timeout,
+            "calls": self.calls,
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+            "breaker": self.breaker.snapshot(),
+        }
+
+
+# ================================
+# 上游注册表
+# ================================
+
+upstreams: Dict[str, Upstream] = {}
+
+
+def register_upstream(name: str, timeout: float, failure_threshold: int = 5, recovery_timeout: float = 30.0, attempts: int = 3) -> Upstream:
+    """创建并登记上游，超时可通过 UPSTREAM_<NAME>_TIMEOUT 环境变量覆盖"""
+    timeout = float(os.getenv(f"UPSTREAM_{name.upper()}_TIMEOUT", str(timeout)))
+    upstream = Upstream(
+        name,
+        timeout,
+        CircuitBreaker(failure_threshold, recovery_timeout),
+        RetryPolicy(attempts),
+    )
+    upstreams[name] = upstream
+    return upstream
+
+
+def upstreams_snapshot() -> Dict[str, Dict[str, Any]]:
+    """所有上游的状态，用于健康检查和指标输出"""
+    return {name: upstream.snapshot() for name, upstream in upstreams.items()}
+
+
+async def close_upstreams() -> None:
+    """关闭所有上游的HTTP客户端"""
+    for upstream in upstreams.values():
+        await upstream.aclose()
@@ -0,0 +1,275 @@
+"""
+打赏回调入库模块
+接收微信/支付宝支付回调，去重后批量写入 rewards 表
+
+- 写库后应答：回调在队列中等待所在批次提交，提交成功后才向支付平台返回成功；
+  写库失败、超时或进程在提交前退出时支付平台收不到成功响应，会按自己的策略重试
+- 幂等：(支付方式, 交易号, 状态) 作为幂等键，同一状态的重复回调在内存中短路，
+  入库中的重复回调等待同一结果；内存记录过期或进程重启后，由数据库唯一约束兜底
+- 状态推进：同一交易的后续回调（如 pending -> completed）更新已有记录，由统计触发器计入收益
+- 冲突：交易号已被打赏人、便签或金额不一致的记录占用，或该用户对该便签已有其他已支付的交易时，
+  不写入并向支付平台返回失败，回调会被重试并留下错误日志，不会被当作已处理而丢失
+- 批量写入：一批回调由数据库函数 ingest_rewards 在一个事务中写入，按收款用户排序，
+  多个批次并发时对 user_profiles 的行锁加锁顺序一致，避免死锁和锁等待放大；
+  整批失败时逐条重写，个别无法写入的回调不会拖累同批的其他回调
+"""
+
+import asyncio
+import random
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+from cache import TTLCache
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 单条回调的处理结果
+OUTCOME_STORED = "stored"          # 已写入（新增记录或推进了状态）
+OUTCOME_DUPLICATE = "duplicate"    # 重复回调，之前已写入
+OUTCOME_IGNORED = "ignored"        # 无需写入：便签不存在、状态未变化或已是终态
+OUTCOME_CONFLICT = "conflict"      # 与已有打赏记录不一致，未写入，应让支付平台重试并人工核对
+OUTCOME_FAILED = "failed"          # 写库失败，应让支付平台重试
+
+# ingest_rewards 返回的逐条结果
+DB_STORED = "stored"
+DB_CONFLICT = "conflict"
+IGNORED_REASONS = {
+    "unchanged": "状态未变化或已是终态",
+    "missing": "便签不存在",
+}
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 0.2
+DEFAULT_QUEUE_SIZE = 10000
+
+
+class QueueFullError(Exception):
+    """入库队列已满，回调应返回失败让支付平台稍后重试"""
+
+
+def idempotency_key(payment_method: str, transaction_id: str, status: str) -> str:
+    """与 database/setup.sql 中 ingest_rewards 返回的键格式一致"""
+    return f"{payment_method}:{transaction_id}:{status}"
+
+
+def reward_key(reward: Dict[str, Any]) -> str:
+    return idempotency_key(reward['payment_method'], reward['transaction_id'], reward['status'])
+
+
+class IdempotencyStore:
+    """
+    已入库回调的幂等键
+
+    Args:
+        maxsize: 最多记录的键数
+        ttl: 记录保留时长（秒），应覆盖支付平台的重试窗口
+    """
+
+    def __init__(self, maxsize: int = 100000, ttl: float = 24 * 3600):
+        self._keys = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def is_stored(self, key: str) -> bool:
+        return self._keys.get(key) is not None
+
+    def mark_stored(self, keys: List[str]) -> None:
+        self._keys.set_many({key: True for key in keys})
+
+    def stats(self) -> Dict[str, Any]:
+        return self._keys.stats()
+
+
+class RewardIngestor:
+    """
+    打赏回调批量入库
+
+    Args:
+        writer: 同步写库函数，接收一批打赏记录，返回 {幂等键: 结果}（见 ingest_rewards）；在线程池中执行
+        idempotency: 幂等键存储
+        batch_size: 单批最多写入条数
+        flush_interval: 攒批最长等待时间（秒）
+        queue_size: 队列容量，满时拒绝新回调
+        attempts: 单批写库尝试次数
+        on_stored: 写入成功后的回调，接收本批实际写入的打赏记录
+    """
+
+    def __init__(
+        self,
+        writer: Callable[[List[Dict[str, Any]]], Dict[str, str]],
+        idempotency: Optional[IdempotencyStore] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        attempts: int = 3,
+        on_stored: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ):
+        self.writer = writer
+        self.idempotency = idempotency or IdempotencyStore()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.attempts = attempts
+        self.on_stored = on_stored
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.stored = 0
+        self.ignored = 0
+        self.conflicts = 0
+        self.failed = 0
+
+    def submit(self, reward: Dict[str, Any]) -> asyncio.Future:
+        """
+        接收一条回调
+
+        Returns:
+            结果 Future，所在批次提交后得到 OUTCOME_* 之一；
+            同一回调正在入库时返回同一个 Future。等待时应使用 asyncio.shield，避免取消影响其他等待者
+
+        Raises:
+            QueueFullError: 队列已满
+        """
+        key = reward_key(reward)
+        if self.idempotency.is_stored(key):
+            self.duplicates += 1
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(OUTCOME_DUPLICATE)
+            return future
+        future = self._inflight.get(key)
+        if future is not None:
+            self.duplicates += 1
+            return future
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((reward, future))
+        except asyncio.QueueFull:
+            raise QueueFullError("打赏入库队列已满")
+        self._inflight[key] = future
+        self.accepted += 1
+        return future
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台任务，并写完队列中剩余的回调"""
+        if self._task is not None:
+            # 哨兵排在已入队的回调之后，后台任务写完之前的批次后退出
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+    async def _next_batch(self) -> List[Optional[Tuple[Dict[str, Any], asyncio.Future]]]:
+        """攒一批：拿到第一条后最多再等 flush_interval 秒或攒满 batch_size 条"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            closing = batch[-1] is None
+            entries = [entry for entry in batch if entry is not None]
+            try:
+                await self._flush(entries)
+            except Exception as e:
+                logger.error(f"打赏入库异常: {e}")
+                self._resolve(entries, {}, failed=True)
+            if closing:
+                return
+
+    async def _write(self, rewards: List[Dict[str, Any]], attempts: int) -> Optional[Dict[str, str]]:
+        """写入一批，返回 {幂等键: 结果}；重试耗尽返回 None"""
+        for attempt in range(attempts):
+            try:
+                return await asyncio.to_thread(self.writer, rewards)
+            except Exception as e:
+                logger.warning(f"打赏批量写入失败（第{attempt + 1}次，{len(rewards)}条）: {e}")
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(random.uniform(0, 0.5 * (2 ** attempt)))
+        return None
+
+    async def _flush(self, entries: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        if not entries:
+            return
+        rewards = [reward for reward, _ in entries]
+        written = await self._write(rewards, self.attempts)
+        if written is not None:
+            self.batches += 1
+            self._resolve(entries, written)
+            return
+
+        if len(entries) == 1:
+            self._resolve(entries, {}, failed=True)
+            return
+        # 整批失败（可能是个别回调引用了不存在的用户等），逐条重写，只让写不进去的回调失败
+        logger.error(f"打赏批量写入最终失败，逐条重写{len(entries)}条")
+        for entry in entries:
+            written = await self._write([entry[0]], 1)
+            self._resolve([entry], written or {}, failed=written is None)
+
+    def _resolve(self, entries: List[Tuple[Dict[str, Any], asyncio.Future]], written: Dict[str, str], failed: bool = False) -> None:
+        """记录结果并唤醒等待的回调请求"""
+        stored = []
+        for reward, future in entries:
+            key = reward_key(reward)
+            self._inflight.pop(key, None)
+            if failed:
+                outcome = OUTCOME_FAILED
+                self.failed += 1
+                logger.error(f"打赏回调写入失败，等待支付平台重试: {key}")
+            elif written.get(key) == DB_STORED:
+                outcome = OUTCOME_STORED
+                self.stored += 1
+                stored.append(reward)
+            elif written.get(key) == DB_CONFLICT:
+                outcome = OUTCOME_CONFLICT
+                self.conflicts += 1
+                logger.error(f"打赏回调与已有记录不一致，未写入，等待支付平台重试: {key} {reward}")
+            else:
+                # 便签不存在、状态未变化、已是终态，或同一批中被同一交易的终态回调取代
+                outcome = OUTCOME_IGNORED
+                self.ignored += 1
+                reason = IGNORED_REASONS.get(written.get(key), "同一批中已有该交易的终态回调")
+                logger.warning(f"打赏回调未写入（{reason}）: {key} {reward}")
+            if not future.done():
+                future.set_result(outcome)
+
+        if stored:
+            self.idempotency.mark_stored([reward_key(reward) for reward in stored])
+            if self.on_stored is not None:
+                try:
+                    self.on_stored(stored)
+                except Exception as e:
+                    logger.warning(f"打赏入库通知失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "inflight": len(self._inflight),
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "stored": self.stored,
+            "ignored": self.ignored,
+            "conflicts": self.conflicts,
+            "failed": self.failed,
+            "idempotency": self.idempotency.stats(),
+        }
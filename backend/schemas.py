@@ -0,0 +1,183 @@
+"""
+响应模型与JSON序列化
+定义高频接口的响应模型，并提供基于 orjson 的默认响应类
+
+高频读接口（便签列表/详情/批量、评论列表、增量同步）直接返回 FastJSONResponse：
+FastAPI 对返回的 Response 不做 response_model 校验，也不执行 jsonable_encoder，只有一次 orjson 编码。
+这些接口的响应模型通过 responses={200: {"model": ...}} 登记，只用于 OpenAPI 文档
+"""
+
+import json
+from decimal import Decimal
+from typing import Any, Dict, Generic, List, Optional, TypeVar
+
+import fastapi.routing
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ConfigDict
+
+from profiling import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 未安装时退回标准库
+    orjson = None
+
+T = TypeVar("T")
+
+
+def _json_default(value: Any) -> Any:
+    """orjson 不支持的类型"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def dumps(content: Any) -> bytes:
+    """编码为紧凑的UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 orjson 编码的JSON响应"""
+
+    def render(self, content: Any) -> bytes:
+        with timed("serialize"):
+            return dumps(content)
+
+
+def instrument_serialization() -> None:
+    """
+    把 FastAPI 对路由返回值的处理（response_model 校验、jsonable_encoder）也计入 serialize 阶段
+
+    FastAPI 没有提供对应的钩子，这里替换 fastapi.routing.serialize_response（每次请求时按模块属性查找）；
+    返回字典的路由在 Server-Timing 中显示为 serialize;desc="2x"，耗时为校验/转换与 orjson 编码之和
+    """
+    original = fastapi.routing.serialize_response
+    if getattr(original, "timed", False):
+        return
+
+    async def serialize_response(*args: Any, **kwargs: Any) -> Any:
+        with timed("serialize"):
+            return await original(*args, **kwargs)
+
+    serialize_response.timed = True
+    fastapi.routing.serialize_response = serialize_response
+
+
+# ================================
+# 响应模型
+# ================================
+
+class ApiResponse(BaseModel, Generic[T]):
+    """统一响应包装"""
+    success: bool = True
+    data: T
+    message: str
+
+
+class Pagination(BaseModel):
+    """
+    分页信息
+
+    页码分页返回 page / total / pages；游标分页不统计总数，只返回 next_cursor / has_more
+    """
+    page: Optional[int] = None
+    limit: int
+    total: Optional[int] = None
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
+    has_more: Optional[bool] = None
+
+
+class UserBrief(BaseModel):
+    nickname: str
+    avatar_url: Optional[str] = None
+
+
+class CommentOut(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    id: str
+    post_id: Optional[str] = None
+    user_id: Optional[str] = None
+    content: Optional[str] = None
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    user_profiles: Optional[UserBrief] = None
+
+
+class PostOut(BaseModel):
+    """
+    便签
+
+    除 id 外的字段都可能被 fields / view 参数裁剪，未返回的字段不会出现在响应中；
+    created_at 保持数据库返回的ISO字符串，避免解析再格式化；
+    location_data / weather_data 为任意JSON，不做逐字段校验
+    """
+    model_config = ConfigDict(extra="allow")
+
+    id: str
+    user_id: Optional[str] = None
+    content: Optional[str] = None
+    image_url: Optional[str] = None
+    audio_url: Optional[str] = None
+    location_data: Optional[Dict[str, Any]] = None
+    weather_data: Optional[Dict[str, Any]] = None
+    # compact 视图从JSONB中提取的值
+    location_name: Optional[str] = None
+    weather_icon: Optional[str] = None
+    likes_count: Optional[int] = None
+    comments_count: Optional[int] = None
+    rewards_count: Optional[int] = None
+    rewards_amount: Optional[float] = None
+    created_at: Optional[str] = None
+    user_profiles: Optional[UserBrief] = None
+    is_liked: Optional[bool] = None
+    # preview_comments > 0 时附带的前K条评论
+    comments_preview: Optional[List[CommentOut]] = None
+
+
+class PostListData(BaseModel):
+    posts: List[PostOut]
+    pagination: Pagination
+
+
+class PostBatchData(BaseModel):
+    posts: List[Optional[PostOut]]
+    missing: List[str]
+    deleted: List[str]
+
+
+class CommentListData(BaseModel):
+    comments: List[CommentOut]
+    pagination: Pagination
+
+
+class PostCounts(BaseModel):
+    """只有点赞/评论数变化的便签"""
+    id: str
+    likes_count: int
+    comments_count: int
+
+
+class SyncDeleted(BaseModel):
+    posts: List[str]
+    comments: List[str]
+
+
+class SyncData(BaseModel):
+    """
+    增量同步
+
+    reset 为 true 时令牌缺失或已过期，客户端应丢弃本地数据，用 next_token 之后的列表接口全量加载；
+    has_more 为 true 时应立即用 next_token 继续同步
+    """
+    posts: List[PostOut]
+    post_counts: List[PostCounts]
+    comments: List[CommentOut]
+    deleted: SyncDeleted
+    next_token: str
+    has_more: bool
+    reset: bool = False
@@ -0,0 +1,278 @@
+"""
+后台任务队列
+发布便签后的附加处理（地理/天气补全、缓存预热、索引等）放到后台异步执行，不阻塞请求
+
+- 持久化：任务存放在数据库 job_queue 表（发件箱），进程崩溃后未完成的任务会在租约过期后被重新领取
+- 领取：claim_jobs 使用 FOR UPDATE SKIP LOCKED，多个实例并发领取互不阻塞
+- 重试：失败后按 full jitter 指数退避重新排队，超过最大次数后标记为 failed
+- 并发：每种任务类型单独限制同时执行的数量
+"""
+
+import asyncio
+import os
+import random
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import logging
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+DEFAULT_POLL_INTERVAL = float(os.getenv("TASK_QUEUE_POLL_INTERVAL", "1.0"))
+DEFAULT_LEASE_SECONDS = int(os.getenv("TASK_QUEUE_LEASE_SECONDS", "60"))
+# 队列深度统计的刷新间隔（秒）
+DEPTH_REFRESH_INTERVAL = 15.0
+
+
+class SupabaseJobStore:
+    """
+    job_queue 表的读写，全部通过数据库函数完成（同步调用，由队列放到线程池执行）
+
+    Args:
+        client: Supabase客户端
+        execute: 执行查询的函数，默认直接调用 .execute()
+    """
+
+    def __init__(self, client, execute: Optional[Callable] = None):
+        self.client = client
+        self.execute = execute or (lambda query: query.execute())
+
+    def enqueue(self, job_type: str, payload: Dict[str, Any], max_attempts: Optional[int] = None) -> None:
+        row = {'job_type': job_type, 'payload': payload}
+        if max_attempts is not None:
+            row['max_attempts'] = max_attempts
+        self.execute(self.client.table('job_queue').insert(row, returning='minimal'))
+
+    def claim(self, job_type: str, limit: int, worker_id: str, lease_seconds: int) -> List[Dict[str, Any]]:
+        response = self.execute(self.client.rpc('claim_jobs', {
+            'p_job_type': job_type,
+            'p_limit': limit,
+            'p_worker_id': worker_id,
+            'p_lease_seconds': lease_seconds,
+        }))
+        return response.data or []
+
+    def complete(self, job_id: int) -> None:
+        self.execute(self.client.rpc('complete_job', {'p_job_id': job_id}))
+
+    def fail(self, job_id: int, error: str, retry_in_seconds: Optional[float]) -> None:
+        """retry_in_seconds 为 None 表示不再重试"""
+        self.execute(self.client.rpc('fail_job', {
+            'p_job_id': job_id,
+            'p_error': error[:1000],
+            'p_retry_in_seconds': retry_in_seconds,
+        }))
+
+    def depth(self) -> List[Dict[str, Any]]:
+        response = self.execute(self.client.rpc('job_queue_depth'))
+        return response.data or []
+
+
+class JobType:
+    """
+    任务类型配置
+
+    Args:
+        handler: 异步处理函数，接收任务 payload，抛出异常表示失败
+        concurrency: 本实例同时执行的最大数量
+        max_attempts: 最大尝试次数（入队时未指定时使用）
+        base_delay: 重试退避基数（秒）
+        max_delay: 单次退避上限（秒）
+        timeout: 单次执行超时（秒），应小于租约时长
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: JobHandler,
+        concurrency: int = 4,
+        max_attempts: int = 5,
+        base_delay: float = 2.0,
+        max_delay: float = 300.0,
+        timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.running = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次失败后的等待时间"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def snapshot(self) -> Dict[str, Any]:
+        finished = self.succeeded + self.failed + self.retried
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+            "avg_seconds": round(self.total_seconds / finished, 3) if finished else 0.0,
+        }
+
+
+class TaskQueue:
+    """
+    进程内任务调度
+
+    Args:
+        store: 任务存储
+        poll_interval: 空闲时轮询间隔（秒）
+        lease_seconds: 领取后的租约时长，超过后未完成的任务可被其他实例重新领取
+    """
+
+    def __init__(self, store, poll_interval: float = DEFAULT_POLL_INTERVAL, lease_seconds: int = DEFAULT_LEASE_SECONDS):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.job_types: Dict[str, JobType] = {}
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running: set = set()
+        self._depth: List[Dict[str, Any]] = []
+        self._depth_updated_at = 0.0
+
+    def register(self, name: str, handler: JobHandler, **options) -> JobType:
+        """登记任务类型，options 见 JobType"""
+        options.setdefault("timeout", self.lease_seconds * 0.8)
+        job_type = JobType(name, handler, **options)
+        self.job_types[name] = job_type
+        return job_type
+
+    def handler(self, name: str, **options) -> Callable[[JobHandler], JobHandler]:
+        """装饰器形式的 register"""
+        def decorator(fn: JobHandler) -> JobHandler:
+            self.register(name, fn, **options)
+            return fn
+        return decorator
+
+    async def enqueue(self, job_type: str, payload: Dict[str, Any], max_attempts: Optional[int] = None) -> None:
+        """从应用代码入队（数据库触发器也可直接写入 job_queue）"""
+        await asyncio.to_thread(self.store.enqueue, job_type, payload, max_attempts)
+        self.notify()
+
+    def notify(self) -> None:
+        """有新任务时提前唤醒调度循环"""
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._dispatcher is None and self.job_types:
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        停止领取新任务，等待执行中的任务结束；超过 timeout 仍未结束的任务会被取消，
+        租约过期后由其他实例重新领取（不取消的话本实例会在租约过期后继续执行，同一任务可能被执行两次）
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        if self._running:
+            _, pending = await asyncio.wait(self._running, timeout=timeout)
+            if pending:
+                logger.warning(f"{len(pending)}个任务在{timeout}秒内未结束，已取消，租约过期后重新执行")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            claimed = 0
+            try:
+                claimed = await self._claim_all()
+                await self._refresh_depth()
+            except Exception as e:
+                logger.warning(f"任务领取失败: {e}")
+            if claimed:
+                # 可能还有积压，立即再领一轮（有空闲并发时）
+                await asyncio.sleep(0)
+                if any(job_type.running < job_type.concurrency for job_type in self.job_types.values()):
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim_all(self) -> int:
+        claimed = 0
+        for job_type in self.job_types.values():
+            free = job_type.concurrency - job_type.running
+            if free <= 0:
+                continue
+            jobs = await asyncio.to_thread(self.store.claim, job_type.name, free, self.worker_id, self.lease_seconds)
+            for job in jobs:
+                job_type.running += 1
+                task = asyncio.create_task(self._execute(job_type, job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            claimed += len(jobs)
+        return claimed
+
+    async def _execute(self, job_type: JobType, job: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(job_type.handler(job.get('payload') or {}), job_type.timeout)
+        except Exception as e:
+            attempts = job.get('attempts', 1)
+            max_attempts = job.get('max_attempts') or job_type.max_attempts
+            error = f"{type(e).__name__}: {e}"
+            if attempts >= max_attempts:
+                job_type.failed += 1
+                logger.error(f"任务 {job_type.name}#{job['id']} 第{attempts}次失败，不再重试: {error}")
+                retry_in = None
+            else:
+                job_type.retried += 1
+                retry_in = job_type.backoff(attempts)
+                logger.warning(f"任务 {job_type.name}#{job['id']} 第{attempts}次失败，{retry_in:.1f}秒后重试: {error}")
+            await self._report(self.store.fail, job['id'], error, retry_in)
+        else:
+            job_type.succeeded += 1
+            await self._report(self.store.complete, job['id'])
+        finally:
+            job_type.running -= 1
+            job_type.total_seconds += time.perf_counter() - started
+            # 有并发名额空出，唤醒调度循环领取下一批
+            self.notify()
+
+    async def _report(self, fn: Callable, *args) -> None:
+        """回写任务结果；失败时不抛出，租约过期后任务会被重新领取"""
+        try:
+            await asyncio.to_thread(fn, *args)
+        except Exception as e:
+            logger.warning(f"任务结果回写失败: {e}")
+
+    async def _refresh_depth(self) -> None:
+        now = time.monotonic()
+        if now - self._depth_updated_at < DEPTH_REFRESH_INTERVAL:
+            return
+        self._depth_updated_at = now
+        self._depth = await asyncio.to_thread(self.store.depth)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "job_types": {name: job_type.snapshot() for name, job_type in self.job_types.items()},
+            "depth": self._depth,
+        }
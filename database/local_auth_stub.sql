@@ -0,0 +1,23 @@
+-- ================================
+-- 生活小确幸 - 本地Postgres的 Supabase auth 模拟
+-- ================================
+-- 只用于在本地普通 Postgres 上调试 DB_BACKEND=asyncpg，Supabase 项目中不要执行
+-- 提供 setup.sql 依赖的 auth.users 表和 auth.uid() 函数：
+--   createdb little_joys
+--   psql little_joys -f database/local_auth_stub.sql -f database/setup.sql
+--   DB_BACKEND=asyncpg DATABASE_URL=postgresql://localhost/little_joys python main.py
+
+CREATE SCHEMA IF NOT EXISTS auth;
+
+CREATE TABLE IF NOT EXISTS auth.users (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    email TEXT,
+    raw_user_meta_data JSONB DEFAULT '{}'::jsonb,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 读取 SET request.jwt.claim.sub = '<uuid>' 设置的用户，未设置时为 NULL
+CREATE OR REPLACE FUNCTION auth.uid()
+RETURNS UUID AS $$
+    SELECT NULLIF(current_setting('request.jwt.claim.sub', true), '')::uuid;
+$$ LANGUAGE sql STABLE;
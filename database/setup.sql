@@ -72,10 +72,21 @@ CREATE TABLE IF NOT EXISTS posts (
 );
 
 -- 创建索引
+-- 路由的读取都带 is_deleted = FALSE：只为未删除的便签建部分索引，排序列后加 id 保证分页顺序稳定
+-- （与 backend/check_query_plans.py 检查的查询形态一一对应）
+DROP INDEX IF EXISTS idx_posts_created_at;
+DROP INDEX IF EXISTS idx_posts_hotness;
+DROP INDEX IF EXISTS idx_posts_is_deleted;
+-- 最新动态流
+CREATE INDEX IF NOT EXISTS idx_posts_live_created_at ON posts(created_at DESC, id) WHERE is_deleted = FALSE;
+-- 最热动态流
+CREATE INDEX IF NOT EXISTS idx_posts_live_likes ON posts(likes_count DESC, id) WHERE is_deleted = FALSE;
+-- 个人主页
+CREATE INDEX IF NOT EXISTS idx_posts_live_user_created_at ON posts(user_id, created_at DESC, id) WHERE is_deleted = FALSE;
+-- 删除用户时 ON DELETE CASCADE 按外键列查找便签，级联查询不能使用部分索引
 CREATE INDEX IF NOT EXISTS idx_posts_user_id ON posts(user_id);
-CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts(created_at DESC);
-CREATE INDEX IF NOT EXISTS idx_posts_hotness ON posts((likes_count + rewards_count) DESC);
-CREATE INDEX IF NOT EXISTS idx_posts_is_deleted ON posts(is_deleted);
+-- 批量导出（backend/bulk_io.py）按 (created_at, id) 升序键集分页，可包含已删除的便签
+CREATE INDEX IF NOT EXISTS idx_posts_created_at_id ON posts(created_at, id);
 
 -- 添加更新触发器
 CREATE TRIGGER update_posts_updated_at
@@ -95,8 +106,9 @@ CREATE TABLE IF NOT EXISTS likes (
 );
 
 -- 创建索引
+-- 点赞状态查询（user_id = ? AND post_id IN ...）直接使用 UNIQUE(user_id, post_id) 的索引
+DROP INDEX IF EXISTS idx_likes_user_id;
 CREATE INDEX IF NOT EXISTS idx_likes_post_id ON likes(post_id);
-CREATE INDEX IF NOT EXISTS idx_likes_user_id ON likes(user_id);
 CREATE INDEX IF NOT EXISTS idx_likes_created_at ON likes(created_at);
 
 -- 创建点赞数量自动更新触发器
@@ -133,9 +145,13 @@ CREATE TABLE IF NOT EXISTS comments (
 );
 
 -- 创建索引
-CREATE INDEX IF NOT EXISTS idx_comments_post_id_created_at ON comments(post_id, created_at);
+-- 评论列表、游标分页、预览评论都按 (created_at, id) 读取某条便签下未删除的评论
+DROP INDEX IF EXISTS idx_comments_post_id_created_at;
+DROP INDEX IF EXISTS idx_comments_is_deleted;
+CREATE INDEX IF NOT EXISTS idx_comments_live_post_created_at ON comments(post_id, created_at, id) WHERE is_deleted = FALSE;
+-- 外键列保留非部分索引，供删除便签/用户时的 ON DELETE CASCADE 使用
+CREATE INDEX IF NOT EXISTS idx_comments_post_id ON comments(post_id);
 CREATE INDEX IF NOT EXISTS idx_comments_user_id ON comments(user_id);
-CREATE INDEX IF NOT EXISTS idx_comments_is_deleted ON comments(is_deleted);
 
 -- 添加更新触发器
 CREATE TRIGGER update_comments_updated_at
@@ -168,6 +184,27 @@ CREATE TRIGGER update_comments_count_trigger
     FOR EACH ROW
     EXECUTE FUNCTION update_post_comments_count();
 
+-- 便签流预览评论：一次查询取出多条便签各自最早的 per_post 条评论
+CREATE OR REPLACE FUNCTION get_comment_previews(post_ids UUID[], per_post INTEGER DEFAULT 3)
+RETURNS TABLE (
+    id UUID,
+    post_id UUID,
+    user_id UUID,
+    content TEXT,
+    created_at TIMESTAMPTZ
+) AS $$
+    SELECT ranked.id, ranked.post_id, ranked.user_id, ranked.content, ranked.created_at
+    FROM (
+        SELECT c.id, c.post_id, c.user_id, c.content, c.created_at,
+               row_number() OVER (PARTITION BY c.post_id ORDER BY c.created_at, c.id) AS rn
+        FROM comments c
+        WHERE c.post_id = ANY(post_ids)
+          AND c.is_deleted = FALSE
+    ) ranked
+    WHERE ranked.rn <= per_post
+    ORDER BY ranked.post_id, ranked.created_at, ranked.id;
+$$ LANGUAGE sql STABLE;
+
 -- ================================
 -- 5. 打赏记录表
 -- ================================
@@ -179,16 +216,20 @@ CREATE TABLE IF NOT EXISTS rewards (
     amount DECIMAL(10,2) NOT NULL DEFAULT 1.00 CHECK (amount > 0),
     payment_method VARCHAR(20) NOT NULL CHECK (payment_method IN ('wechat', 'alipay')),
     transaction_id VARCHAR(100) NOT NULL,
-    status VARCHAR(20) DEFAULT 'completed' CHECK (status IN ('pending', 'completed', 'failed')),
+    status VARCHAR(20) DEFAULT 'pending' CHECK (status IN ('pending', 'completed', 'failed')),
     created_at TIMESTAMPTZ DEFAULT NOW(),
     UNIQUE(from_user_id, post_id)
 );
+-- 客户端创建的打赏未经支付验证，默认 pending，只有支付回调能改为 completed
+ALTER TABLE rewards ALTER COLUMN status SET DEFAULT 'pending';
 
 -- 创建索引
 CREATE INDEX IF NOT EXISTS idx_rewards_to_user_created_at ON rewards(to_user_id, created_at);
 CREATE INDEX IF NOT EXISTS idx_rewards_from_user_id ON rewards(from_user_id);
 CREATE INDEX IF NOT EXISTS idx_rewards_post_id ON rewards(post_id);
-CREATE INDEX IF NOT EXISTS idx_rewards_transaction_id ON rewards(transaction_id);
+-- 同一支付平台的交易号唯一，支付回调重复投递时由该约束去重
+DROP INDEX IF EXISTS idx_rewards_transaction_id;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_rewards_payment_transaction ON rewards(payment_method, transaction_id);
 CREATE INDEX IF NOT EXISTS idx_rewards_status ON rewards(status);
 
 -- 创建打赏数量和金额自动更新触发器
@@ -238,6 +279,212 @@ CREATE TRIGGER update_rewards_stats_trigger
     FOR EACH ROW
     EXECUTE FUNCTION update_post_rewards_stats();
 
+-- 支付回调批量入库：一个事务写入一批打赏
+-- 收款用户取自便签作者；按收款用户排序写入，使并发批次对 user_profiles 的加锁顺序一致；
+-- 交易号已存在时推进状态（如 pending -> completed），由统计触发器计入收益；不会退回 pending。
+-- 已有记录的打赏人、便签、金额必须与回调一致，否则不改动（防止客户端抢先用他人的交易号创建记录）。
+-- 该用户对该便签已有其他交易号的 pending 打赏时，以支付平台验证过的回调为准改写这条记录
+-- 每条回调返回一行 (幂等键 payment_method:transaction_id:status, 结果)，结果为：
+--   stored     已写入（新增或推进了状态）
+--   unchanged  无需写入：状态未变化、已是终态，或该用户对该便签已有打赏时收到的 pending 回调
+--   missing    便签不存在
+--   conflict   与已有记录不一致：交易号已被其他打赏人/便签/金额占用，或该用户对该便签已有其他交易的非 pending 打赏
+CREATE OR REPLACE FUNCTION ingest_reward_rows(rows JSONB)
+RETURNS TABLE (
+    from_user_id UUID,
+    post_id UUID,
+    amount DECIMAL(10,2),
+    payment_method VARCHAR(20),
+    transaction_id VARCHAR(100),
+    status VARCHAR(20),
+    paid_at TIMESTAMPTZ
+) AS $$
+    -- 同一交易在一批中有多个状态时只保留终态，避免同一行在一条语句中被更新两次
+    SELECT DISTINCT ON (r.payment_method, r.transaction_id)
+           r.from_user_id, r.post_id, r.amount, r.payment_method, r.transaction_id,
+           COALESCE(r.status, 'completed'), COALESCE(r.paid_at, NOW())
+    FROM jsonb_to_recordset(rows) AS r(
+        from_user_id UUID,
+        post_id UUID,
+        amount DECIMAL(10,2),
+        payment_method VARCHAR(20),
+        transaction_id VARCHAR(100),
+        status VARCHAR(20),
+        paid_at TIMESTAMPTZ
+    )
+    ORDER BY r.payment_method, r.transaction_id, COALESCE(r.status, 'completed') = 'pending';
+$$ LANGUAGE sql STABLE;
+
+DROP FUNCTION IF EXISTS ingest_rewards(JSONB);
+CREATE OR REPLACE FUNCTION ingest_rewards(rows JSONB)
+RETURNS TABLE (idempotency_key TEXT, outcome TEXT) AS $$
+DECLARE
+    stored_keys TEXT[];
+    inserted_keys TEXT[];
+BEGIN
+    -- 已付款的回调对应用户在该便签上另一笔未支付（pending）的打赏：改写为本次交易
+    WITH reconciled AS (
+        UPDATE rewards pending_reward SET
+            payment_method = i.payment_method,
+            transaction_id = i.transaction_id,
+            amount = i.amount,
+            status = i.status,
+            created_at = i.paid_at
+        FROM ingest_reward_rows(rows) i
+        WHERE pending_reward.from_user_id = i.from_user_id
+          AND pending_reward.post_id = i.post_id
+          AND pending_reward.status = 'pending'
+          AND i.status <> 'pending'
+          AND (pending_reward.payment_method, pending_reward.transaction_id) <> (i.payment_method, i.transaction_id)
+          AND NOT EXISTS (
+              SELECT 1 FROM rewards taken
+              WHERE taken.payment_method = i.payment_method AND taken.transaction_id = i.transaction_id
+          )
+        RETURNING pending_reward.payment_method || ':' || pending_reward.transaction_id || ':' || pending_reward.status AS key
+    )
+    SELECT COALESCE(array_agg(key), '{}') INTO stored_keys FROM reconciled;
+
+    WITH inserted AS (
+        INSERT INTO rewards AS existing (from_user_id, to_user_id, post_id, amount, payment_method, transaction_id, status, created_at)
+        SELECT i.from_user_id, p.user_id, i.post_id, i.amount, i.payment_method, i.transaction_id, i.status, i.paid_at
+        FROM ingest_reward_rows(rows) i
+        JOIN posts p ON p.id = i.post_id
+        -- 每人每条便签限一次：已有其他交易的打赏时跳过，否则会违反 UNIQUE(from_user_id, post_id) 使整批失败
+        WHERE NOT EXISTS (
+            SELECT 1 FROM rewards other
+            WHERE other.from_user_id = i.from_user_id
+              AND other.post_id = i.post_id
+              AND (other.payment_method, other.transaction_id) <> (i.payment_method, i.transaction_id)
+        )
+        ORDER BY p.user_id, i.post_id
+        ON CONFLICT (payment_method, transaction_id) DO UPDATE
+            SET status = EXCLUDED.status
+            WHERE existing.status <> EXCLUDED.status AND EXCLUDED.status <> 'pending'
+              AND existing.from_user_id = EXCLUDED.from_user_id
+              AND existing.post_id = EXCLUDED.post_id
+              AND existing.amount = EXCLUDED.amount
+        RETURNING existing.payment_method || ':' || existing.transaction_id || ':' || existing.status AS key
+    )
+    SELECT COALESCE(array_agg(key), '{}') INTO inserted_keys FROM inserted;
+    stored_keys := stored_keys || inserted_keys;
+
+    RETURN QUERY
+    SELECT i.payment_method || ':' || i.transaction_id || ':' || i.status,
+           CASE
+               WHEN i.payment_method || ':' || i.transaction_id || ':' || i.status = ANY(stored_keys) THEN 'stored'
+               WHEN p.id IS NULL THEN 'missing'
+               WHEN existing.id IS NULL THEN CASE WHEN i.status = 'pending' THEN 'unchanged' ELSE 'conflict' END
+               WHEN existing.from_user_id <> i.from_user_id
+                 OR existing.post_id <> i.post_id
+                 OR existing.amount <> i.amount THEN 'conflict'
+               ELSE 'unchanged'
+           END
+    FROM ingest_reward_rows(rows) i
+    LEFT JOIN posts p ON p.id = i.post_id
+    LEFT JOIN rewards existing
+        ON existing.payment_method = i.payment_method AND existing.transaction_id = i.transaction_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 打赏日汇总表：收益统计按天读取汇总行，不扫描 rewards 明细
+-- 日期按北京时间（Asia/Shanghai）划分
+CREATE TABLE IF NOT EXISTS reward_daily_user_stats (
+    to_user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    rewards_count INTEGER NOT NULL DEFAULT 0,
+    rewards_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (to_user_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS reward_daily_post_stats (
+    post_id UUID NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    to_user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    rewards_count INTEGER NOT NULL DEFAULT 0,
+    rewards_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (post_id, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_reward_daily_post_stats_user_day ON reward_daily_post_stats(to_user_id, day);
+
+-- 把一笔打赏的增量（+1 / -1）累加到日汇总
+CREATE OR REPLACE FUNCTION apply_reward_rollup(r rewards, sign INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    reward_day DATE := (r.created_at AT TIME ZONE 'Asia/Shanghai')::DATE;
+BEGIN
+    INSERT INTO reward_daily_user_stats (to_user_id, day, rewards_count, rewards_amount)
+    VALUES (r.to_user_id, reward_day, sign, sign * r.amount)
+    ON CONFLICT (to_user_id, day) DO UPDATE SET
+        rewards_count = reward_daily_user_stats.rewards_count + EXCLUDED.rewards_count,
+        rewards_amount = reward_daily_user_stats.rewards_amount + EXCLUDED.rewards_amount;
+
+    INSERT INTO reward_daily_post_stats (post_id, day, to_user_id, rewards_count, rewards_amount)
+    VALUES (r.post_id, reward_day, r.to_user_id, sign, sign * r.amount)
+    ON CONFLICT (post_id, day) DO UPDATE SET
+        rewards_count = reward_daily_post_stats.rewards_count + EXCLUDED.rewards_count,
+        rewards_amount = reward_daily_post_stats.rewards_amount + EXCLUDED.rewards_amount;
+END;
+$$ language 'plpgsql';
+
+-- 只有 completed 状态的打赏计入汇总，与 update_post_rewards_stats 保持一致
+CREATE OR REPLACE FUNCTION update_reward_rollups()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.status = 'completed' THEN
+            PERFORM apply_reward_rollup(NEW, 1);
+        END IF;
+    ELSIF TG_OP = 'UPDATE' THEN
+        IF OLD.status = 'completed' THEN
+            PERFORM apply_reward_rollup(OLD, -1);
+        END IF;
+        IF NEW.status = 'completed' THEN
+            PERFORM apply_reward_rollup(NEW, 1);
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        IF OLD.status = 'completed' THEN
+            PERFORM apply_reward_rollup(OLD, -1);
+        END IF;
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER update_reward_rollups_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON rewards
+    FOR EACH ROW
+    EXECUTE FUNCTION update_reward_rollups();
+
+-- 从明细重建日汇总（首次上线回填，或修复偏差）；from_day 为空时全量重建
+CREATE OR REPLACE FUNCTION rebuild_reward_rollups(from_day DATE DEFAULT NULL)
+RETURNS VOID AS $$
+BEGIN
+    -- 重建期间阻止打赏写入，避免触发器的增量和重建结果重复或遗漏
+    LOCK TABLE rewards IN SHARE MODE;
+    DELETE FROM reward_daily_user_stats WHERE from_day IS NULL OR day >= from_day;
+    DELETE FROM reward_daily_post_stats WHERE from_day IS NULL OR day >= from_day;
+
+    INSERT INTO reward_daily_user_stats (to_user_id, day, rewards_count, rewards_amount)
+    SELECT to_user_id, (created_at AT TIME ZONE 'Asia/Shanghai')::DATE, COUNT(*), SUM(amount)
+    FROM rewards
+    WHERE status = 'completed'
+      AND (from_day IS NULL OR (created_at AT TIME ZONE 'Asia/Shanghai')::DATE >= from_day)
+    GROUP BY 1, 2;
+
+    INSERT INTO reward_daily_post_stats (post_id, day, to_user_id, rewards_count, rewards_amount)
+    SELECT post_id, (created_at AT TIME ZONE 'Asia/Shanghai')::DATE, to_user_id, COUNT(*), SUM(amount)
+    FROM rewards
+    WHERE status = 'completed'
+      AND (from_day IS NULL OR (created_at AT TIME ZONE 'Asia/Shanghai')::DATE >= from_day)
+    GROUP BY 1, 2, 3;
+END;
+$$ language 'plpgsql';
+
+-- 回填已有的打赏：汇总表和触发器就绪后从明细全量重建（重复执行本脚本结果相同）
+SELECT rebuild_reward_rollups();
+
 -- ================================
 -- 6. 支付账号绑定表
 -- ================================
@@ -265,7 +512,467 @@ CREATE TRIGGER update_payment_accounts_updated_at
     EXECUTE FUNCTION update_updated_at_column();
 
 -- ================================
--- 7. 启用RLS (Row Level Security)
+-- 7. 用户统计计数表
+-- ================================
+-- 发布数、收到的点赞/评论/打赏，读取时直接返回，不做聚合
+-- 只统计未删除的便签；点赞、评论、打赏的变化经由 posts 上已有的计数列传导过来
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    posts_count INTEGER NOT NULL DEFAULT 0,
+    likes_received INTEGER NOT NULL DEFAULT 0,
+    comments_received INTEGER NOT NULL DEFAULT 0,
+    rewards_received INTEGER NOT NULL DEFAULT 0,
+    rewards_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- 累加一个用户的计数增量
+CREATE OR REPLACE FUNCTION apply_user_stats_delta(
+    target_user_id UUID,
+    d_posts INTEGER,
+    d_likes INTEGER,
+    d_comments INTEGER,
+    d_rewards INTEGER,
+    d_amount DECIMAL
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO user_stats (user_id, posts_count, likes_received, comments_received, rewards_received, rewards_amount)
+    VALUES (target_user_id, d_posts, d_likes, d_comments, d_rewards, d_amount)
+    ON CONFLICT (user_id) DO UPDATE SET
+        posts_count = user_stats.posts_count + EXCLUDED.posts_count,
+        likes_received = user_stats.likes_received + EXCLUDED.likes_received,
+        comments_received = user_stats.comments_received + EXCLUDED.comments_received,
+        rewards_received = user_stats.rewards_received + EXCLUDED.rewards_received,
+        rewards_amount = user_stats.rewards_amount + EXCLUDED.rewards_amount,
+        updated_at = NOW();
+END;
+$$ language 'plpgsql';
+
+-- posts 的发布/软删除/恢复，以及 likes、comments、rewards 触发器对 posts 计数列的更新，
+-- 都折算成作者统计的增量
+CREATE OR REPLACE FUNCTION update_user_stats_from_posts()
+RETURNS TRIGGER AS $$
+DECLARE
+    target_user_id UUID;
+    d_posts INTEGER := 0;
+    d_likes INTEGER := 0;
+    d_comments INTEGER := 0;
+    d_rewards INTEGER := 0;
+    d_amount DECIMAL(12,2) := 0;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        target_user_id := OLD.user_id;
+    ELSE
+        target_user_id := NEW.user_id;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF NOT OLD.is_deleted THEN
+            d_posts := d_posts - 1;
+            d_likes := d_likes - COALESCE(OLD.likes_count, 0);
+            d_comments := d_comments - COALESCE(OLD.comments_count, 0);
+            d_rewards := d_rewards - COALESCE(OLD.rewards_count, 0);
+            d_amount := d_amount - COALESCE(OLD.rewards_amount, 0);
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NOT NEW.is_deleted THEN
+            d_posts := d_posts + 1;
+            d_likes := d_likes + COALESCE(NEW.likes_count, 0);
+            d_comments := d_comments + COALESCE(NEW.comments_count, 0);
+            d_rewards := d_rewards + COALESCE(NEW.rewards_count, 0);
+            d_amount := d_amount + COALESCE(NEW.rewards_amount, 0);
+        END IF;
+    END IF;
+
+    IF d_posts <> 0 OR d_likes <> 0 OR d_comments <> 0 OR d_rewards <> 0 OR d_amount <> 0 THEN
+        PERFORM apply_user_stats_delta(target_user_id, d_posts, d_likes, d_comments, d_rewards, d_amount);
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER update_user_stats_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF is_deleted, likes_count, comments_count, rewards_count, rewards_amount ON posts
+    FOR EACH ROW
+    EXECUTE FUNCTION update_user_stats_from_posts();
+
+-- 对账：从明细表重新计算所有用户的统计，只改写有偏差的行，返回修正的行数
+-- 使用事务级咨询锁，多个实例同时触发时只有一个会执行
+CREATE OR REPLACE FUNCTION reconcile_user_stats()
+RETURNS INTEGER AS $$
+DECLARE
+    fixed INTEGER := 0;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('reconcile_user_stats')) THEN
+        RETURN 0;
+    END IF;
+
+    WITH live_posts AS (
+        SELECT id, user_id FROM posts WHERE is_deleted = FALSE
+    ),
+    post_counts AS (
+        SELECT user_id, COUNT(*) AS n FROM live_posts GROUP BY user_id
+    ),
+    like_counts AS (
+        SELECT lp.user_id, COUNT(*) AS n
+        FROM likes l JOIN live_posts lp ON lp.id = l.post_id
+        GROUP BY lp.user_id
+    ),
+    comment_counts AS (
+        SELECT lp.user_id, COUNT(*) AS n
+        FROM comments c JOIN live_posts lp ON lp.id = c.post_id
+        WHERE c.is_deleted = FALSE
+        GROUP BY lp.user_id
+    ),
+    reward_sums AS (
+        SELECT lp.user_id, COUNT(*) AS n, SUM(r.amount) AS amount
+        FROM rewards r JOIN live_posts lp ON lp.id = r.post_id
+        WHERE r.status = 'completed'
+        GROUP BY lp.user_id
+    ),
+    users AS (
+        SELECT user_id FROM post_counts
+        UNION
+        SELECT user_id FROM user_stats
+    )
+    INSERT INTO user_stats (user_id, posts_count, likes_received, comments_received, rewards_received, rewards_amount)
+    SELECT u.user_id,
+           COALESCE(pc.n, 0),
+           COALESCE(lc.n, 0),
+           COALESCE(cc.n, 0),
+           COALESCE(rs.n, 0),
+           COALESCE(rs.amount, 0)
+    FROM users u
+    LEFT JOIN post_counts pc ON pc.user_id = u.user_id
+    LEFT JOIN like_counts lc ON lc.user_id = u.user_id
+    LEFT JOIN comment_counts cc ON cc.user_id = u.user_id
+    LEFT JOIN reward_sums rs ON rs.user_id = u.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        posts_count = EXCLUDED.posts_count,
+        likes_received = EXCLUDED.likes_received,
+        comments_received = EXCLUDED.comments_received,
+        rewards_received = EXCLUDED.rewards_received,
+        rewards_amount = EXCLUDED.rewards_amount,
+        updated_at = NOW()
+    WHERE (user_stats.posts_count, user_stats.likes_received, user_stats.comments_received,
+           user_stats.rewards_received, user_stats.rewards_amount)
+        IS DISTINCT FROM
+          (EXCLUDED.posts_count, EXCLUDED.likes_received, EXCLUDED.comments_received,
+           EXCLUDED.rewards_received, EXCLUDED.rewards_amount);
+
+    GET DIAGNOSTICS fixed = ROW_COUNT;
+    RETURN fixed;
+END;
+$$ language 'plpgsql';
+
+-- ================================
+-- 8. 后台任务队列（发件箱）
+-- ================================
+-- 由后端 task_queue.py 的工作协程领取执行；租约过期未完成的任务会被重新领取
+CREATE TABLE IF NOT EXISTS job_queue (
+    id BIGSERIAL PRIMARY KEY,
+    job_type VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    locked_by VARCHAR(100),
+    locked_until TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- 领取只扫描待执行/执行中的任务；成功的任务直接删除，表保持很小
+CREATE INDEX IF NOT EXISTS idx_job_queue_claim ON job_queue(job_type, run_at) WHERE status IN ('pending', 'running');
+
+-- 领取任务：待执行且已到时间的，或执行中但租约已过期的（实例崩溃）
+CREATE OR REPLACE FUNCTION claim_jobs(p_job_type TEXT, p_limit INTEGER, p_worker_id TEXT, p_lease_seconds INTEGER)
+RETURNS SETOF job_queue AS $$
+    UPDATE job_queue SET
+        status = 'running',
+        attempts = attempts + 1,
+        locked_by = p_worker_id,
+        locked_until = NOW() + make_interval(secs => p_lease_seconds),
+        updated_at = NOW()
+    WHERE id IN (
+        SELECT id FROM job_queue
+        WHERE job_type = p_job_type
+          AND ((status = 'pending' AND run_at <= NOW())
+               OR (status = 'running' AND locked_until < NOW()))
+        ORDER BY run_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION complete_job(p_job_id BIGINT)
+RETURNS VOID AS $$
+    DELETE FROM job_queue WHERE id = p_job_id;
+$$ LANGUAGE sql;
+
+-- p_retry_in_seconds 为 NULL 时标记为最终失败，保留记录供排查
+CREATE OR REPLACE FUNCTION fail_job(p_job_id BIGINT, p_error TEXT, p_retry_in_seconds DOUBLE PRECISION)
+RETURNS VOID AS $$
+    UPDATE job_queue SET
+        status = CASE WHEN p_retry_in_seconds IS NULL THEN 'failed' ELSE 'pending' END,
+        run_at = NOW() + make_interval(secs => COALESCE(p_retry_in_seconds, 0)),
+        last_error = p_error,
+        locked_by = NULL,
+        locked_until = NULL,
+        updated_at = NOW()
+    WHERE id = p_job_id;
+$$ LANGUAGE sql;
+
+-- 队列深度：按类型和状态统计数量及最早的待执行时间
+CREATE OR REPLACE FUNCTION job_queue_depth()
+RETURNS TABLE (job_type VARCHAR, status VARCHAR, jobs BIGINT, oldest_run_at TIMESTAMPTZ) AS $$
+    SELECT job_type, status, COUNT(*), MIN(run_at)
+    FROM job_queue
+    GROUP BY job_type, status
+    ORDER BY job_type, status;
+$$ LANGUAGE sql STABLE;
+
+-- 便签发布后的附加处理在同一事务中写入发件箱，create_post 仍然只有一次插入
+-- 只提交了坐标的便签（location_data.enrichment = 'pending'）额外写入位置/天气补全任务
+CREATE OR REPLACE FUNCTION enqueue_post_created_job()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO job_queue (job_type, payload)
+    VALUES ('post.created', jsonb_build_object('post_id', NEW.id, 'user_id', NEW.user_id));
+
+    IF NEW.location_data->>'enrichment' = 'pending' THEN
+        INSERT INTO job_queue (job_type, payload)
+        VALUES ('post.enrich', jsonb_build_object(
+            'post_id', NEW.id,
+            'latitude', NEW.location_data->'coordinates'->'latitude',
+            'longitude', NEW.location_data->'coordinates'->'longitude',
+            'needs_weather', NEW.weather_data IS NULL,
+            'created_at', NEW.created_at
+        ));
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER enqueue_post_created_job_trigger
+    AFTER INSERT ON posts
+    FOR EACH ROW
+    EXECUTE FUNCTION enqueue_post_created_job();
+
+-- ================================
+-- 9. 增量同步变更日志
+-- ================================
+-- posts/comments 的变化由触发器写入 change_log，客户端凭同步令牌只拉取之后变化的实体
+-- 点赞、评论数的变化经由 posts 计数列的更新记录为 post_counts，不单独记录 likes 明细
+CREATE TABLE IF NOT EXISTS change_log (
+    id BIGSERIAL PRIMARY KEY,
+    -- 写入事务的ID：同步只返回已提交的事务，保证令牌之前的变化不会在之后才出现
+    txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    entity VARCHAR(20) NOT NULL CHECK (entity IN ('post', 'post_counts', 'comment')),
+    entity_id UUID NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_change_log_position ON change_log(txid, id);
+CREATE INDEX IF NOT EXISTS idx_change_log_entity ON change_log(entity, entity_id, txid, id);
+
+-- 同步状态（单行）：早于 truncated_before 的变化已被清理，令牌更早的客户端需要全量刷新
+CREATE TABLE IF NOT EXISTS sync_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    truncated_before XID8 NOT NULL DEFAULT '0'::xid8
+);
+INSERT INTO sync_state (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+-- 计数列之外的内容变化（含补全位置/天气、软删除）记为 post，只有点赞/评论数变化记为 post_counts
+CREATE OR REPLACE FUNCTION log_post_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO change_log (entity, entity_id) VALUES ('post', OLD.id);
+        RETURN OLD;
+    END IF;
+
+    IF TG_OP = 'INSERT'
+       OR (to_jsonb(NEW) - ARRAY['likes_count', 'comments_count', 'rewards_count', 'rewards_amount', 'updated_at'])
+          IS DISTINCT FROM
+          (to_jsonb(OLD) - ARRAY['likes_count', 'comments_count', 'rewards_count', 'rewards_amount', 'updated_at']) THEN
+        INSERT INTO change_log (entity, entity_id) VALUES ('post', NEW.id);
+    ELSIF NEW.likes_count IS DISTINCT FROM OLD.likes_count OR NEW.comments_count IS DISTINCT FROM OLD.comments_count THEN
+        INSERT INTO change_log (entity, entity_id) VALUES ('post_counts', NEW.id);
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS log_post_change_trigger ON posts;
+CREATE TRIGGER log_post_change_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON posts
+    FOR EACH ROW
+    EXECUTE FUNCTION log_post_change();
+
+CREATE OR REPLACE FUNCTION log_comment_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO change_log (entity, entity_id) VALUES ('comment', OLD.id);
+        RETURN OLD;
+    END IF;
+    INSERT INTO change_log (entity, entity_id) VALUES ('comment', NEW.id);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS log_comment_change_trigger ON comments;
+CREATE TRIGGER log_comment_change_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON comments
+    FOR EACH ROW
+    EXECUTE FUNCTION log_comment_change();
+
+-- 读取令牌位置 (since_txid, since_id) 之后的变化
+-- 只返回事务ID小于当前快照 xmin 的变化（这些事务都已结束，之后不会再出现更早的记录）；
+-- 同一实体多次变化只返回一次。返回:
+-- {"changes": [{"entity", "entity_id", "txid", "id"}], "horizon": xmin, "truncated": 令牌是否已过期}
+CREATE OR REPLACE FUNCTION get_changes(since_txid TEXT, since_id BIGINT, max_rows INTEGER DEFAULT 500)
+RETURNS JSONB AS $$
+    WITH horizon AS (
+        SELECT pg_snapshot_xmin(pg_current_snapshot()) AS xmin
+    ),
+    window_rows AS (
+        SELECT c.id, c.txid, c.entity, c.entity_id
+        FROM change_log c, horizon h
+        WHERE (c.txid, c.id) > (since_txid::xid8, since_id)
+          AND c.txid < h.xmin
+        ORDER BY c.txid, c.id
+        LIMIT max_rows
+    ),
+    latest AS (
+        SELECT DISTINCT ON (entity, entity_id) entity, entity_id, txid, id
+        FROM window_rows
+        ORDER BY entity, entity_id, txid DESC, id DESC
+    )
+    SELECT jsonb_build_object(
+        'changes', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('entity', entity, 'entity_id', entity_id, 'txid', txid::text, 'id', id) ORDER BY txid, id)
+            FROM latest
+        ), '[]'::jsonb),
+        'rows', (SELECT COUNT(*) FROM window_rows),
+        'last_txid', (SELECT txid::text FROM window_rows ORDER BY txid DESC, id DESC LIMIT 1),
+        'last_id', (SELECT id FROM window_rows ORDER BY txid DESC, id DESC LIMIT 1),
+        'horizon', (SELECT xmin::text FROM horizon),
+        'truncated', since_txid::xid8 <= (SELECT truncated_before FROM sync_state)
+    );
+$$ LANGUAGE sql STABLE;
+
+-- 压缩：删除已被同一实体更新的变化覆盖的记录，以及超过保留期的记录
+-- 只处理已提交事务的记录；返回删除的行数
+CREATE OR REPLACE FUNCTION compact_change_log(retention_days INTEGER DEFAULT 30)
+RETURNS INTEGER AS $$
+DECLARE
+    horizon XID8 := pg_snapshot_xmin(pg_current_snapshot());
+    expired_before XID8;
+    removed INTEGER := 0;
+    n INTEGER;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('compact_change_log')) THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM change_log c
+    WHERE c.txid < horizon
+      AND EXISTS (
+          SELECT 1 FROM change_log newer
+          WHERE newer.entity = c.entity
+            AND newer.entity_id = c.entity_id
+            AND (newer.txid, newer.id) > (c.txid, c.id)
+            AND newer.txid < horizon
+      );
+    GET DIAGNOSTICS n = ROW_COUNT;
+    removed := removed + n;
+
+    -- 过期记录删除后，令牌早于被删记录的客户端无法再得到完整的增量
+    SELECT MAX(txid) INTO expired_before
+    FROM change_log
+    WHERE changed_at < NOW() - make_interval(days => retention_days)
+      AND txid < horizon;
+
+    IF expired_before IS NOT NULL THEN
+        UPDATE sync_state SET truncated_before = GREATEST(truncated_before, expired_before);
+        DELETE FROM change_log WHERE txid <= expired_before;
+        GET DIAGNOSTICS n = ROW_COUNT;
+        removed := removed + n;
+    END IF;
+
+    RETURN removed;
+END;
+$$ language 'plpgsql';
+
+-- ================================
+-- 10. 缓存失效通知
+-- ================================
+-- 数据变化时通过 pg_notify 广播 "命名空间:键"，各 worker 监听 cache_invalidation 频道后淘汰进程内缓存
+-- （backend/invalidation.py）；同一事务内相同的通知由 Postgres 自动合并，事务回滚时不会发出
+-- NOTIFY 在提交时需要获取全局锁，只给有进程内缓存订阅的表加触发器（目前只有用户资料）
+CREATE OR REPLACE FUNCTION notify_cache_invalidation()
+RETURNS TRIGGER AS $$
+DECLARE
+    row_data RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := OLD;
+    ELSE
+        row_data := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'user_profiles' THEN
+        PERFORM pg_notify('cache_invalidation', 'profile:' || row_data.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS notify_profile_invalidation_trigger ON user_profiles;
+CREATE TRIGGER notify_profile_invalidation_trigger
+    AFTER UPDATE OR DELETE ON user_profiles
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_cache_invalidation();
+
+-- 便签和评论没有进程内缓存，移除之前版本创建的通知触发器
+DROP TRIGGER IF EXISTS notify_post_invalidation_trigger ON posts;
+DROP TRIGGER IF EXISTS notify_comment_invalidation_trigger ON comments;
+
+-- ================================
+-- 11. 只读副本状态
+-- ================================
+-- 后端读写分离的健康检查（backend/db_router.py）
+-- lsn：主库为当前WAL插入位置（不小于任何已确认提交的事务，包括 synchronous_commit=off 的），
+--      备库为已回放到的位置；以字节偏移返回，便于比较
+-- now：本库的时钟，后端用主库的时钟统一表示写入和回放的时间点
+-- 每轮检查先读主库的 (lsn, now)，备库回放位置越过该 lsn 时才算追平到主库的该时间点；
+-- 不能用"已回放完收到的WAL"判断追平，WAL接收落后时备库也会满足该条件
+CREATE OR REPLACE FUNCTION replica_status()
+RETURNS JSONB AS $$
+    SELECT jsonb_build_object(
+        'is_replica', pg_is_in_recovery(),
+        'lsn', pg_wal_lsn_diff(
+            CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_insert_lsn() END,
+            '0/0'
+        )::bigint,
+        'now', clock_timestamp()
+    );
+$$ LANGUAGE sql VOLATILE;
+
+-- ================================
+-- 12. 启用RLS (Row Level Security)
 -- ================================
 ALTER TABLE user_profiles ENABLE ROW LEVEL SECURITY;
 ALTER TABLE posts ENABLE ROW LEVEL SECURITY;
@@ -273,6 +980,13 @@ ALTER TABLE likes ENABLE ROW LEVEL SECURITY;
 ALTER TABLE comments ENABLE ROW LEVEL SECURITY;
 ALTER TABLE rewards ENABLE ROW LEVEL SECURITY;
 ALTER TABLE payment_accounts ENABLE ROW LEVEL SECURITY;
+ALTER TABLE reward_daily_user_stats ENABLE ROW LEVEL SECURITY;
+ALTER TABLE reward_daily_post_stats ENABLE ROW LEVEL SECURITY;
+ALTER TABLE user_stats ENABLE ROW LEVEL SECURITY;
+-- job_queue、change_log、sync_state 不开放任何策略，只允许后端服务密钥访问
+ALTER TABLE job_queue ENABLE ROW LEVEL SECURITY;
+ALTER TABLE change_log ENABLE ROW LEVEL SECURITY;
+ALTER TABLE sync_state ENABLE ROW LEVEL SECURITY;
 
 -- user_profiles 策略
 DROP POLICY IF EXISTS "Users can view all profiles" ON user_profiles;
@@ -318,7 +1032,17 @@ DROP POLICY IF EXISTS "Users can insert own rewards" ON rewards;
 CREATE POLICY "Users can view rewards they gave or received" ON rewards FOR SELECT USING (
     auth.uid() = from_user_id OR auth.uid() = to_user_id
 );
-CREATE POLICY "Users can insert own rewards" ON rewards FOR INSERT WITH CHECK (auth.uid() = from_user_id);
+CREATE POLICY "Users can insert own rewards" ON rewards FOR INSERT WITH CHECK (auth.uid() = from_user_id AND status = 'pending');
+
+-- 打赏日汇总策略（只读，由触发器维护）
+DROP POLICY IF EXISTS "Users can view own reward stats" ON reward_daily_user_stats;
+DROP POLICY IF EXISTS "Users can view own post reward stats" ON reward_daily_post_stats;
+CREATE POLICY "Users can view own reward stats" ON reward_daily_user_stats FOR SELECT USING (auth.uid() = to_user_id);
+CREATE POLICY "Users can view own post reward stats" ON reward_daily_post_stats FOR SELECT USING (auth.uid() = to_user_id);
+
+-- user_stats 策略（公开只读，由触发器维护）
+DROP POLICY IF EXISTS "Anyone can view user stats" ON user_stats;
+CREATE POLICY "Anyone can view user stats" ON user_stats FOR SELECT USING (true);
 
 -- payment_accounts 策略
 DROP POLICY IF EXISTS "Users can manage own payment accounts" ON payment_accounts;